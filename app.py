@@ -1,37 +1,415 @@
-from flask import Flask, request, jsonify
+from flask import (Blueprint, Flask, Response, current_app, g, has_app_context, request, jsonify,
+                   stream_with_context)
+from werkzeug.http import parse_etags
 from flask_cors import CORS
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-from functools import wraps
+from functools import partial, wraps
 import os
 import jwt
-from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
 import re
-from pymongo import MongoClient
+import base64
+import hashlib
+import math
+import threading
+import time
+import weakref
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from dotenv import load_dotenv
+import atexit
+from caches import LRUCache
+from write_behind import WriteBehindQueue
+from jobs import JOB_BACKENDS, JobQueueFull, TooManyUserJobs, JobRunner, MongoJobStore, MemoryJobStore
+from json_provider import DEFAULT_JSON_ENCODER, json_provider
+import metrics
+from metrics import MongoCommandListener, RequestProfiler, current_route, stage, timed
+from rate_limit import RATE_LIMIT_STORAGES, RateLimiter, MemoryTokenBuckets, SharedTokenBuckets, default_shm_path
+from storage import (DEFAULT_MONGODB_URI, USER_EXISTS_PROJECTION, USER_LOGIN_PROJECTION,
+                     USER_PROFILE_PROJECTION, USER_SUMMARY_PROJECTION, RECENT_RECIPES_PROJECTION, MEAL_PLAN_PROJECTION,
+                     MEAL_PLAN_ETAG_PROJECTION, MEAL_SWAP_PROJECTION, QueryPlanChecker, client_options, create_client,
+                     ensure_indexes)
+from plan_storage import (STORAGE_MODES, MEAL_FORMATS, split_plan_body, cached_bodies, attach_bodies,
+                          is_reference_meal, meal_position, compact_meals, expand_meals, expand_plan_meals)
+from passwords import PasswordHasherBusy, hash_password, verify_password, needs_rehash, rehash_in_background
+from grocery import (GROCERY_CATEGORIES, GroceryAggregator, grocery_item, grocery_names, grocery_quantities,
+                     round_quantity, swap_grocery_items)
+from recipe_catalog import MACRO_FIELDS, MEAL_TYPES, load_catalog, normalize_tag
+from meal_optimizer import (OPTIMIZER_MODES, NoCandidatesError, candidate_pools, optimize_plan, plan_totals,
+                            rank_candidates)
+from variety import variety_penalty
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
+# Routes are registered on the api blueprint; create_app() builds the app
+api = Blueprint('api', __name__)
 
-# Security and rate limiting
-limiter = Limiter(
-    app,
-    key_func=get_remote_address,
-    default_limits=["100 per hour"]
-)
+# Settings create_app() copies into app.config, read from the environment.
+# Keys passed to create_app() override them; the resources built from them
+# (database client, rate limiter, job runner, caches) belong to that app
+# alone, see AppResources.
+DEFAULT_CONFIG = {
+    # Response encoding: 'orjson' (default when installed) or 'stdlib'.  Dates
+    # are RFC 822 ('http', as Flask writes them) unless JSON_DATE_FORMAT=iso,
+    # and non-ASCII characters are escaped unless JSON_ENSURE_ASCII=0.
+    'JSON_ENCODER': os.getenv('JSON_ENCODER', DEFAULT_JSON_ENCODER),
+    'JSON_DATE_FORMAT': os.getenv('JSON_DATE_FORMAT', 'http'),
+    'JSON_ENSURE_ASCII': os.getenv('JSON_ENSURE_ASCII', '1') == '1',
 
-# Database connection (using MongoDB as in the original)
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/mealprep'))
-db = client.mealprep
+    # Database: client pool, timeouts and read preference (see
+    # storage.client_options).  MONGO_QUERY_DEBUG=1 logs queries that are not
+    # served by an index.
+    'MONGODB_URI': os.getenv('MONGODB_URI', DEFAULT_MONGODB_URI),
+    'MONGO_MAX_POOL_SIZE': int(os.getenv('MONGO_MAX_POOL_SIZE', 100)),
+    'MONGO_MIN_POOL_SIZE': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+    'MONGO_MAX_IDLE_TIME_MS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    'MONGO_CONNECT_TIMEOUT_MS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'MONGO_SOCKET_TIMEOUT_MS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+    'MONGO_READ_PREFERENCE': os.getenv('MONGO_READ_PREFERENCE', 'primary'),
+    'MONGO_ENSURE_INDEXES': os.getenv('MONGO_ENSURE_INDEXES', '1') == '1',
+    'MONGO_QUERY_DEBUG': os.getenv('MONGO_QUERY_DEBUG') == '1',
 
-# JWT secret
-JWT_SECRET = os.getenv('JWT_SECRET', 'defaultSecret')
+    # JWT signing secret
+    'JWT_SECRET': os.getenv('JWT_SECRET', 'defaultSecret'),
+
+    # Plan generation: requests above MAX_SYNC_MEALS must run as background
+    # jobs, which are limited to MAX_JOB_MEALS.  MEAL_OPTIMIZER is the
+    # default optimizer mode ('greedy' or 'search').
+    'MAX_SYNC_MEALS': int(os.getenv('MAX_SYNC_MEALS', 200)),
+    'MAX_JOB_MEALS': int(os.getenv('MAX_JOB_MEALS', 5000)),
+    'MEAL_OPTIMIZER': os.getenv('MEAL_OPTIMIZER', 'greedy'),
+
+    # Variety: the last VARIETY_HISTORY recipe ids a user was given are kept
+    # on their users document (0 disables); generation penalizes those
+    # recipes and ones with similar ingredients by the given score amounts
+    'VARIETY_HISTORY': int(os.getenv('VARIETY_HISTORY', 56)),
+    'VARIETY_RECENT_PENALTY': float(os.getenv('VARIETY_RECENT_PENALTY', 1.0)),
+    'VARIETY_SIMILAR_PENALTY': float(os.getenv('VARIETY_SIMILAR_PENALTY', 0.5)),
+
+    # Plan storage: MEAL_PLAN_STORAGE is 'embedded' or 'deduplicated' (bodies
+    # stored once in plan_bodies by content hash); MEAL_FORMAT is 'embedded'
+    # (full meal dicts) or 'reference' (recipe ids plus per-plan overrides,
+    # filled in from the catalog on read)
+    'MEAL_PLAN_STORAGE': os.getenv('MEAL_PLAN_STORAGE', 'embedded'),
+    'MEAL_FORMAT': os.getenv('MEAL_FORMAT', 'embedded'),
+
+    # Meal plan writes: MEAL_PLAN_WRITE_CONCERN is the 'w' value ('1',
+    # 'majority', '0' for unacknowledged) and MEAL_PLAN_WRITE_MODE is 'sync'
+    # or 'write-behind'
+    'MEAL_PLAN_WRITE_CONCERN': os.getenv('MEAL_PLAN_WRITE_CONCERN', '1'),
+    'MEAL_PLAN_WRITE_MODE': os.getenv('MEAL_PLAN_WRITE_MODE', 'sync'),
+    'WRITE_BEHIND_QUEUE_SIZE': int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', 10000)),
+    'WRITE_BEHIND_BATCH_SIZE': int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 100)),
+
+    # Rate limiting: a token bucket per route and client address.  'shared'
+    # keeps the buckets in a memory-mapped file used by every worker process
+    # on the host, 'memory' per app; 'off' disables limiting.
+    'RATE_LIMIT_STORAGE': os.getenv('RATE_LIMIT_STORAGE', 'shared'),
+    'RATE_LIMIT_SHM_PATH': os.getenv('RATE_LIMIT_SHM_PATH') or default_shm_path(),
+    'RATE_LIMIT_SLOTS': int(os.getenv('RATE_LIMIT_SLOTS', 65536)),
+    'RATE_LIMIT_DEFAULT': os.getenv('RATE_LIMIT_DEFAULT', '100 per hour'),
+    'RATE_LIMIT_AUTH': os.getenv('RATE_LIMIT_AUTH', '20 per hour'),
+    'RATE_LIMIT_GENERATE': os.getenv('RATE_LIMIT_GENERATE', '60 per hour'),
+
+    # Background generation jobs: JOB_BACKEND is 'mongo' (shared by every
+    # server process) or 'memory' (single-process stand-in for tests)
+    'JOB_BACKEND': os.getenv('JOB_BACKEND', 'mongo'),
+    'JOB_WORKERS': int(os.getenv('JOB_WORKERS', 2)),
+    'JOB_QUEUE_SIZE': int(os.getenv('JOB_QUEUE_SIZE', 100)),
+    'JOBS_PER_USER': int(os.getenv('JOBS_PER_USER', 2)),
+    'JOB_LEASE': float(os.getenv('JOB_LEASE', 60)),
+
+    # Cache sizes (0 disables a cache) and lifetimes in seconds
+    'PLAN_CACHE_SIZE': int(os.getenv('PLAN_CACHE_SIZE', 1024)),
+    'PLAN_CACHE_TTL': int(os.getenv('PLAN_CACHE_TTL', 3600)),
+    'PLAN_BODY_CACHE_SIZE': int(os.getenv('PLAN_BODY_CACHE_SIZE', 10000)),
+    'TOKEN_CACHE_SIZE': int(os.getenv('TOKEN_CACHE_SIZE', 10000)),
+    'USER_CACHE_SIZE': int(os.getenv('USER_CACHE_SIZE', 10000)),
+    'USER_CACHE_TTL': int(os.getenv('USER_CACHE_TTL', 300)),
+
+    # PROFILE_SAMPLE_RATE=N writes cProfile stats for 1 in N requests to
+    # PROFILE_DIR (0, the default, disables it)
+    'PROFILE_SAMPLE_RATE': int(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+    'PROFILE_DIR': os.getenv('PROFILE_DIR', 'profiles'),
+
+    # Batch request size limit and insert_many chunk size
+    'MAX_BATCH_SIZE': int(os.getenv('MAX_BATCH_SIZE', 1000)),
+    'BATCH_CHUNK_SIZE': int(os.getenv('BATCH_CHUNK_SIZE', 200)),
+
+    # Pagination for /api/meals/my-plans, and documents fetched per round
+    # trip when streaming ?format=ndjson exports
+    'PLAN_PAGE_SIZE': int(os.getenv('PLAN_PAGE_SIZE', 20)),
+    'MAX_PLAN_PAGE_SIZE': int(os.getenv('MAX_PLAN_PAGE_SIZE', 100)),
+    'EXPORT_BATCH_SIZE': int(os.getenv('EXPORT_BATCH_SIZE', 100))
+}
+
+# Instrumentation: latency histograms per route and stage plus MongoDB
+# command metrics, served at /metrics
+mongo_listener = MongoCommandListener()
+
+# Start of the keyset cursor date range
+EPOCH = datetime(1970, 1, 1)
+
+class AppResources:
+    """The resources one app builds from its app.config
+
+    Caches and the request profiler are created with the app.  The database
+    client, the queues and threads built on it and the rate limiter's
+    bucket file are created on first use in each process, so
+    creating or importing the app needs no database and opens no files, and
+    workers forked from a preloading master never share a client.
+    """
+
+    def __init__(self, config):
+        if config['RATE_LIMIT_STORAGE'] not in RATE_LIMIT_STORAGES:
+            raise ValueError('RATE_LIMIT_STORAGE must be one of %s' % ', '.join(RATE_LIMIT_STORAGES))
+        if config['JOB_BACKEND'] not in JOB_BACKENDS:
+            raise ValueError('JOB_BACKEND must be one of %s' % ', '.join(JOB_BACKENDS))
+        if config['MEAL_PLAN_STORAGE'] not in STORAGE_MODES:
+            raise ValueError('MEAL_PLAN_STORAGE must be one of %s' % ', '.join(STORAGE_MODES))
+        if config['MEAL_FORMAT'] not in MEAL_FORMATS:
+            raise ValueError('MEAL_FORMAT must be one of %s' % ', '.join(MEAL_FORMATS))
+        self.config = config
+        self.client_options = client_options(config)
+        self.profiler = RequestProfiler(config['PROFILE_SAMPLE_RATE'], config['PROFILE_DIR'])
+        self.query_plan_checker = QueryPlanChecker() if config['MONGO_QUERY_DEBUG'] else None
+        self.event_listeners = [mongo_listener]
+        if self.query_plan_checker is not None:
+            self.event_listeners.append(self.query_plan_checker)
+        concern = config['MEAL_PLAN_WRITE_CONCERN']
+        self.meal_plan_write_concern = WriteConcern(w=int(concern) if concern.isdigit() else concern)
+
+        # Generated plans memoized on normalized preferences, and per-meal-type
+        # candidate rankings on the same key; plans for users with a
+        # recent-recipe history are penalized over the rankings
+        self.plan_cache = LRUCache(config['PLAN_CACHE_SIZE'], ttl=config['PLAN_CACHE_TTL'])
+        self.ranking_cache = LRUCache(config['PLAN_CACHE_SIZE'], ttl=config['PLAN_CACHE_TTL'])
+        # Plan bodies are immutable, so they are cached without expiry
+        self.plan_body_cache = LRUCache(config['PLAN_BODY_CACHE_SIZE'])
+        # Decoded JWT claims keyed by token digest; entries expire at the token's exp
+        self.token_cache = LRUCache(config['TOKEN_CACHE_SIZE'])
+        # Name/email summaries echoed in meal plan responses, and recent recipe ids
+        self.user_summary_cache = LRUCache(config['USER_CACHE_SIZE'], ttl=config['USER_CACHE_TTL'])
+        self.recent_recipes_cache = LRUCache(config['USER_CACHE_SIZE'], ttl=config['USER_CACHE_TTL'])
+
+        self._rate_limiter = None
+        self._lock = threading.RLock()
+        self.reset_after_fork()
+        _all_resources.add(self)
+
+    def reset_after_fork(self):
+        """Drop the client and the threads built on it; a forked child creates its own"""
+        self._client = self._db = self._meal_plans_writer = None
+        self._write_behind = self._history_writer = self._job_runner = None
+        self._lock = threading.RLock()
+
+    def db(self):
+        """Return the database, creating the client and any missing indexes on first use"""
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    client = create_client(self.config['MONGODB_URI'], self.event_listeners,
+                                           options=self.client_options)
+                    if self.query_plan_checker is not None:
+                        self.query_plan_checker.attach(client)
+                    if self.config['MONGO_ENSURE_INDEXES']:
+                        ensure_indexes(client.mealprep)
+                    self._client = client
+                    self._db = client.mealprep
+        return self._db
+
+    def meal_plans_writer(self):
+        """meal_plans with MEAL_PLAN_WRITE_CONCERN"""
+        if self._meal_plans_writer is None:
+            self._meal_plans_writer = self.db().meal_plans.with_options(write_concern=self.meal_plan_write_concern)
+        return self._meal_plans_writer
+
+    def write_behind(self):
+        """Return the write-behind queue in write-behind mode, else None"""
+        if self._write_behind is None and self.config['MEAL_PLAN_WRITE_MODE'] == 'write-behind':
+            with self._lock:
+                if self._write_behind is None:
+                    self._write_behind = WriteBehindQueue(
+                        self.meal_plans_writer(),
+                        maxsize=self.config['WRITE_BEHIND_QUEUE_SIZE'],
+                        batch_size=self.config['WRITE_BEHIND_BATCH_SIZE']
+                    )
+        return self._write_behind
+
+    def history_writer(self):
+        """Return the queue that appends recent-recipe history to users documents"""
+        if self._history_writer is None:
+            with self._lock:
+                if self._history_writer is None:
+                    self._history_writer = WriteBehindQueue(
+                        self.db().users,
+                        maxsize=self.config['WRITE_BEHIND_QUEUE_SIZE'],
+                        batch_size=self.config['WRITE_BEHIND_BATCH_SIZE'],
+                        write=partial(write_recent_recipes, history=self.config['VARIETY_HISTORY']),
+                        name='history-writer'
+                    )
+        return self._history_writer
+
+    def flush(self):
+        """Wait for queued write-behind inserts and history updates, if any"""
+        if self._write_behind is not None:
+            self._write_behind.flush()
+        if self._history_writer is not None:
+            self._history_writer.flush()
+
+    def job_runner(self):
+        """Return the background job runner on JOB_BACKEND"""
+        if self._job_runner is None:
+            with self._lock:
+                if self._job_runner is None:
+                    config = self.config
+                    self._job_runner = JobRunner(
+                        MongoJobStore(self.db().meal_plan_jobs) if config['JOB_BACKEND'] == 'mongo'
+                        else MemoryJobStore(),
+                        workers=config['JOB_WORKERS'],
+                        max_pending=config['JOB_QUEUE_SIZE'],
+                        per_user=config['JOBS_PER_USER'],
+                        lease=config['JOB_LEASE']
+                    )
+        return self._job_runner
+
+    def rate_limiter(self):
+        """Return the RateLimiter, or None with RATE_LIMIT_STORAGE=off
+
+        The bucket file of 'shared' storage is opened on the first request,
+        not when the app is created or imported.  A forked child keeps the
+        parent's mapping, which is the same shared file.
+        """
+        config = self.config
+        if self._rate_limiter is None and config['RATE_LIMIT_STORAGE'] != 'off':
+            with self._lock:
+                if self._rate_limiter is None:
+                    self._rate_limiter = RateLimiter(
+                        SharedTokenBuckets(config['RATE_LIMIT_SHM_PATH'], config['RATE_LIMIT_SLOTS'])
+                        if config['RATE_LIMIT_STORAGE'] == 'shared' else MemoryTokenBuckets(),
+                        config['RATE_LIMIT_DEFAULT'],
+                        limits={
+                            '/api/auth/login': config['RATE_LIMIT_AUTH'],
+                            '/api/auth/register': config['RATE_LIMIT_AUTH'],
+                            '/api/meals/generate': config['RATE_LIMIT_GENERATE'],
+                            '/api/meals/generate-batch': config['RATE_LIMIT_GENERATE']
+                        },
+                        exempt=('/metrics',)
+                    )
+        return self._rate_limiter
+
+    def cache_stats(self):
+        """Hit, miss and size counts of every cache, for /api/cache/stats"""
+        return {
+            'token_cache': self.token_cache.stats(),
+            'user_summary_cache': self.user_summary_cache.stats(),
+            'plan_cache': self.plan_cache.stats(),
+            'ranking_cache': self.ranking_cache.stats(),
+            'plan_body_cache': self.plan_body_cache.stats(),
+            'recent_recipes_cache': self.recent_recipes_cache.stats()
+        }
+
+_all_resources = weakref.WeakSet()
+
+def resources():
+    """Return the AppResources of the current app, else of the module's `app`
+
+    Outside an app context (the ASGI server, scripts, threads started
+    without in_app_context()) the default app's resources are used.
+    """
+    if has_app_context():
+        return current_app.extensions['mealprep']
+    return app.extensions['mealprep']
+
+def setting(name):
+    """Return a setting from the config of the app resources() belongs to"""
+    return resources().config[name]
+
+def in_app_context(fn):
+    """Wrap `fn` to run in the current app's context on another thread"""
+    if not has_app_context():
+        return fn
+    application = current_app._get_current_object()
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        with application.app_context():
+            return fn(*args, **kwargs)
+    return run
+
+def get_db():
+    """Return this process's database for the current app"""
+    return resources().db()
+
+def get_meal_plans_writer():
+    """meal_plans with MEAL_PLAN_WRITE_CONCERN"""
+    return resources().meal_plans_writer()
+
+def get_write_behind():
+    """Return the write-behind queue in write-behind mode, else None"""
+    return resources().write_behind()
+
+def get_history_writer():
+    """Return the queue that appends recent-recipe history to users documents"""
+    return resources().history_writer()
+
+def get_job_runner():
+    """Return the background job runner on JOB_BACKEND"""
+    return resources().job_runner()
+
+@atexit.register
+def flush_write_behind():
+    """Wait for every app's queued write-behind inserts and history updates"""
+    for state in list(_all_resources):
+        state.flush()
+
+# The recipe catalog is plain data, shared by every app and copy-on-write
+# with forked children
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    """Return the recipe catalog, loading it on first use"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = load_catalog()
+    return _catalog
+
+def _reset_after_fork():
+    for state in list(_all_resources):
+        state.reset_after_fork()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Authentication helpers
+def decode_token(token):
+    """Verify a JWT and return its claims, cached by token digest until `exp`"""
+    key = hashlib.sha256(token.encode()).digest()
+    token_cache = resources().token_cache
+    data = token_cache.get(key)
+    if data is None:
+        data = jwt.decode(token, setting('JWT_SECRET'), algorithms=["HS256"])
+        ttl = data['exp'] - time.time() if 'exp' in data else None
+        if ttl is None or ttl > 0:
+            token_cache.set(key, data, ttl)
+    return data
+
+def issue_token(user_id):
+    """Create the 7-day JWT returned by register and login"""
+    return jwt.encode({
+        'user': {'id': user_id},
+        'exp': datetime.utcnow() + timedelta(days=7)
+    }, setting('JWT_SECRET'), algorithm="HS256")
+
+def invalidate_user_summary(user_id):
+    """Drop a user's cached summary after their profile changes"""
+    resources().user_summary_cache.pop(user_id)
 
 # Authentication decorator
 def token_required(f):
@@ -43,7 +421,8 @@ def token_required(f):
             return jsonify({'success': False, 'message': 'No token, authorization denied'}), 401
         
         try:
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+            with stage('auth'):
+                data = decode_token(token)
             current_user_id = data['user']['id']
         except jwt.ExpiredSignatureError:
             return jsonify({'success': False, 'message': 'Token is expired'}), 401
@@ -58,124 +437,802 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+def registration_errors(data):
+    """Validation errors for a register request body, as [{'msg': ...}]"""
+    errors = []
+    if not data.get('name') or data['name'].strip() == '':
+        errors.append({'msg': 'Name is required'})
+    if not data.get('email') or not validate_email(data['email']):
+        errors.append({'msg': 'Please include a valid email'})
+    if not data.get('password') or len(data['password']) < 6:
+        errors.append({'msg': 'Password must be at least 6 characters'})
+    return errors
+
+def login_errors(data):
+    """Validation errors for a login request body, as [{'msg': ...}]"""
+    errors = []
+    if not data.get('email') or not validate_email(data['email']):
+        errors.append({'msg': 'Please include a valid email'})
+    if not data.get('password'):
+        errors.append({'msg': 'Password is required'})
+    return errors
+
+def parse_profile_update(data):
+    """Extract the users fields to $set from a profile update request body
+
+    Returns (fields, None) on success or (None, validation errors).
+    """
+    errors = []
+    if not data.get('name') or data['name'].strip() == '':
+        errors.append({'msg': 'Name is required'})
+    if not data.get('email') or not validate_email(data['email']):
+        errors.append({'msg': 'Please include a valid email'})
+    if errors:
+        return None, errors
+
+    # Preferences are updated only when they were sent
+    profile_fields = {'name': data['name'], 'email': data['email']}
+    for field, key in (('dietaryPreference', 'dietary_preference'),
+                       ('allergies', 'allergies'),
+                       ('nutritionalGoal', 'nutritional_goal'),
+                       ('preferredCuisine', 'preferred_cuisine')):
+        if data.get(field):
+            profile_fields[key] = data[field]
+    return profile_fields, None
+
+def json_body():
+    """The request's JSON object, or {} for any other JSON value
+
+    A body that is not JSON is rejected by Flask with a 400 or 415, answered
+    by the error handlers below.
+    """
+    data = request.get_json()
+    return data if isinstance(data, dict) else {}
+
 # Helper functions for meal generation
-def generate_meal_plan(dietary_preference, allergies, nutritional_goal, number_of_meals, preferred_cuisine):
-    """Generate a meal plan based on user preferences"""
+@timed('generate')
+def generate_meal_plan(dietary_preference, allergies, nutritional_goal, number_of_meals, preferred_cuisine,
+                       optimizer='greedy', recent=None):
+    """Generate a meal plan based on user preferences
+
+    Results up to MAX_SYNC_MEALS meals are memoized on the normalized
+    preferences.  The returned dict may be shared between callers and must be
+    treated as read-only.  Plans are steered away from `recent` recipe ids
+    by re-ranking memoized per-meal-type rankings; a history that changes
+    none of their scores gets the memoized plan.
+    """
+    key = (
+        normalize_tag(dietary_preference),
+        tuple(sorted({normalize_tag(allergy) for allergy in allergies or []})),
+        normalize_tag(nutritional_goal),
+        number_of_meals,
+        normalize_tag(preferred_cuisine),
+        optimizer
+    )
+    state = resources()
+    cacheable = number_of_meals <= state.config['MAX_SYNC_MEALS']
+    penalty = recent_penalty(recent) if recent else None
+    if penalty is not None:
+        pools = state.ranking_cache.get(key)
+        if pools is None:
+            catalog = get_catalog()
+            candidates = plan_candidates(catalog, dietary_preference, allergies, nutritional_goal, preferred_cuisine)
+            pools = candidate_pools(catalog.macros, candidates, number_of_meals, nutritional_goal, optimizer)
+            if cacheable:
+                state.ranking_cache.set(key, pools)
+        if any(penalty(pool).any() for pool in pools.values() if len(pool)):
+            return assemble_meal_plan(pools, number_of_meals, nutritional_goal, optimizer, penalty)
+
+    meal_plan = state.plan_cache.get(key)
+    if meal_plan is None:
+        meal_plan = compute_meal_plan(dietary_preference, allergies, nutritional_goal, number_of_meals,
+                                      preferred_cuisine, optimizer)
+        if cacheable:
+            state.plan_cache.set(key, meal_plan)
+    return meal_plan
+
+def compute_meal_plan(dietary_preference, allergies, nutritional_goal, number_of_meals, preferred_cuisine,
+                      optimizer='greedy', recent=None):
+    """Generate a meal plan without consulting the plan or ranking caches"""
+    candidates = plan_candidates(get_catalog(), dietary_preference, allergies, nutritional_goal, preferred_cuisine)
+    penalty = recent_penalty(recent) if recent else None
+    return assemble_meal_plan(candidates, number_of_meals, nutritional_goal, optimizer, penalty)
+
+def assemble_meal_plan(candidates, number_of_meals, nutritional_goal, optimizer, penalty=None):
+    """Choose a plan's recipes from per-meal-type candidates and build its meals, grocery list and totals"""
+    catalog = get_catalog()
     meals = []
-    grocery_list = {
-        'produce': [],
-        'grains': [],
-        'proteins': [],
-        'dairy': [],
-        'pantry': []
-    }
+    grocery = GroceryAggregator()
 
-    # Sample meal generation based on preferences
-    meal_types = ['breakfast', 'lunch', 'dinner', 'snack']
+    # Choose recipes against the macro targets of the nutritional goal,
+    # steering away from recently eaten and similar recipes
+    positions = optimize_plan(catalog.macros, candidates, number_of_meals, nutritional_goal, optimizer, penalty)
     
-    for i in range(number_of_meals):
-        meal_type = meal_types[i % 4]
-        meal = generate_meal(meal_type, dietary_preference, preferred_cuisine, nutritional_goal)
+    for position in positions:
+        meal = catalog.meal(position)
         meals.append(meal)
         
         # Add ingredients to grocery list
-        add_to_grocery_list(grocery_list, meal['ingredients'])
+        grocery.add(catalog.grocery_items(position))
+    
+    # Macro aggregates are stored with the plan for /api/meals/stats
+    days = -(-number_of_meals // 4)
+    totals = plan_totals(catalog.macros, positions)
     
     return {
         'meals': meals,
-        'grocery_list': grocery_list
+        'grocery_list': grocery.to_dict(),
+        'totals': totals,
+        'daily_average': daily_average(totals, days),
+        'days': days
+    }
+
+def plan_candidates(catalog, dietary_preference, allergies, nutritional_goal, preferred_cuisine):
+    """Candidate recipe positions for each meal type of a plan"""
+    # Diet and allergies are compiled once; each meal type is one index lookup
+    recipe_filter = catalog.compile_filter(dietary_preference, allergies)
+    return {
+        meal_type: catalog.candidates(meal_type, preferred_cuisine, nutritional_goal, recipe_filter)
+        for meal_type in MEAL_TYPES
     }
 
-def generate_meal(meal_type, dietary_preference, cuisine, goal):
+def check_plan_candidates(preferences):
+    """Raise NoCandidatesError if no recipe matching `preferences` can fill a meal type the plan needs"""
+    candidates = plan_candidates(get_catalog(), preferences['dietary_preference'], preferences['allergies'],
+                                 preferences['nutritional_goal'], preferences['preferred_cuisine'])
+    missing = [meal_type for meal_type in MEAL_TYPES[:preferences['number_of_meals']]
+               if not len(candidates[meal_type])]
+    if missing:
+        raise NoCandidatesError(missing)
+
+def recent_penalty(recent):
+    """Score penalty for recent recipe ids and recipes similar to them"""
+    catalog = get_catalog()
+    positions = [position for position in map(catalog.position, recent) if position is not None]
+    return variety_penalty(catalog.band_keys, positions, setting('VARIETY_RECENT_PENALTY'),
+                           setting('VARIETY_SIMILAR_PENALTY'))
+
+def daily_average(totals, days):
+    """Per-day average of a plan's macro totals"""
+    return {field: round(value / days, 1) for field, value in totals.items()}
+
+def generate_meal(meal_type, dietary_preference, cuisine, goal, offset=0, allergies=None):
     """Generate a single meal based on preferences"""
-    base_meals = {
-        'breakfast': {
-            'name': "Mediterranean Breakfast Bowl",
-            'description': "Greek yogurt with honey, mixed berries, and almonds",
-            'ingredients': ["Greek yogurt", "Honey", "Mixed berries", "Almonds"],
-            'prep_time': "10 minutes",
-            'calories': 320,
-            'protein': 18,
-            'carbs': 28,
-            'fat': 16,
-            'meal_type': 'breakfast'
-        },
-        'lunch': {
-            'name': "Quinoa Mediterranean Salad",
-            'description': "Quinoa with chickpeas, cucumber, tomatoes, olives, and feta",
-            'ingredients': ["Quinoa", "Chickpeas", "Cucumber", "Tomatoes", "Olives", "Feta cheese"],
-            'prep_time': "20 minutes",
-            'calories': 450,
-            'protein': 16,
-            'carbs': 58,
-            'fat': 18,
-            'meal_type': 'lunch'
-        },
-        'dinner': {
-            'name': "Herb-Crusted Salmon with Roasted Vegetables",
-            'description': "Salmon with herbs and roasted Mediterranean vegetables",
-            'ingredients': ["Salmon", "Herbs", "Zucchini", "Eggplant", "Bell peppers", "Olive oil"],
-            'prep_time': "30 minutes",
-            'calories': 520,
-            'protein': 32,
-            'carbs': 18,
-            'fat': 32,
-            'meal_type': 'dinner'
+    catalog = get_catalog()
+    recipe_filter = catalog.compile_filter(dietary_preference, allergies)
+    candidates = catalog.candidates(meal_type, cuisine, goal, recipe_filter)
+    if not len(candidates):
+        return None
+
+    # Best fit for the goal first, later offsets give the runners-up
+    ranked = rank_candidates(catalog.macros, candidates, meal_type, goal, offset + 1)
+    return catalog.meal(int(ranked[offset % len(ranked)]))
+
+def choose_swap_recipe(plan, meal, recipe_id=None):
+    """Pick the recipe replacing `meal` in `plan`
+
+    Returns (position, None) or (None, error message).  Without a recipe_id
+    this is the next best fit after the current recipe, so repeated swaps
+    cycle through the alternatives.
+    """
+    catalog = get_catalog()
+    meal_type = meal.get('meal_type')
+    goal = plan['nutritional_goal']
+    recipe_filter = catalog.compile_filter(plan['dietary_preference'], plan.get('allergies'))
+
+    if recipe_id is not None:
+        position = catalog.position(str(recipe_id))
+        if position is None:
+            return None, 'Unknown recipe'
+        if catalog.meal(position)['meal_type'] != meal_type:
+            return None, 'Recipe is not a %s' % meal_type
+        if not catalog.allows(position, recipe_filter):
+            return None, 'Recipe does not fit the plan\'s dietary preference or allergies'
+        return position, None
+
+    candidates = catalog.candidates(meal_type, plan['preferred_cuisine'], goal, recipe_filter)
+    ranked = [int(position) for position in rank_candidates(catalog.macros, candidates, meal_type, goal)]
+    # Meals stored before recipe ids were recorded are found by name
+    current = meal_position(meal, catalog)
+    if current in ranked:
+        at = ranked.index(current)
+        ranked = ranked[at + 1:] + ranked[:at]
+    if not ranked:
+        return None, 'No alternative recipe'
+    return ranked[0], None
+
+def meal_grocery_items(meal):
+    """Grocery items a full meal contributed to its plan's grocery list"""
+    catalog = get_catalog()
+    position = catalog.position(meal.get('recipe_id'))
+    if position is not None and catalog.meal(position)['ingredients'] == meal.get('ingredients'):
+        return catalog.grocery_items(position)
+    return tuple(grocery_item(name) for name in meal.get('ingredients', []))
+
+def parse_meal_plan_request(data):
+    """Extract generation preferences from a request body
+
+    Returns (preferences, None) on success or (None, error message).
+    """
+    if not isinstance(data, dict):
+        return None, 'Missing required fields'
+
+    preferences = {
+        'dietary_preference': data.get('dietaryPreference'),
+        'allergies': data.get('allergies', []),
+        'nutritional_goal': data.get('nutritionalGoal'),
+        'number_of_meals': data.get('numberOfMeals'),
+        'preferred_cuisine': data.get('preferredCuisine'),
+        'optimizer': data.get('optimizer', setting('MEAL_OPTIMIZER'))
+    }
+
+    if (not preferences['dietary_preference'] or not preferences['nutritional_goal']
+            or not preferences['number_of_meals'] or not preferences['preferred_cuisine']):
+        return None, 'Missing required fields'
+    if preferences['optimizer'] not in OPTIMIZER_MODES:
+        return None, 'Unknown optimizer mode'
+    try:
+        preferences['number_of_meals'] = int(preferences['number_of_meals'])
+    except (TypeError, ValueError):
+        preferences['number_of_meals'] = 0
+    max_job_meals = setting('MAX_JOB_MEALS')
+    if not 1 <= preferences['number_of_meals'] <= max_job_meals:
+        return None, 'numberOfMeals must be between 1 and %d' % max_job_meals
+
+    return preferences, None
+
+def run_meal_plan_job(user_id, preferences):
+    """Generate and save a plan on a job worker; returns the job's result fields"""
+    meal_plan_doc = build_meal_plan_doc(user_id, preferences)
+    save_meal_plan(meal_plan_doc)
+    return {'plan': meal_plan_doc['_id']}
+
+def format_job(job):
+    """Format a job document for an API response"""
+    return {
+        '_id': job['_id'],
+        'status': job['status'],
+        'plan': job.get('plan'),
+        'created': job['created'],
+        'started': job.get('started'),
+        'finished': job.get('finished')
+    }
+
+def build_meal_plan_doc(user_id, preferences, recent=None):
+    """Generate a meal plan and wrap it in a meal_plans document
+
+    `recent` is the user's recent recipe ids; they are looked up when None.
+    """
+    if recent is None:
+        recent = get_recent_recipes(user_id)
+    meal_plan_data = generate_meal_plan(recent=recent, **preferences)
+
+    return {
+        'user': ObjectId(user_id),
+        'dietary_preference': preferences['dietary_preference'],
+        'allergies': preferences['allergies'],
+        'nutritional_goal': preferences['nutritional_goal'],
+        'number_of_meals': preferences['number_of_meals'],
+        'preferred_cuisine': preferences['preferred_cuisine'],
+        'meals': meal_plan_data['meals'],
+        'grocery_list': meal_plan_data['grocery_list'],
+        'totals': meal_plan_data['totals'],
+        'daily_average': meal_plan_data['daily_average'],
+        'days': meal_plan_data['days'],
+        # Truncated to what MongoDB stores so the in-memory copy matches a read-back
+        'date': now_millis()
+    }
+
+def now_millis():
+    """Current UTC time truncated to millisecond precision"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def prepare_storage_doc(meal_plan_doc):
+    """Return (meal_plans document, plan_bodies document or None) to write
+
+    Applies MEAL_FORMAT and MEAL_PLAN_STORAGE.  The _id is assigned here so
+    the stored document and the in-memory one agree on it.
+    """
+    meal_plan_doc.setdefault('_id', ObjectId())
+    stored = meal_plan_doc
+    if setting('MEAL_FORMAT') == 'reference':
+        stored = dict(stored, meals=compact_meals(stored['meals'], get_catalog()))
+    if setting('MEAL_PLAN_STORAGE') != 'deduplicated':
+        return stored, None
+    return split_plan_body(stored)
+
+def to_storage_doc(meal_plan_doc):
+    """Return the document to insert into meal_plans
+
+    In deduplicated mode the plan body is upserted into plan_bodies unless
+    this process has already seen it, and the returned document references
+    it by hash.
+    """
+    stored, body = prepare_storage_doc(meal_plan_doc)
+    plan_body_cache = resources().plan_body_cache
+    if body is not None and plan_body_cache.get(body['_id']) is None:
+        get_db().plan_bodies.update_one({'_id': body['_id']}, {'$setOnInsert': body}, upsert=True)
+        plan_body_cache.set(body['_id'], body)
+    return stored
+
+def load_plan_bodies(plans):
+    """Fill in meals and grocery_list, as stored, on plans that reference a plan body"""
+    plan_body_cache = resources().plan_body_cache
+    bodies, missing = cached_bodies(plans, plan_body_cache)
+    if missing:
+        for body in get_db().plan_bodies.find({'_id': {'$in': missing}}):
+            plan_body_cache.set(body['_id'], body)
+            bodies[body['_id']] = body
+    return attach_bodies(plans, bodies)
+
+def hydrate_meal_plans(plans):
+    """Fill in meals and grocery_list on plans stored by body or recipe reference"""
+    return expand_plan_meals(load_plan_bodies(plans), get_catalog())
+
+class MealSwapError(Exception):
+    """A meal swap that cannot be applied, with the HTTP status to answer"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def swap_plan_meal(user_id, plan_id, index, recipe_id=None):
+    """Replace meal `index` of a stored plan and patch its grocery list in place
+
+    Only the meal being replaced and the grocery list are read, and the plan
+    is changed with one targeted update that $sets the meal, the grocery
+    categories that gain or lose an item, the rounded quantities of the
+    remaining changed items and any stored totals.  Plans sharing a deduplicated body get their own
+    copy of it first.  A revision counter turns concurrent swaps into a 409.
+    Returns the new meal, the updated grocery list and the updated totals.
+    """
+    projection = dict(MEAL_SWAP_PROJECTION, meals={'$slice': [index, 1]})
+    plan = get_db().meal_plans.find_one({'_id': ObjectId(plan_id)}, projection)
+    if not plan:
+        raise MealSwapError('Meal plan not found', 404)
+    if str(plan['user']) != user_id:
+        raise MealSwapError('User not authorized', 401)
+
+    shared_body = plan.get('body')
+    if shared_body is not None:
+        plan.pop('meals', None)
+        load_plan_bodies([plan])
+        stored_meals = list(plan.get('meals') or [])
+        old_meal = stored_meals[index] if index < len(stored_meals) else None
+    else:
+        old_meal = plan['meals'][0] if plan.get('meals') else None
+    if old_meal is None:
+        raise MealSwapError('Meal not found', 404)
+
+    catalog = get_catalog()
+    old_full = expand_meals([old_meal], catalog)[0]
+    position, error = choose_swap_recipe(plan, old_full, recipe_id)
+    if error:
+        raise MealSwapError(error)
+    new_full = catalog.meal(position)
+    new_meal = compact_meals([new_full], catalog)[0] if is_reference_meal(old_meal) else new_full
+
+    grocery_list, quantities, replaced = swap_grocery_items(
+        plan.get('grocery_list') or {}, meal_grocery_items(old_full), catalog.grocery_items(position)
+    )
+
+    update = {'$inc': {'rev': 1}}
+    if shared_body is not None:
+        stored_meals[index] = new_meal
+        update['$set'] = {'meals': stored_meals, 'grocery_list': grocery_list}
+        update['$unset'] = {'body': ''}
+    else:
+        update['$set'] = {'meals.%d' % index: new_meal}
+        for category, items in replaced.items():
+            update['$set']['grocery_list.%s' % category] = items
+        for (category, item_index), quantity in quantities.items():
+            update['$set']['grocery_list.%s.%d.quantity' % (category, item_index)] = quantity
+    totals = None
+    if 'totals' in plan:
+        totals = {}
+        for macro, value in plan['totals'].items():
+            totals[macro] = round_quantity(value + new_full.get(macro, 0) - old_full.get(macro, 0))
+            update['$set']['totals.%s' % macro] = totals[macro]
+        if plan.get('days'):
+            update['$set']['daily_average'] = daily_average(totals, plan['days'])
+
+    result = get_db().meal_plans.update_one({'_id': plan['_id'], 'rev': plan.get('rev')}, update)
+    if result.matched_count == 0:
+        raise MealSwapError('Meal plan was changed by another request, try again', 409)
+
+    return {'index': index, 'meal': new_full, 'grocery_list': grocery_names(grocery_list),
+            'grocery_items': grocery_quantities(grocery_list), 'totals': totals}
+
+def save_meal_plan(meal_plan_doc):
+    """Persist a new meal plan and set its _id
+
+    In write-behind mode the document is queued and this returns before it
+    is durable; if the queue is full it is written synchronously instead.
+    """
+    stored = to_storage_doc(meal_plan_doc)
+    write_behind = get_write_behind()
+    if write_behind is None or not write_behind.submit(stored):
+        get_meal_plans_writer().insert_one(stored)
+    record_recent_recipes(str(meal_plan_doc['user']), plan_recipe_ids(meal_plan_doc['meals']))
+
+def get_recent_recipes(user_id):
+    """Return the recipe ids of a user's recent plans, oldest first"""
+    state = resources()
+    if not state.config['VARIETY_HISTORY']:
+        return []
+    recent_recipes_cache = state.recent_recipes_cache
+    recent = recent_recipes_cache.get(user_id)
+    if recent is None:
+        user = get_db().users.find_one({'_id': ObjectId(user_id)}, RECENT_RECIPES_PROJECTION) or {}
+        recent = user.get('recent_recipes', [])
+        recent_recipes_cache.set(user_id, recent)
+    return recent
+
+def plan_recipe_ids(meals):
+    """Distinct recipe ids of a plan's meals in order of first use, at most VARIETY_HISTORY"""
+    history = setting('VARIETY_HISTORY')
+    recipe_ids = list(dict.fromkeys(meal['recipe_id'] for meal in meals if meal.get('recipe_id')))
+    return recipe_ids[-history:] if history else []
+
+def recent_recipes_update(recipe_ids, history):
+    """users update appending recipe ids to a recent_recipes list bounded at `history`"""
+    return {'$push': {'recent_recipes': {'$each': recipe_ids, '$slice': -history}}}
+
+def record_recent_recipes(user_id, recipe_ids):
+    """Append a new plan's recipe ids to the user's recent-recipe index
+
+    The update is written synchronously only when the history queue is full.
+    """
+    history = setting('VARIETY_HISTORY')
+    if not history or not recipe_ids:
+        return
+    if not queue_recent_recipes(user_id, recipe_ids):
+        get_db().users.update_one({'_id': ObjectId(user_id)}, recent_recipes_update(recipe_ids, history))
+
+def queue_recent_recipes(user_id, recipe_ids):
+    """Update the cached history in place and queue its users update; False if the queue is full"""
+    state = resources()
+    recent = state.recent_recipes_cache.get(user_id)
+    if recent is not None:
+        state.recent_recipes_cache.set(user_id, (recent + list(recipe_ids))[-state.config['VARIETY_HISTORY']:])
+    return state.history_writer().submit((user_id, list(recipe_ids)))
+
+def write_recent_recipes(users, batch, history):
+    """Apply queued (user_id, recipe_ids) history appends with one update per user"""
+    appended = {}
+    for user_id, recipe_ids in batch:
+        appended.setdefault(user_id, []).extend(recipe_ids)
+    users.bulk_write([UpdateOne({'_id': ObjectId(user_id)}, recent_recipes_update(recipe_ids[-history:], history))
+                      for user_id, recipe_ids in appended.items()], ordered=False)
+
+def get_user_summary(user_id):
+    """Return a user's _id, name and email, served from the summary cache"""
+    user_summary_cache = resources().user_summary_cache
+    user = user_summary_cache.get(user_id)
+    if user is None:
+        user = get_db().users.find_one({'_id': ObjectId(user_id)}, USER_SUMMARY_PROJECTION)
+        if user is not None:
+            user_summary_cache.set(user_id, user)
+    return user
+
+def _build_batch_item(user_id, data, recent):
+    preferences, error = parse_meal_plan_request(data)
+    if error:
+        return None, error
+    max_sync_meals = setting('MAX_SYNC_MEALS')
+    if preferences['number_of_meals'] > max_sync_meals:
+        return None, 'numberOfMeals above %d must be generated as a job' % max_sync_meals
+    try:
+        return build_meal_plan_doc(user_id, preferences, recent), None
+    except NoCandidatesError as e:
+        return None, str(e)
+    except Exception:
+        return None, 'Generation error'
+
+def generate_meal_plans_batch(items):
+    """Generate and store meal plans for many (user_id, request body) pairs
+
+    Plans are generated one after another in the calling thread: generation
+    is CPU-bound, so threads would only contend for the GIL.  Each plan's
+    recipes are added to its user's history before that user's next item is
+    generated, so repeated preferences in one batch still rotate recipes.
+    Plans are written with one unordered insert_many per chunk of
+    BATCH_CHUNK_SIZE items.  Returns one compact result per item, in input
+    order: {'index', 'success', '_id'} or {'index', 'success', 'message'}.
+    """
+    results = [None] * len(items)
+    # Generation history per user: stored history plus this batch's plans
+    generated = {}
+    recent = {}
+    chunk_size = setting('BATCH_CHUNK_SIZE')
+    history = setting('VARIETY_HISTORY')
+
+    for start in range(0, len(items), chunk_size):
+        docs = []
+        doc_indexes = []
+        for index in range(start, min(start + chunk_size, len(items))):
+            user_id, data = items[index]
+            if user_id not in generated:
+                generated[user_id] = get_recent_recipes(user_id)
+            doc, error = _build_batch_item(user_id, data, generated[user_id])
+            if error:
+                results[index] = {'index': index, 'success': False, 'message': error}
+            else:
+                if history:
+                    generated[user_id] = (generated[user_id] + plan_recipe_ids(doc['meals']))[-history:]
+                docs.append(doc)
+                doc_indexes.append(index)
+
+        if not docs:
+            continue
+
+        write_errors = set()
+        try:
+            get_meal_plans_writer().insert_many([to_storage_doc(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            write_errors = {error['index'] for error in e.details.get('writeErrors', [])}
+        except Exception:
+            # e.g. AutoReconnect: the chunk's outcome is unknown, later chunks still run
+            write_errors = set(range(len(docs)))
+
+        for position, (doc, index) in enumerate(zip(docs, doc_indexes)):
+            if position in write_errors:
+                results[index] = {'index': index, 'success': False, 'message': 'Database error'}
+            else:
+                results[index] = {'index': index, 'success': True, '_id': doc['_id']}
+                # Ordered by last use across the batch
+                user_recent = recent.setdefault(str(doc['user']), {})
+                for recipe_id in plan_recipe_ids(doc['meals']):
+                    user_recent.pop(recipe_id, None)
+                    user_recent[recipe_id] = True
+
+    # One history update per user for the whole batch
+    for user_id, recipe_ids in recent.items():
+        record_recent_recipes(user_id, list(recipe_ids)[-history:])
+    return results
+
+def new_user_doc(name, email, hashed_password):
+    """Build the users document for a new registration with default preferences"""
+    return {
+        'name': name,
+        'email': email,
+        'password': hashed_password,
+        'dietary_preference': 'omnivore',
+        'allergies': [],
+        'nutritional_goal': 'maintenance',
+        'preferred_cuisine': 'any',
+        'date': datetime.utcnow()
+    }
+
+def format_user_profile(user):
+    """Format a user document for an API response, without the password"""
+    return {
+        'id': user['_id'],
+        'name': user['name'],
+        'email': user['email'],
+        'dietary_preference': user.get('dietary_preference', 'omnivore'),
+        'allergies': user.get('allergies', []),
+        'nutritional_goal': user.get('nutritional_goal', 'maintenance'),
+        'preferred_cuisine': user.get('preferred_cuisine', 'any'),
+        'date': user.get('date')
+    }
+
+def format_meal_plan(plan, user):
+    """Format a stored meal plan and its owner for an API response
+
+    `grocery_list` keeps its original {category: [name, ...]} shape and the
+    merged quantities are returned as `grocery_items`.  ObjectId and
+    datetime values are left to the app's JSON provider.
+    """
+    return {
+        '_id': plan['_id'],
+        'user': {
+            'id': user['_id'],
+            'name': user['name'],
+            'email': user['email']
         },
-        'snack': {
-            'name': "Mediterranean Hummus with Veggies",
-            'description': "Homemade hummus with fresh vegetables",
-            'ingredients': ["Chickpeas", "Tahini", "Lemon", "Garlic", "Carrots", "Cucumber"],
-            'prep_time': "15 minutes",
-            'calories': 180,
-            'protein': 6,
-            'carbs': 20,
-            'fat': 9,
-            'meal_type': 'snack'
-        }
+        'dietary_preference': plan['dietary_preference'],
+        'allergies': plan['allergies'],
+        'nutritional_goal': plan['nutritional_goal'],
+        'number_of_meals': plan['number_of_meals'],
+        'preferred_cuisine': plan['preferred_cuisine'],
+        'meals': plan['meals'],
+        'grocery_list': grocery_names(plan['grocery_list']),
+        'grocery_items': grocery_quantities(plan['grocery_list']),
+        'totals': plan.get('totals'),
+        'daily_average': plan.get('daily_average'),
+        'date': plan['date']
     }
 
-    return base_meals[meal_type]
-
-def add_to_grocery_list(grocery_list, ingredients):
-    """Add ingredients to the appropriate category in the grocery list"""
-    for ingredient in ingredients:
-        if ingredient in ['Greek yogurt', 'Feta cheese']:
-            grocery_list['dairy'].append(ingredient)
-        elif ingredient in ['Quinoa', 'Rice', 'Pasta']:
-            grocery_list['grains'].append(ingredient)
-        elif ingredient in ['Chickpeas', 'Salmon', 'Almonds']:
-            grocery_list['proteins'].append(ingredient)
-        elif ingredient in ['Tomatoes', 'Cucumber', 'Carrots', 'Bell peppers', 'Zucchini', 'Eggplant']:
-            grocery_list['produce'].append(ingredient)
-        else:
-            grocery_list['pantry'].append(ingredient)
+def stream_meal_plans(query, user):
+    """Yield every matching plan as one JSON line, newest first
+
+    The cursor is read EXPORT_BATCH_SIZE documents at a time, so memory use
+    does not depend on the length of the history.
+    """
+    batch_size = setting('EXPORT_BATCH_SIZE')
+    cursor = (
+        get_db().meal_plans.find(query, MEAL_PLAN_PROJECTION)
+        .sort([('date', -1), ('_id', -1)])
+        .batch_size(batch_size)
+    )
+    try:
+        batch = []
+        for plan in cursor:
+            batch.append(plan)
+            if len(batch) == batch_size:
+                for plan in hydrate_meal_plans(batch):
+                    yield current_app.json.dumps(format_meal_plan(plan, user)) + '\n'
+                batch = []
+        for plan in hydrate_meal_plans(batch):
+            yield current_app.json.dumps(format_meal_plan(plan, user)) + '\n'
+    finally:
+        cursor.close()
+
+def meal_plans_etag(plans, user, more=False):
+    """Strong ETag for the formatted `plans`, computed from their _id and rev
+
+    Stored plans only change through meal swaps, which bump rev; the owner's
+    name and email and the recipe catalog version cover the other inputs of
+    format_meal_plan(), and `more` whether a next page token is included.
+    """
+    digest = hashlib.sha256(('%s\0%s\0%s\0%d' % (
+        get_catalog().version, user.get('name'), user.get('email'), more)).encode())
+    for plan in plans:
+        digest.update(('\0%s.%d' % (plan['_id'], plan.get('rev') or 0)).encode())
+    return digest.hexdigest()[:32]
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value lists `etag` (or is *)"""
+    return bool(if_none_match) and parse_etags(if_none_match).contains_weak(etag)
+
+def etag_headers(etag):
+    """Headers sent with 200 and 304 meal plan reads; clients revalidate every time"""
+    return {'ETag': '"%s"' % etag, 'Cache-Control': 'private, no-cache'}
+
+def encode_page_token(date, plan_id):
+    """Encode the (date, _id) keyset position of a plan as an opaque token"""
+    millis = (date - EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(('%d.%s' % (millis, plan_id)).encode()).decode()
+
+def decode_page_token(token):
+    """Decode a token from encode_page_token(), raising ValueError if malformed"""
+    try:
+        millis, plan_id = base64.urlsafe_b64decode(token.encode()).decode().split('.')
+        return EPOCH + timedelta(milliseconds=int(millis)), ObjectId(plan_id)
+    except Exception:
+        raise ValueError('Invalid pagination token')
+
+def parse_date_bound(value, end=False):
+    """Parse an ISO date or datetime query value into naive UTC, raising ValueError if malformed
+
+    A bare date as the end of a range includes that whole day.
+    """
+    bound = datetime.fromisoformat(value)
+    if bound.tzinfo is not None:
+        bound = bound.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and len(value) == 10:
+        bound += timedelta(days=1)
+    return bound
+
+def parse_date_range(args):
+    """Build a date condition from ?from= and ?to=
+
+    Returns (condition or None, None) or (None, error message).
+    """
+    date_range = {}
+    try:
+        if args.get('from'):
+            date_range['$gte'] = parse_date_bound(args['from'])
+        if args.get('to'):
+            date_range['$lt'] = parse_date_bound(args['to'], end=True)
+    except ValueError:
+        return None, 'Invalid date range'
+    return date_range or None, None
+
+def grocery_list_pipeline(query):
+    """Aggregation merging the grocery lists of every plan matching `query`
+
+    Yields one row per (category, name, unit) with the summed quantity, so the
+    result size depends on the distinct items rather than the number of plans.
+    Plain-name items from older plans count as one each.
+    """
+    item = '$categories.v'
+    return [
+        {'$match': query},
+        {'$project': {'grocery_list': 1, 'body': 1}},
+        # Deduplicated plans keep their grocery list in plan_bodies
+        {'$lookup': {'from': 'plan_bodies', 'localField': 'body', 'foreignField': '_id', 'as': 'stored_body'}},
+        {'$project': {'_id': 0, 'categories': {'$objectToArray': {
+            '$ifNull': ['$grocery_list', {'$arrayElemAt': ['$stored_body.grocery_list', 0]}]
+        }}}},
+        {'$unwind': '$categories'},
+        {'$unwind': item},
+        {'$group': {
+            '_id': {
+                'category': '$categories.k',
+                'name': {'$ifNull': [item + '.name', item]},
+                'unit': {'$ifNull': [item + '.unit', None]}
+            },
+            'quantity': {'$sum': {'$ifNull': [item + '.quantity', 1]}}
+        }},
+        {'$sort': {'_id.category': 1, '_id.name': 1, '_id.unit': 1}}
+    ]
+
+def merge_grocery_rows(rows):
+    """Build a grocery_list from grocery_list_pipeline() rows"""
+    grocery_list = {category: [] for category in GROCERY_CATEGORIES}
+    for row in rows:
+        grocery_list.setdefault(row['_id']['category'], []).append({
+            'name': row['_id']['name'],
+            'quantity': round_quantity(row['quantity']),
+            'unit': row['_id']['unit']
+        })
+    return grocery_list
+
+# Period formats for /api/meals/stats trends (UTC, ISO weeks)
+STATS_INTERVALS = {'day': '%Y-%m-%d', 'week': '%G-W%V', 'month': '%Y-%m'}
+
+def plan_stats_pipeline(query, interval):
+    """Aggregation summing the stored macro totals of matching plans per period
+
+    Reads only date, days and totals, never the meals.
+    """
+    group = {
+        '_id': {'$dateToString': {'format': STATS_INTERVALS[interval], 'date': '$date'}},
+        'plans': {'$sum': 1},
+        'days': {'$sum': '$days'}
+    }
+    for field in MACRO_FIELDS:
+        group[field] = {'$sum': '$totals.%s' % field}
+    return [
+        {'$match': dict(query, totals={'$exists': True})},
+        {'$project': {'date': 1, 'days': 1, 'totals': 1}},
+        {'$group': group},
+        {'$sort': {'_id': 1}}
+    ]
+
+def format_plan_stats(rows):
+    """Build the /api/meals/stats payload from plan_stats_pipeline() rows"""
+    def summarize(plans, days, totals):
+        return {
+            'plans': plans,
+            'days': days,
+            'totals': totals,
+            'daily_average': daily_average(totals, days) if days else None
+        }
+
+    trend = []
+    overall = dict.fromkeys(MACRO_FIELDS, 0)
+    plans = days = 0
+    for row in rows:
+        totals = {field: row[field] for field in MACRO_FIELDS}
+        trend.append(dict(summarize(row['plans'], row['days'], totals), period=row['_id']))
+        plans += row['plans']
+        days += row['days']
+        for field in MACRO_FIELDS:
+            overall[field] += row[field]
+    return {'summary': summarize(plans, days, overall), 'trend': trend}
 
 # Routes
 
 # Auth routes
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
-    data = request.get_json()
+    data = json_body()
     
     name = data.get('name')
     email = data.get('email')
     password = data.get('password')
     
     # Validation
-    errors = []
-    if not name or name.strip() == '':
-        errors.append({'msg': 'Name is required'})
-    if not email or not validate_email(email):
-        errors.append({'msg': 'Please include a valid email'})
-    if not password or len(password) < 6:
-        errors.append({'msg': 'Password must be at least 6 characters'})
-    
+    errors = registration_errors(data)
     if errors:
         return jsonify({'success': False, 'errors': errors}), 400
     
     # Check if user already exists
-    existing_user = db.users.find_one({'email': email})
+    existing_user = get_db().users.find_one({'email': email}, USER_EXISTS_PROJECTION)
     if existing_user:
         return jsonify({
             'success': False,
@@ -183,27 +1240,28 @@ def register():
         }), 400
     
     # Create new user
-    hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+    try:
+        hashed_password = hash_password(password)
+    except PasswordHasherBusy:
+        return jsonify({
+            'success': False,
+            'message': 'Server busy, please try again'
+        }), 503
     
-    user_data = {
-        'name': name,
-        'email': email,
-        'password': hashed_password,
-        'dietary_preference': 'omnivore',
-        'allergies': [],
-        'nutritional_goal': 'maintenance',
-        'preferred_cuisine': 'any',
-        'date': datetime.utcnow()
-    }
+    user_data = new_user_doc(name, email, hashed_password)
     
-    result = db.users.insert_one(user_data)
+    # The unique email index settles concurrent registrations
+    try:
+        result = get_db().users.insert_one(user_data)
+    except DuplicateKeyError:
+        return jsonify({
+            'success': False,
+            'message': 'User already exists'
+        }), 400
     user_id = str(result.inserted_id)
     
     # Generate JWT token
-    token = jwt.encode({
-        'user': {'id': user_id},
-        'exp': datetime.utcnow() + timedelta(days=7)
-    }, JWT_SECRET, algorithm="HS256")
+    token = issue_token(user_id)
     
     # Return user info without password
     user_response = {
@@ -218,25 +1276,20 @@ def register():
         'user': user_response
     })
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
-    data = request.get_json()
+    data = json_body()
     
     email = data.get('email')
     password = data.get('password')
     
     # Validation
-    errors = []
-    if not email or not validate_email(email):
-        errors.append({'msg': 'Please include a valid email'})
-    if not password:
-        errors.append({'msg': 'Password is required'})
-    
+    errors = login_errors(data)
     if errors:
         return jsonify({'success': False, 'errors': errors}), 400
     
     # Check if user exists
-    user = db.users.find_one({'email': email})
+    user = get_db().users.find_one({'email': email}, USER_LOGIN_PROJECTION)
     if not user:
         return jsonify({
             'success': False,
@@ -244,21 +1297,33 @@ def login():
         }), 400
     
     # Check password
-    if not check_password_hash(user['password'], password):
+    try:
+        password_ok = verify_password(user['password'], password)
+    except PasswordHasherBusy:
+        return jsonify({
+            'success': False,
+            'message': 'Server busy, please try again'
+        }), 503
+    if not password_ok:
         return jsonify({
             'success': False,
             'message': 'Invalid credentials'
         }), 400
     
+    # Upgrade hashes made with an older iteration count
+    if needs_rehash(user['password']):
+        users = get_db().users
+        rehash_in_background(password, lambda new_hash: users.update_one(
+            {'_id': user['_id'], 'password': user['password']},
+            {'$set': {'password': new_hash}}
+        ))
+    
     # Generate JWT token
-    token = jwt.encode({
-        'user': {'id': str(user['_id'])},
-        'exp': datetime.utcnow() + timedelta(days=7)
-    }, JWT_SECRET, algorithm="HS256")
+    token = issue_token(str(user['_id']))
     
     # Return user info without password
     user_response = {
-        'id': str(user['_id']),
+        'id': user['_id'],
         'name': user['name'],
         'email': user['email']
     }
@@ -269,135 +1334,351 @@ def login():
         'user': user_response
     })
 
-@app.route('/api/auth', methods=['GET'])
+@api.route('/api/auth', methods=['GET'])
 @token_required
 def get_user(current_user_id):
-    user = db.users.find_one({'_id': ObjectId(current_user_id)})
+    user = get_db().users.find_one({'_id': ObjectId(current_user_id)}, USER_PROFILE_PROJECTION)
     if not user:
         return jsonify({'success': False, 'message': 'User not found'}), 404
     
     # Return user without password
-    user_response = {
-        'id': str(user['_id']),
-        'name': user['name'],
-        'email': user['email'],
-        'dietary_preference': user.get('dietary_preference', 'omnivore'),
-        'allergies': user.get('allergies', []),
-        'nutritional_goal': user.get('nutritional_goal', 'maintenance'),
-        'preferred_cuisine': user.get('preferred_cuisine', 'any'),
-        'date': user.get('date')
-    }
+    user_response = format_user_profile(user)
     
     return jsonify({
         'success': True,
         'user': user_response
     })
 
+# User routes
+@api.route('/api/users/profile', methods=['GET'])
+@token_required
+def get_profile(current_user_id):
+    user = get_db().users.find_one({'_id': ObjectId(current_user_id)}, USER_PROFILE_PROJECTION)
+    if not user:
+        return jsonify({'success': False, 'message': 'User not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'data': format_user_profile(user)
+    })
+
+@api.route('/api/users/profile', methods=['PUT'])
+@token_required
+def update_profile(current_user_id):
+    # Validation
+    profile_fields, errors = parse_profile_update(json_body())
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+    
+    try:
+        user = get_db().users.find_one_and_update(
+            {'_id': ObjectId(current_user_id)},
+            {'$set': profile_fields},
+            projection=USER_PROFILE_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if not user:
+            return jsonify({'success': False, 'message': 'User not found'}), 404
+        
+        # Name and email are echoed from the summary cache
+        invalidate_user_summary(current_user_id)
+        
+        return jsonify({
+            'success': True,
+            'data': format_user_profile(user)
+        })
+    except DuplicateKeyError:
+        # Another account already has the email; the unique index rejects it
+        return jsonify({
+            'success': False,
+            'message': 'User already exists'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Server error'
+        }), 500
+
+@api.before_app_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    current_route.set(request.url_rule.rule if request.url_rule else 'unmatched')
+    g.profile = resources().profiler.start()
+
+@api.before_app_request
+def check_rate_limit():
+    rate_limiter = resources().rate_limiter()
+    if rate_limiter is None:
+        return None
+    retry_after = rate_limiter.check(current_route.get(), request.remote_addr)
+    if retry_after is not None:
+        return jsonify({
+            'success': False,
+            'message': 'Too many requests, please try again later'
+        }), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+@api.after_app_request
+def record_request_metrics(response):
+    route = current_route.get()
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, request.method, route,
+                                    response.status_code)
+    if g.profile is not None:
+        resources().profiler.finish(g.profile, '%s %s' % (request.method, route))
+    return response
+
+@api.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'success': True,
+        'data': resources().cache_stats()
+    })
+
 # Meal routes
-@app.route('/api/meals/generate', methods=['POST'])
+@api.route('/api/meals/generate', methods=['POST'])
 @token_required
 def generate_meal_plan_route(current_user_id):
     data = request.get_json()
     
-    dietary_preference = data.get('dietaryPreference')
-    allergies = data.get('allergies', [])
-    nutritional_goal = data.get('nutritionalGoal')
-    number_of_meals = data.get('numberOfMeals')
-    preferred_cuisine = data.get('preferredCuisine')
-    
     # Validation
-    if not dietary_preference or not nutritional_goal or not number_of_meals or not preferred_cuisine:
+    preferences, error = parse_meal_plan_request(data)
+    if error:
         return jsonify({
             'success': False,
-            'message': 'Missing required fields'
+            'message': error
         }), 400
     
-    try:
-        # Generate meal plan
-        meal_plan_data = generate_meal_plan(
-            dietary_preference, 
-            allergies, 
-            nutritional_goal, 
-            number_of_meals, 
-            preferred_cuisine
-        )
+    # Prefer: respond-async runs the generation as a background job
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        try:
+            # Checked up front so the client gets a 400 rather than a failed job
+            check_plan_candidates(preferences)
+            job = get_job_runner().submit(current_user_id, 'generate', in_app_context(run_meal_plan_job),
+                                         current_user_id, preferences)
+        except NoCandidatesError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        except TooManyUserJobs:
+            return jsonify({'success': False, 'message': 'Too many active jobs'}), 429
+        except JobQueueFull:
+            return jsonify({'success': False, 'message': 'Server busy, try again shortly'}), 503
+        except Exception as e:
+            return jsonify({'success': False, 'message': 'Server error'}), 500
         
-        # Create meal plan document
-        meal_plan_doc = {
-            'user': ObjectId(current_user_id),
-            'dietary_preference': dietary_preference,
-            'allergies': allergies,
-            'nutritional_goal': nutritional_goal,
-            'number_of_meals': number_of_meals,
-            'preferred_cuisine': preferred_cuisine,
-            'meals': meal_plan_data['meals'],
-            'grocery_list': meal_plan_data['grocery_list'],
-            'date': datetime.utcnow()
-        }
+        return jsonify({
+            'success': True,
+            'data': format_job(job)
+        }), 202, {'Location': '/api/meals/jobs/%s' % job['_id']}
+    
+    max_sync_meals = current_app.config['MAX_SYNC_MEALS']
+    if preferences['number_of_meals'] > max_sync_meals:
+        return jsonify({
+            'success': False,
+            'message': 'numberOfMeals above %d must be generated as a job (Prefer: respond-async)' % max_sync_meals
+        }), 400
+    
+    try:
+        # Echoed user data comes from the summary cache
+        user = get_user_summary(current_user_id)
+        if not user:
+            return jsonify({'success': False, 'message': 'User not found'}), 404
         
-        result = db.meal_plans.insert_one(meal_plan_doc)
-        saved_meal_plan = db.meal_plans.find_one({'_id': result.inserted_id})
+        # Generate meal plan and create meal plan document
+        meal_plan_doc = build_meal_plan_doc(current_user_id, preferences)
         
-        # Format response with user data
-        user = db.users.find_one({'_id': ObjectId(current_user_id)}, {'password': 0})
+        # The response is built from the document we wrote; no read-back
+        save_meal_plan(meal_plan_doc)
         
         response = {
             'success': True,
-            'data': {
-                '_id': str(saved_meal_plan['_id']),
-                'user': {
-                    'id': str(user['_id']),
-                    'name': user['name'],
-                    'email': user['email']
-                },
-                'dietary_preference': saved_meal_plan['dietary_preference'],
-                'allergies': saved_meal_plan['allergies'],
-                'nutritional_goal': saved_meal_plan['nutritional_goal'],
-                'number_of_meals': saved_meal_plan['number_of_meals'],
-                'preferred_cuisine': saved_meal_plan['preferred_cuisine'],
-                'meals': saved_meal_plan['meals'],
-                'grocery_list': saved_meal_plan['grocery_list'],
-                'date': saved_meal_plan['date']
-            }
+            'data': format_meal_plan(meal_plan_doc, user)
         }
         
         return jsonify(response)
+    except NoCandidatesError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Server error'
+        }), 500
+
+@api.route('/api/meals/generate-batch', methods=['POST'])
+@token_required
+def generate_meal_plan_batch_route(current_user_id):
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+    
+    # Validation
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'success': False,
+            'message': 'Missing required fields'
+        }), 400
+    max_batch_size = current_app.config['MAX_BATCH_SIZE']
+    if len(items) > max_batch_size:
+        return jsonify({
+            'success': False,
+            'message': 'Batch is limited to %d items' % max_batch_size
+        }), 400
+    
+    try:
+        # Every plan in the batch belongs to the authenticated user
+        results = generate_meal_plans_batch([(current_user_id, item) for item in items])
+        failed = sum(1 for result in results if not result['success'])
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'generated': len(results) - failed,
+                'failed': failed,
+                'results': results
+            }
+        })
     except Exception as e:
         return jsonify({
             'success': False,
             'message': 'Server error'
         }), 500
 
-@app.route('/api/meals/my-plans', methods=['GET'])
+@api.route('/api/meals/my-plans', methods=['GET'])
 @token_required
 def get_user_meal_plans(current_user_id):
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'ndjson'):
+        return jsonify({
+            'success': False,
+            'message': 'Unsupported format'
+        }), 400
+    
+    try:
+        limit = int(request.args.get('limit', current_app.config['PLAN_PAGE_SIZE']))
+    except ValueError:
+        limit = 0
+    max_page_size = current_app.config['MAX_PLAN_PAGE_SIZE']
+    if output_format == 'json' and (limit < 1 or limit > max_page_size):
+        return jsonify({
+            'success': False,
+            'message': 'Limit must be between 1 and %d' % max_page_size
+        }), 400
+    
+    # Keyset pagination on (date, _id), newest first
+    query = {'user': ObjectId(current_user_id)}
+    page_token = request.args.get('next')
+    if page_token:
+        try:
+            last_date, last_id = decode_page_token(page_token)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid pagination token'
+            }), 400
+        query['$or'] = [
+            {'date': {'$lt': last_date}},
+            {'date': last_date, '_id': {'$lt': last_id}}
+        ]
+    
     try:
-        meal_plans = list(db.meal_plans.find({'user': ObjectId(current_user_id)}).sort('date', -1))
+        # Every plan belongs to the same user, so fetch the user once
+        user = get_user_summary(current_user_id)
+        if not user:
+            return jsonify({'success': False, 'message': 'User not found'}), 404
+        
+        if output_format == 'ndjson':
+            return Response(stream_with_context(stream_meal_plans(query, user)), mimetype='application/x-ndjson')
+        
+        # Revalidation reads only _id and rev of the page
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            versions = list(
+                get_db().meal_plans.find(query, MEAL_PLAN_ETAG_PROJECTION)
+                .sort([('date', -1), ('_id', -1)])
+                .limit(limit + 1)
+            )
+            etag = meal_plans_etag(versions[:limit], user, len(versions) > limit)
+            if etag_matches(if_none_match, etag):
+                return '', 304, etag_headers(etag)
+        
+        # Fetch one extra plan to learn whether another page exists
+        meal_plans = list(
+            get_db().meal_plans.find(query, MEAL_PLAN_PROJECTION)
+            .sort([('date', -1), ('_id', -1)])
+            .limit(limit + 1)
+        )
+        next_token = None
+        if len(meal_plans) > limit:
+            meal_plans = meal_plans[:limit]
+            next_token = encode_page_token(meal_plans[-1]['date'], meal_plans[-1]['_id'])
+        etag = meal_plans_etag(meal_plans, user, next_token is not None)
         
         # Format response
-        formatted_plans = []
-        for plan in meal_plans:
-            user = db.users.find_one({'_id': plan['user']}, {'password': 0})
-            formatted_plans.append({
-                '_id': str(plan['_id']),
-                'user': {
-                    'id': str(user['_id']),
-                    'name': user['name'],
-                    'email': user['email']
-                },
-                'dietary_preference': plan['dietary_preference'],
-                'allergies': plan['allergies'],
-                'nutritional_goal': plan['nutritional_goal'],
-                'number_of_meals': plan['number_of_meals'],
-                'preferred_cuisine': plan['preferred_cuisine'],
-                'meals': plan['meals'],
-                'grocery_list': plan['grocery_list'],
-                'date': plan['date']
-            })
+        formatted_plans = [format_meal_plan(plan, user) for plan in hydrate_meal_plans(meal_plans)]
+        
+        return jsonify({
+            'success': True,
+            'data': formatted_plans,
+            'next': next_token
+        }), 200, etag_headers(etag)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Server error'
+        }), 500
+
+@api.route('/api/meals/stats', methods=['GET'])
+@token_required
+def get_meal_plan_stats(current_user_id):
+    interval = request.args.get('interval', 'week')
+    if interval not in STATS_INTERVALS:
+        return jsonify({
+            'success': False,
+            'message': 'Interval must be one of %s' % ', '.join(STATS_INTERVALS)
+        }), 400
+    
+    # Optional ISO date range over plan dates; a bare `to` date is inclusive
+    query = {'user': ObjectId(current_user_id)}
+    date_range, error = parse_date_range(request.args)
+    if error:
+        return jsonify({
+            'success': False,
+            'message': error
+        }), 400
+    if date_range:
+        query['date'] = date_range
+    
+    try:
+        rows = get_db().meal_plans.aggregate(plan_stats_pipeline(query, interval))
+        return jsonify({
+            'success': True,
+            'data': format_plan_stats(rows)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Server error'
+        }), 500
+
+@api.route('/api/meals/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_meal_plan_job(current_user_id, job_id):
+    try:
+        job = get_job_runner().get(ObjectId(job_id))
+        
+        # Jobs of other users are reported as missing
+        if not job or str(job['user']) != current_user_id:
+            return jsonify({
+                'success': False,
+                'message': 'Job not found'
+            }), 404
         
         return jsonify({
             'success': True,
-            'data': formatted_plans
+            'data': format_job(job)
         })
     except Exception as e:
         return jsonify({
@@ -405,11 +1686,40 @@ def get_user_meal_plans(current_user_id):
             'message': 'Server error'
         }), 500
 
-@app.route('/api/meals/<plan_id>', methods=['GET'])
+@api.route('/api/meals/grocery-list', methods=['GET'])
+@token_required
+def get_combined_grocery_list(current_user_id):
+    # Optional ISO date range over plan dates; a bare `to` date is inclusive
+    query = {'user': ObjectId(current_user_id)}
+    date_range, error = parse_date_range(request.args)
+    if error:
+        return jsonify({
+            'success': False,
+            'message': error
+        }), 400
+    if date_range:
+        query['date'] = date_range
+
+    try:
+        rows = get_db().meal_plans.aggregate(grocery_list_pipeline(query))
+        return jsonify({
+            'success': True,
+            'data': merge_grocery_rows(rows)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Server error'
+        }), 500
+
+@api.route('/api/meals/<plan_id>', methods=['GET'])
 @token_required
 def get_specific_meal_plan(current_user_id, plan_id):
     try:
-        meal_plan = db.meal_plans.find_one({'_id': ObjectId(plan_id)})
+        # Revalidation reads only the owner and rev; the full plan is read on a miss
+        if_none_match = request.headers.get('If-None-Match')
+        projection = MEAL_PLAN_ETAG_PROJECTION if if_none_match else None
+        meal_plan = get_db().meal_plans.find_one({'_id': ObjectId(plan_id)}, projection)
         
         if not meal_plan:
             return jsonify({
@@ -424,29 +1734,42 @@ def get_specific_meal_plan(current_user_id, plan_id):
                 'message': 'User not authorized'
             }), 401
         
-        user = db.users.find_one({'_id': ObjectId(current_user_id)}, {'password': 0})
+        user = get_user_summary(current_user_id)
+        etag = meal_plans_etag([meal_plan], user)
+        if projection is not None:
+            if etag_matches(if_none_match, etag):
+                return '', 304, etag_headers(etag)
+            meal_plan = get_db().meal_plans.find_one({'_id': meal_plan['_id']})
+            etag = meal_plans_etag([meal_plan], user)
         
         response = {
             'success': True,
-            'data': {
-                '_id': str(meal_plan['_id']),
-                'user': {
-                    'id': str(user['_id']),
-                    'name': user['name'],
-                    'email': user['email']
-                },
-                'dietary_preference': meal_plan['dietary_preference'],
-                'allergies': meal_plan['allergies'],
-                'nutritional_goal': meal_plan['nutritional_goal'],
-                'number_of_meals': meal_plan['number_of_meals'],
-                'preferred_cuisine': meal_plan['preferred_cuisine'],
-                'meals': meal_plan['meals'],
-                'grocery_list': meal_plan['grocery_list'],
-                'date': meal_plan['date']
-            }
+            'data': format_meal_plan(hydrate_meal_plans([meal_plan])[0], user)
         }
         
-        return jsonify(response)
+        return jsonify(response), 200, etag_headers(etag)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Server error'
+        }), 500
+
+@api.route('/api/meals/<plan_id>/meals/<int:index>', methods=['PATCH'])
+@token_required
+def swap_meal_route(current_user_id, plan_id, index):
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        result = swap_plan_meal(current_user_id, plan_id, index, data.get('recipeId'))
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+    except MealSwapError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), e.status
     except Exception as e:
         return jsonify({
             'success': False,
@@ -454,19 +1777,49 @@ def get_specific_meal_plan(current_user_id, plan_id):
         }), 500
 
 # Error handling middleware
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({
-        'success': False,
-        'message': 'Route not found'
-    }), 404
+# Messages for errors raised outside the route handlers, shared with the
+# ASGI server so both answer them with the same body
+ERROR_MESSAGES = {
+    400: 'Request body is not valid JSON',
+    404: 'Route not found',
+    405: 'Method not allowed',
+    415: 'Request body must be JSON (Content-Type: application/json)',
+    500: 'Something went wrong!'
+}
 
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify({
-        'success': False,
-        'message': 'Something went wrong!'
-    }), 500
+def error_body(status):
+    """Response body for an ERROR_MESSAGES status"""
+    return {'success': False, 'message': ERROR_MESSAGES[status]}
+
+@api.app_errorhandler(400)
+@api.app_errorhandler(404)
+@api.app_errorhandler(405)
+@api.app_errorhandler(415)
+@api.app_errorhandler(500)
+def error_response(error):
+    status = getattr(error, 'code', 500)
+    return jsonify(error_body(status)), status
+
+def create_app(config=None):
+    """Create the Flask app serving the api blueprint
+
+    app.config starts from DEFAULT_CONFIG and is updated with `config`; the
+    app's AppResources are built from it.  No database connection is made,
+    no rate limit file is opened and the recipe catalog is not loaded until
+    a request needs them.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(DEFAULT_CONFIG)
+    app.config.from_mapping(config or {})
+    CORS(app)
+    app.json = json_provider(app, app.config['JSON_ENCODER'], app.config['JSON_DATE_FORMAT'],
+                             app.config['JSON_ENSURE_ASCII'])
+    app.json.response = timed('serialize')(app.json.response)
+    app.extensions['mealprep'] = AppResources(app.config)
+    app.register_blueprint(api)
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
\ No newline at end of file
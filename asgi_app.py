@@ -0,0 +1,757 @@
+"""
+Async (ASGI) serving mode for the Python Meal Prep Application
+Serves the same routes as app.py with async handlers on the Motor driver.
+Validation, formatting and generation are shared with app.py, and
+responses are encoded by the Flask app's JSON provider, so bodies are
+byte-for-byte the same as the synchronous server's.
+
+Run with:
+    uvicorn asgi_app:application --host 0.0.0.0 --port 5000 --workers 4
+
+Settings, caches and rate limits are those of app.py's default app, so
+limits share the synchronous server's token buckets.  The sampling profiler
+only applies to the synchronous server; /metrics reports the same histograms
+for both.
+"""
+
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+import jwt
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from werkzeug.exceptions import BadRequest, HTTPException, UnsupportedMediaType
+
+import app as sync_app
+import metrics
+from metrics import current_route, stage
+from storage import create_client
+from plan_storage import cached_bodies, attach_bodies, expand_plan_meals
+from jobs import JobQueueFull, TooManyUserJobs
+from meal_optimizer import NoCandidatesError
+from passwords import PasswordHasherBusy, hash_password, verify_password, needs_rehash, rehash_in_background
+
+# Settings, caches and rate limits of app.py's default app (DEFAULT_CONFIG,
+# read from the environment)
+resources = sync_app.app.extensions['mealprep']
+
+# Threads that run plan generation and blocking password hashing calls
+ASYNC_EXECUTOR_WORKERS = int(os.getenv('ASYNC_EXECUTOR_WORKERS', os.cpu_count() or 4))
+
+_motor_client = None
+_executor = None
+
+
+def get_db():
+    """Return the Motor database, creating the client inside the running loop"""
+    global _motor_client
+    if _motor_client is None:
+        _motor_client = create_client(resources.config['MONGODB_URI'], resources.event_listeners,
+                                      AsyncIOMotorClient, resources.client_options)
+    return _motor_client.mealprep
+
+
+def get_meal_plans_writer():
+    """meal_plans with the same write concern as the synchronous server"""
+    return get_db().get_collection('meal_plans', write_concern=resources.meal_plan_write_concern)
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking or CPU-bound call on the executor"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix='asgi-worker')
+    # The copied context carries the route label to stage timings on the worker
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_executor, context.run, fn, *args)
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers read"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.client = (scope.get('client') or ('',))[0]
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.args = {k: v[0] for k, v in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.body = body
+
+    def get_json(self, silent=False):
+        """Parse the body like Flask's request.get_json()
+
+        A body that is not JSON raises UnsupportedMediaType (wrong
+        Content-Type) or BadRequest, unless `silent`, which returns None.
+        """
+        mimetype = self.headers.get('content-type', '').split(';')[0].strip().lower()
+        if mimetype != 'application/json' and not (mimetype.startswith('application/')
+                                                   and mimetype.endswith('+json')):
+            if silent:
+                return None
+            raise UnsupportedMediaType()
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            if silent:
+                return None
+            raise BadRequest()
+
+    def json_body(self):
+        """Async counterpart of app.json_body"""
+        data = self.get_json()
+        return data if isinstance(data, dict) else {}
+
+
+class StreamingResponse:
+    """Handler result whose body is produced by an async generator"""
+
+    def __init__(self, chunks, mimetype):
+        self.chunks = chunks
+        self.mimetype = mimetype
+
+
+# Routing: (compiled path, methods, handler, route label); first path + method
+# match wins.  Labels use Flask's <name> syntax so both servers' metrics agree.
+ROUTES = []
+
+
+def route(path, methods, auth=False):
+    def register_route(handler):
+        if auth:
+            handler = token_required(handler)
+        label = re.sub(r'\(\?P<(\w+)>[^)]*\)', r'<\1>', path)
+        ROUTES.append((re.compile('^%s$' % path), methods, handler, label))
+        return handler
+    return register_route
+
+
+def token_required(handler):
+    async def decorated(request, **kwargs):
+        token = request.headers.get('x-auth-token')
+
+        if not token:
+            return {'success': False, 'message': 'No token, authorization denied'}, 401
+
+        try:
+            with stage('auth'):
+                data = sync_app.decode_token(token)
+            current_user_id = data['user']['id']
+        except jwt.ExpiredSignatureError:
+            return {'success': False, 'message': 'Token is expired'}, 401
+        except jwt.InvalidTokenError:
+            return {'success': False, 'message': 'Token is not valid'}, 401
+
+        return await handler(request, current_user_id, **kwargs)
+    return decorated
+
+
+async def get_user_summary(user_id):
+    """Async counterpart of app.get_user_summary, sharing its cache"""
+    user = resources.user_summary_cache.get(user_id)
+    if user is None:
+        user = await get_db().users.find_one({'_id': ObjectId(user_id)}, sync_app.USER_SUMMARY_PROJECTION)
+        if user is not None:
+            resources.user_summary_cache.set(user_id, user)
+    return user
+
+
+async def save_meal_plan(meal_plan_doc):
+    """Async counterpart of app.save_meal_plan"""
+    stored, body = sync_app.prepare_storage_doc(meal_plan_doc)
+    if body is not None and resources.plan_body_cache.get(body['_id']) is None:
+        await get_db().plan_bodies.update_one({'_id': body['_id']}, {'$setOnInsert': body}, upsert=True)
+        resources.plan_body_cache.set(body['_id'], body)
+
+    write_behind = sync_app.get_write_behind()
+    if write_behind is None or not write_behind.submit(stored):
+        await get_meal_plans_writer().insert_one(stored)
+
+    recipe_ids = sync_app.plan_recipe_ids(meal_plan_doc['meals'])
+    user_id = str(meal_plan_doc['user'])
+    if recipe_ids and not sync_app.queue_recent_recipes(user_id, recipe_ids):
+        update = sync_app.recent_recipes_update(recipe_ids, resources.config['VARIETY_HISTORY'])
+        await get_db().users.update_one({'_id': ObjectId(user_id)}, update)
+
+
+async def get_recent_recipes(user_id):
+    """Async counterpart of app.get_recent_recipes, sharing its cache"""
+    if not resources.config['VARIETY_HISTORY']:
+        return []
+    recent = resources.recent_recipes_cache.get(user_id)
+    if recent is None:
+        user = await get_db().users.find_one({'_id': ObjectId(user_id)}, sync_app.RECENT_RECIPES_PROJECTION) or {}
+        recent = user.get('recent_recipes', [])
+        resources.recent_recipes_cache.set(user_id, recent)
+    return recent
+
+
+async def hydrate_meal_plans(plans):
+    """Async counterpart of app.hydrate_meal_plans, sharing its body cache"""
+    bodies, missing = cached_bodies(plans, resources.plan_body_cache)
+    if missing:
+        async for body in get_db().plan_bodies.find({'_id': {'$in': missing}}):
+            resources.plan_body_cache.set(body['_id'], body)
+            bodies[body['_id']] = body
+    return expand_plan_meals(attach_bodies(plans, bodies), sync_app.get_catalog())
+
+
+# Auth routes
+@route('/api/auth/register', ['POST'])
+async def register(request):
+    data = request.json_body()
+
+    name = data.get('name')
+    email = data.get('email')
+    password = data.get('password')
+
+    # Validation
+    errors = sync_app.registration_errors(data)
+    if errors:
+        return {'success': False, 'errors': errors}, 400
+
+    db = get_db()
+
+    # Check if user already exists
+    existing_user = await db.users.find_one({'email': email}, sync_app.USER_EXISTS_PROJECTION)
+    if existing_user:
+        return {'success': False, 'message': 'User already exists'}, 400
+
+    # Create new user
+    try:
+        hashed_password = await run_blocking(hash_password, password)
+    except PasswordHasherBusy:
+        return {'success': False, 'message': 'Server busy, please try again'}, 503
+
+    # The unique email index settles concurrent registrations
+    try:
+        result = await db.users.insert_one(sync_app.new_user_doc(name, email, hashed_password))
+    except DuplicateKeyError:
+        return {'success': False, 'message': 'User already exists'}, 400
+    user_id = str(result.inserted_id)
+
+    return {
+        'success': True,
+        'token': sync_app.issue_token(user_id),
+        'user': {'id': user_id, 'name': name, 'email': email}
+    }, 200
+
+
+@route('/api/auth/login', ['POST'])
+async def login(request):
+    data = request.json_body()
+
+    email = data.get('email')
+    password = data.get('password')
+
+    # Validation
+    errors = sync_app.login_errors(data)
+    if errors:
+        return {'success': False, 'errors': errors}, 400
+
+    db = get_db()
+
+    # Check if user exists
+    user = await db.users.find_one({'email': email}, sync_app.USER_LOGIN_PROJECTION)
+    if not user:
+        return {'success': False, 'message': 'Invalid credentials'}, 400
+
+    # Check password
+    try:
+        password_ok = await run_blocking(verify_password, user['password'], password)
+    except PasswordHasherBusy:
+        return {'success': False, 'message': 'Server busy, please try again'}, 503
+    if not password_ok:
+        return {'success': False, 'message': 'Invalid credentials'}, 400
+
+    # Upgrade hashes made with an older iteration count
+    if needs_rehash(user['password']):
+        loop = asyncio.get_running_loop()
+        rehash_in_background(password, lambda new_hash: asyncio.run_coroutine_threadsafe(
+            db.users.update_one(
+                {'_id': user['_id'], 'password': user['password']},
+                {'$set': {'password': new_hash}}
+            ),
+            loop
+        ))
+
+    return {
+        'success': True,
+        'token': sync_app.issue_token(str(user['_id'])),
+        'user': {'id': user['_id'], 'name': user['name'], 'email': user['email']}
+    }, 200
+
+
+@route('/api/auth', ['GET'], auth=True)
+async def get_user(request, current_user_id):
+    user = await get_db().users.find_one({'_id': ObjectId(current_user_id)}, sync_app.USER_PROFILE_PROJECTION)
+    if not user:
+        return {'success': False, 'message': 'User not found'}, 404
+
+    return {'success': True, 'user': sync_app.format_user_profile(user)}, 200
+
+
+# User routes
+@route('/api/users/profile', ['GET'], auth=True)
+async def get_profile(request, current_user_id):
+    user = await get_db().users.find_one({'_id': ObjectId(current_user_id)}, sync_app.USER_PROFILE_PROJECTION)
+    if not user:
+        return {'success': False, 'message': 'User not found'}, 404
+
+    return {'success': True, 'data': sync_app.format_user_profile(user)}, 200
+
+
+@route('/api/users/profile', ['PUT'], auth=True)
+async def update_profile(request, current_user_id):
+    # Validation
+    profile_fields, errors = sync_app.parse_profile_update(request.json_body())
+    if errors:
+        return {'success': False, 'errors': errors}, 400
+
+    try:
+        user = await get_db().users.find_one_and_update(
+            {'_id': ObjectId(current_user_id)},
+            {'$set': profile_fields},
+            projection=sync_app.USER_PROFILE_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if not user:
+            return {'success': False, 'message': 'User not found'}, 404
+
+        # Name and email are echoed from the summary cache
+        resources.user_summary_cache.pop(current_user_id)
+
+        return {'success': True, 'data': sync_app.format_user_profile(user)}, 200
+    except DuplicateKeyError:
+        # Another account already has the email; the unique index rejects it
+        return {'success': False, 'message': 'User already exists'}, 400
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+# Meal routes
+@route('/api/meals/generate', ['POST'], auth=True)
+async def generate_meal_plan_route(request, current_user_id):
+    # Validation
+    preferences, error = sync_app.parse_meal_plan_request(request.get_json())
+    if error:
+        return {'success': False, 'message': error}, 400
+
+    # Prefer: respond-async runs the generation as a background job
+    if 'respond-async' in request.headers.get('prefer', ''):
+        try:
+            await run_blocking(sync_app.check_plan_candidates, preferences)
+            job = await run_blocking(sync_app.get_job_runner().submit, current_user_id, 'generate',
+                                     sync_app.run_meal_plan_job, current_user_id, preferences)
+        except NoCandidatesError as e:
+            return {'success': False, 'message': str(e)}, 400
+        except TooManyUserJobs:
+            return {'success': False, 'message': 'Too many active jobs'}, 429
+        except JobQueueFull:
+            return {'success': False, 'message': 'Server busy, try again shortly'}, 503
+        except Exception as e:
+            return {'success': False, 'message': 'Server error'}, 500
+        return ({'success': True, 'data': sync_app.format_job(job)}, 202,
+                {'Location': '/api/meals/jobs/%s' % job['_id']})
+
+    if preferences['number_of_meals'] > resources.config['MAX_SYNC_MEALS']:
+        return {
+            'success': False,
+            'message': 'numberOfMeals above %d must be generated as a job (Prefer: respond-async)'
+                       % resources.config['MAX_SYNC_MEALS']
+        }, 400
+
+    try:
+        user = await get_user_summary(current_user_id)
+        if not user:
+            return {'success': False, 'message': 'User not found'}, 404
+
+        # Generation is CPU-bound and stays off the event loop
+        recent = await get_recent_recipes(current_user_id)
+        meal_plan_doc = await run_blocking(sync_app.build_meal_plan_doc, current_user_id, preferences, recent)
+        await save_meal_plan(meal_plan_doc)
+
+        return {'success': True, 'data': sync_app.format_meal_plan(meal_plan_doc, user)}, 200
+    except NoCandidatesError as e:
+        return {'success': False, 'message': str(e)}, 400
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+@route('/api/meals/generate-batch', ['POST'], auth=True)
+async def generate_meal_plan_batch_route(request, current_user_id):
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+
+    # Validation
+    if not isinstance(items, list) or not items:
+        return {'success': False, 'message': 'Missing required fields'}, 400
+    max_batch_size = resources.config['MAX_BATCH_SIZE']
+    if len(items) > max_batch_size:
+        return {'success': False, 'message': 'Batch is limited to %d items' % max_batch_size}, 400
+
+    try:
+        # The batch pipeline (worker pool + insert_many per chunk) runs as a
+        # whole on the executor
+        results = await run_blocking(
+            sync_app.generate_meal_plans_batch,
+            [(current_user_id, item) for item in items]
+        )
+        failed = sum(1 for result in results if not result['success'])
+
+        return {
+            'success': True,
+            'data': {
+                'generated': len(results) - failed,
+                'failed': failed,
+                'results': results
+            }
+        }, 200
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+@route('/api/meals/my-plans', ['GET'], auth=True)
+async def get_user_meal_plans(request, current_user_id):
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'ndjson'):
+        return {'success': False, 'message': 'Unsupported format'}, 400
+
+    try:
+        limit = int(request.args.get('limit', resources.config['PLAN_PAGE_SIZE']))
+    except ValueError:
+        limit = 0
+    if output_format == 'json' and (limit < 1 or limit > resources.config['MAX_PLAN_PAGE_SIZE']):
+        return {
+            'success': False,
+            'message': 'Limit must be between 1 and %d' % resources.config['MAX_PLAN_PAGE_SIZE']
+        }, 400
+
+    # Keyset pagination on (date, _id), newest first
+    query = {'user': ObjectId(current_user_id)}
+    page_token = request.args.get('next')
+    if page_token:
+        try:
+            last_date, last_id = sync_app.decode_page_token(page_token)
+        except ValueError:
+            return {'success': False, 'message': 'Invalid pagination token'}, 400
+        query['$or'] = [
+            {'date': {'$lt': last_date}},
+            {'date': last_date, '_id': {'$lt': last_id}}
+        ]
+
+    try:
+        user = await get_user_summary(current_user_id)
+        if not user:
+            return {'success': False, 'message': 'User not found'}, 404
+
+        cursor = (
+            get_db().meal_plans.find(query, sync_app.MEAL_PLAN_PROJECTION)
+            .sort([('date', -1), ('_id', -1)])
+        )
+
+        if output_format == 'ndjson':
+            return StreamingResponse(stream_meal_plans(cursor, user), 'application/x-ndjson'), 200
+
+        # Revalidation reads only _id and rev of the page
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match:
+            versions = await (
+                get_db().meal_plans.find(query, sync_app.MEAL_PLAN_ETAG_PROJECTION)
+                .sort([('date', -1), ('_id', -1)])
+                .limit(limit + 1)
+            ).to_list(length=limit + 1)
+            etag = sync_app.meal_plans_etag(versions[:limit], user, len(versions) > limit)
+            if sync_app.etag_matches(if_none_match, etag):
+                return None, 304, sync_app.etag_headers(etag)
+
+        # Fetch one extra plan to learn whether another page exists
+        meal_plans = await cursor.limit(limit + 1).to_list(length=limit + 1)
+        next_token = None
+        if len(meal_plans) > limit:
+            meal_plans = meal_plans[:limit]
+            next_token = sync_app.encode_page_token(meal_plans[-1]['date'], meal_plans[-1]['_id'])
+        etag = sync_app.meal_plans_etag(meal_plans, user, next_token is not None)
+
+        return {
+            'success': True,
+            'data': [sync_app.format_meal_plan(plan, user) for plan in await hydrate_meal_plans(meal_plans)],
+            'next': next_token
+        }, 200, sync_app.etag_headers(etag)
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+async def stream_meal_plans(cursor, user):
+    """Async counterpart of app.stream_meal_plans"""
+    batch_size = resources.config['EXPORT_BATCH_SIZE']
+    cursor.batch_size(batch_size)
+    try:
+        batch = []
+        async for plan in cursor:
+            batch.append(plan)
+            if len(batch) == batch_size:
+                for plan in await hydrate_meal_plans(batch):
+                    yield sync_app.app.json.dumps(sync_app.format_meal_plan(plan, user)) + '\n'
+                batch = []
+        for plan in await hydrate_meal_plans(batch):
+            yield sync_app.app.json.dumps(sync_app.format_meal_plan(plan, user)) + '\n'
+    finally:
+        await cursor.close()
+
+
+@route('/api/meals/jobs/(?P<job_id>[^/]+)', ['GET'], auth=True)
+async def get_meal_plan_job(request, current_user_id, job_id):
+    try:
+        # Job state is read through the same store the workers write to
+        job = await run_blocking(sync_app.get_job_runner().get, ObjectId(job_id))
+        if not job or str(job['user']) != current_user_id:
+            return {'success': False, 'message': 'Job not found'}, 404
+        return {'success': True, 'data': sync_app.format_job(job)}, 200
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+@route('/api/meals/stats', ['GET'], auth=True)
+async def get_meal_plan_stats(request, current_user_id):
+    interval = request.args.get('interval', 'week')
+    if interval not in sync_app.STATS_INTERVALS:
+        return {
+            'success': False,
+            'message': 'Interval must be one of %s' % ', '.join(sync_app.STATS_INTERVALS)
+        }, 400
+
+    query = {'user': ObjectId(current_user_id)}
+    date_range, error = sync_app.parse_date_range(request.args)
+    if error:
+        return {'success': False, 'message': error}, 400
+    if date_range:
+        query['date'] = date_range
+
+    try:
+        cursor = get_db().meal_plans.aggregate(sync_app.plan_stats_pipeline(query, interval))
+        rows = [row async for row in cursor]
+        return {'success': True, 'data': sync_app.format_plan_stats(rows)}, 200
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+@route('/api/meals/grocery-list', ['GET'], auth=True)
+async def get_combined_grocery_list(request, current_user_id):
+    query = {'user': ObjectId(current_user_id)}
+    date_range, error = sync_app.parse_date_range(request.args)
+    if error:
+        return {'success': False, 'message': error}, 400
+    if date_range:
+        query['date'] = date_range
+
+    try:
+        cursor = get_db().meal_plans.aggregate(sync_app.grocery_list_pipeline(query))
+        rows = [row async for row in cursor]
+        return {'success': True, 'data': sync_app.merge_grocery_rows(rows)}, 200
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+@route('/api/meals/(?P<plan_id>[^/]+)/meals/(?P<index>[0-9]+)', ['PATCH'], auth=True)
+async def swap_meal_route(request, current_user_id, plan_id, index):
+    data = request.get_json(silent=True) or {}
+    recipe_id = data.get('recipeId')
+
+    try:
+        # A read and one targeted update on the synchronous driver
+        result = await run_blocking(sync_app.swap_plan_meal, current_user_id, plan_id, int(index), recipe_id)
+        return {'success': True, 'data': result}, 200
+    except sync_app.MealSwapError as e:
+        return {'success': False, 'message': str(e)}, e.status
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+@route('/api/meals/(?P<plan_id>[^/]+)', ['GET'], auth=True)
+async def get_specific_meal_plan(request, current_user_id, plan_id):
+    try:
+        # Revalidation reads only the owner and rev; the full plan is read on a miss
+        if_none_match = request.headers.get('if-none-match')
+        projection = sync_app.MEAL_PLAN_ETAG_PROJECTION if if_none_match else None
+        meal_plan = await get_db().meal_plans.find_one({'_id': ObjectId(plan_id)}, projection)
+
+        if not meal_plan:
+            return {'success': False, 'message': 'Meal plan not found'}, 404
+
+        # Check if user owns the meal plan
+        if str(meal_plan['user']) != current_user_id:
+            return {'success': False, 'message': 'User not authorized'}, 401
+
+        user = await get_user_summary(current_user_id)
+        etag = sync_app.meal_plans_etag([meal_plan], user)
+        if projection is not None:
+            if sync_app.etag_matches(if_none_match, etag):
+                return None, 304, sync_app.etag_headers(etag)
+            meal_plan = await get_db().meal_plans.find_one({'_id': meal_plan['_id']})
+            etag = sync_app.meal_plans_etag([meal_plan], user)
+
+        await hydrate_meal_plans([meal_plan])
+        return {'success': True, 'data': sync_app.format_meal_plan(meal_plan, user)}, 200, sync_app.etag_headers(etag)
+    except Exception as e:
+        return {'success': False, 'message': 'Server error'}, 500
+
+
+@route('/metrics', ['GET'])
+async def metrics_route(request):
+    return StreamingResponse(_chunks(metrics.render()), 'text/plain; version=0.0.4'), 200
+
+
+@route('/api/cache/stats', ['GET'])
+async def cache_stats(request):
+    return {'success': True, 'data': resources.cache_stats()}, 200
+
+
+# ASGI plumbing
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _cors_headers():
+    return [(b'access-control-allow-origin', b'*')]
+
+
+async def _send_json(send, payload, status, headers=None):
+    # Same encoder and framing as flask.jsonify
+    response = sync_app.app.json.response(payload)
+    body = response.get_data()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', response.mimetype.encode()),
+            (b'content-length', str(len(body)).encode())
+        ] + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()] + _cors_headers()
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_not_modified(send, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': 304,
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()] + _cors_headers()
+    })
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _send_stream(send, result, status):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', result.mimetype.encode())] + _cors_headers()
+    })
+    async for chunk in result.chunks:
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Load the catalog and create missing indexes before the first request
+            await run_blocking(sync_app.get_catalog)
+            if resources.config['MONGO_ENSURE_INDEXES']:
+                await run_blocking(sync_app.get_db)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await run_blocking(sync_app.flush_write_behind)
+            if _motor_client is not None:
+                _motor_client.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope, await _read_body(receive))
+
+    if request.method == 'OPTIONS':
+        # CORS preflight
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': _cors_headers() + [
+                (b'access-control-allow-methods', b'GET, POST, PUT, PATCH, OPTIONS'),
+                (b'access-control-allow-headers', request.headers.get('access-control-request-headers', '*').encode())
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    start = time.perf_counter()
+    status = await _respond(request, send)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, current_route.get(), status)
+
+
+async def _respond(request, send):
+    """Route `request`, send its response and return the status"""
+    current_route.set('unmatched')
+    path_matched = False
+    for pattern, methods, handler, label in ROUTES:
+        match = pattern.match(request.path)
+        if not match:
+            continue
+        path_matched = True
+        if request.method in methods:
+            break
+    else:
+        status = 405 if path_matched else 404
+        await _send_json(send, sync_app.error_body(status), status)
+        return status
+
+    current_route.set(label)
+    rate_limiter = resources.rate_limiter()
+    if rate_limiter is not None:
+        retry_after = rate_limiter.check(label, request.client)
+        if retry_after is not None:
+            await _send_json(send, {'success': False, 'message': 'Too many requests, please try again later'}, 429,
+                             {'Retry-After': str(math.ceil(retry_after))})
+            return 429
+
+    # Handlers return (payload, status) or (payload, status, extra headers)
+    try:
+        result, status, *headers = await handler(request, **match.groupdict())
+    except HTTPException as e:
+        # A body that is not JSON, as Flask's error handlers answer it
+        await _send_json(send, sync_app.error_body(e.code), e.code)
+        return e.code
+    except Exception:
+        await _send_json(send, sync_app.error_body(500), 500)
+        return 500
+
+    if isinstance(result, StreamingResponse):
+        await _send_stream(send, result, status)
+    elif status == 304:
+        await _send_not_modified(send, *headers)
+    else:
+        await _send_json(send, result, status, *headers)
+    return status
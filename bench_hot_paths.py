@@ -0,0 +1,238 @@
+"""
+Hot path benchmarks for the Python Meal Prep Application
+Times plan and meal generation, grocery aggregation, email validation, JWT
+handling, response formatting and the generate route at plan sizes from 4
+to 10,000 meals, plus generation over a synthetic catalog of 50,000 recipes,
+and compares each case with a stored JSON baseline:
+
+    python bench_hot_paths.py                      compare with bench_baseline.json
+    python bench_hot_paths.py --save               record the results as the baseline
+    python bench_hot_paths.py --only generate --threshold 10
+    python bench_hot_paths.py --catalog-size 0     skip the synthetic catalog cases
+
+Exits with status 1 when a case is slower than its baseline by more than
+--threshold percent.  Runs offline: MongoDB is replaced by mongomock, and
+the route case is skipped when mongomock is not installed.
+"""
+
+import argparse
+from functools import partial
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+# Settings read when app.py is imported
+os.environ.setdefault('RATE_LIMIT_STORAGE', 'off')
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+os.environ.setdefault('PASSWORD_HASH_ITERATIONS', '1000')
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+else:
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+
+from bson import ObjectId
+import jwt
+
+import app
+from grocery import GroceryAggregator
+from recipe_catalog import DEFAULT_CATALOG_PATH, MACRO_FIELDS, RecipeCatalog
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+DEFAULT_SIZES = (4, 28, 1000, 10000)
+DEFAULT_THRESHOLD = float(os.getenv('BENCH_THRESHOLD', 25))
+DEFAULT_CATALOG_SIZE = 50000
+CUISINES = ('mediterranean', 'asian', 'american', 'mexican', 'italian', 'indian', 'french', 'thai')
+
+PREFERENCES = {
+    'dietary_preference': 'omnivore',
+    'allergies': ['nuts'],
+    'nutritional_goal': 'maintenance',
+    'preferred_cuisine': 'any'
+}
+
+
+def aggregate_grocery_list(catalog, positions):
+    grocery = GroceryAggregator()
+    for position in positions:
+        grocery.add(catalog.grocery_items(position))
+    return grocery.to_dict()
+
+
+def stored_plan(plan, user, number_of_meals):
+    """A meal_plans document as my-plans and GET /api/meals/:id read it"""
+    return dict(plan, _id=ObjectId(), user=user['_id'], number_of_meals=number_of_meals,
+                date=app.now_millis(), **PREFERENCES)
+
+
+def format_response(application, plan, user):
+    return application.json.response({'success': True, 'data': app.format_meal_plan(plan, user)}).get_data()
+
+
+def synthetic_catalog(size, seed=0):
+    """A catalog of `size` recipes: the bundled ones repeated with new ids, macros and cuisines"""
+    with open(DEFAULT_CATALOG_PATH) as f:
+        bundled = json.load(f)
+    rng = random.Random(seed)
+    records = []
+    for i in range(size):
+        record = dict(bundled[i % len(bundled)], cuisine=rng.choice(CUISINES))
+        record['id'] = '%s-%d' % (record['id'], i)
+        record['name'] = '%s %d' % (record['name'], i)
+        for field in MACRO_FIELDS:
+            record[field] = max(int(record[field] * rng.uniform(0.7, 1.3)), 1)
+        records.append(record)
+    return RecipeCatalog(records)
+
+
+def with_catalog(catalog, fn):
+    """Call `fn` with `catalog` as the app's recipe catalog"""
+    bundled, app._catalog = app._catalog, catalog
+    try:
+        return fn()
+    finally:
+        app._catalog = bundled
+
+
+def generate_route(client, headers, body):
+    response = client.post('/api/meals/generate', json=body, headers=headers)
+    assert response.status_code == 200, response.status
+
+
+def cases(sizes, catalog_size):
+    """(name, zero-argument callable) for every benchmarked hot path"""
+    catalog = app.get_catalog()
+    application = app.create_app()
+    user = {'_id': ObjectId(), 'name': 'Benchmark User', 'email': 'bench@example.com'}
+    token = app.issue_token(str(user['_id']))
+
+    yield 'validate_email', partial(app.validate_email, 'someone.else@example.co.uk')
+    yield 'jwt_encode', partial(app.issue_token, str(user['_id']))
+    yield 'jwt_decode', partial(jwt.decode, token, app.app.config['JWT_SECRET'], algorithms=['HS256'])
+    yield 'jwt_decode_cached', partial(app.decode_token, token)
+    yield 'generate_meal', partial(app.generate_meal, 'dinner', 'vegetarian', 'any', 'weight-loss')
+
+    for size in sizes:
+        generate = partial(app.compute_meal_plan, number_of_meals=size, **PREFERENCES)
+        plan = generate()
+        positions = [catalog.position(meal['recipe_id']) for meal in plan['meals']]
+        yield 'generate_meal_plan[%d]' % size, generate
+        yield 'grocery_list[%d]' % size, partial(aggregate_grocery_list, catalog, positions)
+        yield 'format_response[%d]' % size, partial(
+            format_response, application, stored_plan(plan, user, size), user)
+
+    plan = app.compute_meal_plan(number_of_meals=28, **PREFERENCES)
+    recent = app.plan_recipe_ids(plan['meals'])
+    yield 'generate_meal_plan[28,variety]', partial(
+        app.compute_meal_plan, number_of_meals=28, recent=recent, **PREFERENCES)
+    yield 'generate_meal_plan[28,variety,memoized]', partial(
+        app.generate_meal_plan, number_of_meals=28, recent=recent, **PREFERENCES)
+    yield 'generate_meal_plan[28,search]', partial(
+        app.compute_meal_plan, number_of_meals=28, optimizer='search', **PREFERENCES)
+
+    if catalog_size:
+        large = synthetic_catalog(catalog_size)
+        generate = partial(app.compute_meal_plan, number_of_meals=28, **PREFERENCES)
+        recent = app.plan_recipe_ids(with_catalog(large, generate)['meals'])
+        yield 'generate_meal_plan[28,catalog=%d]' % catalog_size, partial(with_catalog, large, generate)
+        yield 'generate_meal_plan[28,variety,catalog=%d]' % catalog_size, partial(
+            with_catalog, large, partial(generate, recent=recent))
+
+    if mongomock is None:
+        print('generate_route skipped: requires mongomock', file=sys.stderr)
+        return
+    client = application.test_client()
+    response = client.post('/api/auth/register', json={
+        'name': user['name'], 'email': user['email'], 'password': 'benchmark1'
+    })
+    body = {'dietaryPreference': 'omnivore', 'allergies': ['nuts'], 'nutritionalGoal': 'maintenance',
+            'numberOfMeals': 28, 'preferredCuisine': 'any'}
+    yield 'generate_route[28]', partial(
+        generate_route, client, {'x-auth-token': response.get_json()['token']}, body)
+
+
+def measure(cases, repeat):
+    """Best seconds per call of each case over `repeat` rounds
+
+    Every round times each case once for at least 0.2 s, so a slow spell on
+    the machine costs one sample of several cases rather than every sample
+    of one case.
+    """
+    timers = []
+    for name, fn in cases:
+        timer = timeit.Timer(fn)
+        timers.append((name, timer, timer.autorange()[0]))
+    best = {}
+    for _ in range(repeat):
+        for name, timer, number in timers:
+            seconds = timer.timeit(number) / number
+            best[name] = min(best.get(name, seconds), seconds)
+    return best
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def environment():
+    return {'machine': platform.machine(), 'processor': platform.processor(), 'python': platform.python_version()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help='write the results to the baseline file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown in percent (BENCH_THRESHOLD, default 25)')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='plan sizes in meals')
+    parser.add_argument('--only', default='', help='run cases whose name contains this text')
+    parser.add_argument('--catalog-size', type=int, default=DEFAULT_CATALOG_SIZE,
+                        help='recipes in the synthetic catalog (0 skips those cases)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    expected = baseline.get('results', {})
+    if baseline and baseline.get('environment') != environment():
+        print('Baseline recorded on %s; timings may not be comparable' % baseline.get('environment'),
+              file=sys.stderr)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    results = measure([case for case in cases(sizes, args.catalog_size) if args.only in case[0]],
+                      args.repeat)
+    regressed = []
+    print('%-44s %12s %12s %9s' % ('case', 'us/call', 'baseline', 'change'))
+    for name, seconds in results.items():
+        line = '%-44s %12.2f' % (name, seconds * 1e6)
+        if name in expected:
+            change = (seconds / expected[name] - 1) * 100
+            line += ' %12.2f %+8.1f%%' % (expected[name] * 1e6, change)
+            if change > args.threshold:
+                regressed.append(name)
+                line += '  REGRESSED'
+        print(line)
+
+    if args.save:
+        # Cases not run this time keep their recorded timings
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'results': dict(expected, **results)},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved %d results to %s' % (len(results), args.baseline))
+    elif regressed:
+        print('%d case(s) regressed by more than %.0f%%: %s' % (len(regressed), args.threshold,
+                                                             ', '.join(regressed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+JSON encoding benchmark for the Python Meal Prep Application
+Times formatting and encoding of a my-plans response holding 500 stored
+plans, and the memory allocated while doing it, for three encoders:
+
+    legacy   Flask's default provider, with ObjectId fields converted by hand
+    stdlib   json_provider.MongoJSONProvider, documents passed through
+    orjson   json_provider.OrjsonProvider, documents passed through
+
+    python bench_json.py --plans 500 --meals 28
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import statistics
+import time
+import tracemalloc
+
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from grocery import GroceryAggregator
+from json_provider import JSON_ENCODERS, json_provider
+from meal_optimizer import optimize_plan, plan_totals
+from recipe_catalog import MEAL_TYPES, load_catalog
+
+
+def build_plans(count, number_of_meals):
+    """Stored meal_plans documents as my-plans reads them, plus their owner"""
+    catalog = load_catalog()
+    candidates = {meal_type: catalog.candidates(meal_type, 'any', 'maintenance') for meal_type in MEAL_TYPES}
+    positions = optimize_plan(catalog.macros, candidates, number_of_meals, 'maintenance')
+    grocery = GroceryAggregator()
+    for position in positions:
+        grocery.add(catalog.grocery_items(position))
+    totals = plan_totals(catalog.macros, positions)
+    days = -(-number_of_meals // 4)
+
+    user = {'_id': ObjectId(), 'name': 'Benchmark User', 'email': 'bench@example.com'}
+    start = datetime(2026, 1, 1)
+    plans = []
+    for i in range(count):
+        plans.append({
+            '_id': ObjectId(),
+            'user': user['_id'],
+            'dietary_preference': 'omnivore',
+            'allergies': ['nuts'],
+            'nutritional_goal': 'maintenance',
+            'number_of_meals': number_of_meals,
+            'preferred_cuisine': 'any',
+            'meals': [catalog.meal(position) for position in positions],
+            'grocery_list': grocery.to_dict(),
+            'totals': totals,
+            'daily_average': {field: round(value / days, 1) for field, value in totals.items()},
+            'date': start + timedelta(hours=i)
+        })
+    return plans, user
+
+
+def format_plan(plan, user, convert):
+    # Same shape as app.format_meal_plan; `convert` is applied to ObjectIds
+    return {
+        '_id': convert(plan['_id']),
+        'user': {'id': convert(user['_id']), 'name': user['name'], 'email': user['email']},
+        'dietary_preference': plan['dietary_preference'],
+        'allergies': plan['allergies'],
+        'nutritional_goal': plan['nutritional_goal'],
+        'number_of_meals': plan['number_of_meals'],
+        'preferred_cuisine': plan['preferred_cuisine'],
+        'meals': plan['meals'],
+        'grocery_list': plan['grocery_list'],
+        'totals': plan.get('totals'),
+        'daily_average': plan.get('daily_average'),
+        'date': plan['date']
+    }
+
+
+def encoders():
+    """(name, app, ObjectId conversion) for every available encoder"""
+    legacy = Flask('legacy')
+    legacy.json = DefaultJSONProvider(legacy)
+    yield 'legacy', legacy, str
+    for name in JSON_ENCODERS:
+        app = Flask(name)
+        try:
+            app.json = json_provider(app, name)
+        except RuntimeError as e:
+            print('%-8s skipped: %s' % (name, e))
+            continue
+        yield name, app, lambda value: value
+
+
+def measure(app, convert, plans, user, repeat):
+    """Return (median ms, peak KB allocated, response KB) for one my-plans response"""
+    def respond():
+        data = [format_plan(plan, user, convert) for plan in plans]
+        return app.json.response({'success': True, 'data': data, 'next': None}).get_data()
+
+    body = respond()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        respond()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    respond()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1024, len(body) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--plans', type=int, default=500)
+    parser.add_argument('--meals', type=int, default=28)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    plans, user = build_plans(args.plans, args.meals)
+    print('%d plans of %d meals' % (args.plans, args.meals))
+    print('%-8s %10s %12s %12s' % ('encoder', 'median ms', 'peak KB', 'body KB'))
+    for name, app, convert in encoders():
+        elapsed, peak, size = measure(app, convert, plans, user, args.repeat)
+        print('%-8s %10.1f %12.0f %12.0f' % (name, elapsed, peak, size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Startup benchmark for the Python Meal Prep Application
+Times, in a fresh interpreter per run, what a new server process pays before
+it answers its first requests:
+
+    import        importing app.py (no database connection is made)
+    create_app    building a Flask app with create_app()
+    register      the first request: MongoDB client, indexes, password hash
+    generate      the first generation: recipe catalog load, plan, save
+
+    python bench_startup.py --runs 5 --mongomock
+
+--mongomock runs against an in-memory stand-in instead of MONGODB_URI, so the
+first-request times then exclude network round trips.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = r'''
+import json, sys, time
+if sys.argv[1] == '1':
+    import mongomock, pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+timings = {}
+start = time.perf_counter()
+import app
+timings['import'] = time.perf_counter() - start
+
+start = time.perf_counter()
+application = app.create_app({'TESTING': True})
+timings['create_app'] = time.perf_counter() - start
+
+client = application.test_client()
+start = time.perf_counter()
+response = client.post('/api/auth/register', json={
+    'name': 'Startup', 'email': 'startup-%d@example.com' % time.time_ns(), 'password': 'startup1'
+})
+timings['register'] = time.perf_counter() - start
+token = response.get_json()['token']
+
+start = time.perf_counter()
+client.post('/api/meals/generate', headers={'x-auth-token': token}, json={
+    'dietaryPreference': 'omnivore', 'allergies': [], 'nutritionalGoal': 'maintenance',
+    'numberOfMeals': 28, 'preferredCuisine': 'any'
+})
+timings['generate'] = time.perf_counter() - start
+print(json.dumps(timings))
+'''
+
+STEPS = ('import', 'create_app', 'register', 'generate')
+
+
+def run_once(mongomock):
+    """Time one cold start in a new interpreter; returns {step: seconds}"""
+    env = dict(os.environ, RATE_LIMIT_STORAGE='off', PASSWORD_HASH_WORKERS='0',
+               PASSWORD_HASH_ITERATIONS=os.getenv('PASSWORD_HASH_ITERATIONS', '1000'))
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, '1' if mongomock else '0'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--mongomock', action='store_true')
+    args = parser.parse_args()
+
+    runs = [run_once(args.mongomock) for _ in range(args.runs)]
+    print('%d cold starts%s' % (args.runs, ' on mongomock' if args.mongomock else ''))
+    print('%-12s %10s %10s' % ('step', 'median ms', 'max ms'))
+    for step in STEPS:
+        values = [run[step] * 1000 for run in runs]
+        print('%-12s %10.1f %10.1f' % (step, statistics.median(values), max(values)))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,13 @@ import React, { useState, useEffect } from 'react';
 import { Container, Row, Col, Form, Button, Alert, Card, Tab, Tabs } from 'react-bootstrap';
 import axios from 'axios';
 
+// Grocery items are plain names, or { name, quantity, unit } from the Python API
+const formatGroceryItem = (item) => {
+  if (typeof item === 'string') return item;
+  const quantity = Math.round(item.quantity * 100) / 100;
+  return item.unit ? `${item.name} (${quantity} ${item.unit})` : `${item.name} (${quantity})`;
+};
+
 const MealPlanner = () => {
   const [formData, setFormData] = useState({
     dietaryPreference: 'omnivore',
@@ -192,7 +199,7 @@ const MealPlanner = () => {
                                 <Card.Body>
                                   <ul className="list-unstyled">
                                     {items.map((item, idx) => (
-                                      <li key={idx}>{item}</li>
+                                      <li key={idx}>{formatGroceryItem(item)}</li>
                                     ))}
                                   </ul>
                                 </Card.Body>
@@ -0,0 +1,198 @@
+"""
+Grocery list aggregation for the Python Meal Prep Application
+Ingredients from every meal of a plan are merged into one entry per item and
+unit, with quantities summed, and grouped into the grocery list categories.
+"""
+
+GROCERY_CATEGORIES = ('produce', 'grains', 'proteins', 'dairy', 'pantry')
+DEFAULT_CATEGORY = 'pantry'
+
+# Category of each known ingredient; anything else is pantry
+INGREDIENT_CATEGORIES = {}
+for _category, _ingredients in {
+    'produce': (
+        'Apple', 'Arugula', 'Avocado', 'Banana', 'Basil', 'Bell peppers', 'Broccoli', 'Cabbage', 'Carrots',
+        'Cauliflower', 'Cilantro', 'Corn', 'Cucumber', 'Eggplant', 'Garlic', 'Ginger', 'Herbs', 'Jicama',
+        'Lemon', 'Lettuce', 'Lime', 'Mixed berries', 'Mixed greens', 'Onion', 'Parsley', 'Peas', 'Pineapple',
+        'Red onion', 'Romaine', 'Scallions', 'Spinach', 'Sweet potato', 'Tomatoes', 'Zucchini'
+    ),
+    'grains': (
+        'Brown rice', 'Corn tortillas', 'Couscous', 'Flattened rice', 'Oats', 'Pasta', 'Quinoa', 'Rice',
+        'Soba noodles', 'Whole grain bagel', 'Whole wheat tortilla'
+    ),
+    'proteins': (
+        'Almonds', 'Bacon', 'Beef jerky', 'Black beans', 'Cannellini beans', 'Chicken breast', 'Chicken thighs',
+        'Chickpeas', 'Edamame', 'Egg whites', 'Eggs', 'Ground lamb', 'Ground turkey', 'Kidney beans', 'Lentils',
+        'Peanuts', 'Pine nuts', 'Salmon', 'Shrimp', 'Sirloin steak', 'Skirt steak', 'Smoked salmon', 'Tofu',
+        'Tuna', 'Turkey breast', 'Whey protein'
+    ),
+    'dairy': (
+        'Blue cheese', 'Butter', 'Cheddar', 'Cottage cheese', 'Cream cheese', 'Feta cheese', 'Ghee',
+        'Greek yogurt', 'Heavy cream', 'Milk', 'Mozzarella', 'Parmesan', 'Ricotta'
+    )
+}.items():
+    for _ingredient in _ingredients:
+        INGREDIENT_CATEGORIES[_ingredient] = _category
+del _category, _ingredients, _ingredient
+
+# Units folded into a common base unit so that they can be summed
+UNIT_CONVERSIONS = {
+    'g': ('g', 1),
+    'kg': ('g', 1000),
+    'ml': ('ml', 1),
+    'l': ('ml', 1000),
+    'tsp': ('ml', 5),
+    'tbsp': ('ml', 15),
+    'cup': ('ml', 240)
+}
+
+
+def ingredient_category(name):
+    return INGREDIENT_CATEGORIES.get(name, DEFAULT_CATEGORY)
+
+
+def grocery_item(ingredient):
+    """Normalize a recipe ingredient into a (name, category, quantity, unit) tuple
+
+    `ingredient` is either a name or a dict with 'name' and optional
+    'quantity', 'unit' and 'category'.  A bare name counts as one item with
+    no unit.  Known units are converted to their base unit.
+    """
+    if isinstance(ingredient, str):
+        return ingredient, ingredient_category(ingredient), 1, None
+
+    name = ingredient['name']
+    quantity = ingredient.get('quantity', 1)
+    unit = ingredient.get('unit')
+    if unit is not None:
+        unit = unit.strip().lower()
+        if unit in UNIT_CONVERSIONS:
+            unit, factor = UNIT_CONVERSIONS[unit]
+            quantity = quantity * factor
+    category = ingredient.get('category') or ingredient_category(name)
+    if category not in GROCERY_CATEGORIES:
+        raise ValueError('Unknown grocery category: %s' % category)
+    return name, category, quantity, unit
+
+
+def round_quantity(quantity):
+    """Round summed quantities to 2 decimals, as an int when whole"""
+    if isinstance(quantity, float):
+        quantity = round(quantity, 2)
+        if quantity.is_integer():
+            quantity = int(quantity)
+    return quantity
+
+
+class GroceryAggregator:
+    """Merge grocery items into one entry per (name, unit), in first-seen order"""
+
+    def __init__(self):
+        self._entries = {}
+
+    def add(self, items):
+        """Add (name, category, quantity, unit) tuples, as made by grocery_item()"""
+        entries = self._entries
+        for name, category, quantity, unit in items:
+            entry = entries.get((name, unit))
+            if entry is None:
+                entries[(name, unit)] = [category, quantity]
+            else:
+                entry[1] += quantity
+
+    def to_dict(self):
+        """Return {category: [{name, quantity, unit}, ...]} for every category"""
+        grocery_list = {category: [] for category in GROCERY_CATEGORIES}
+        for (name, unit), (category, quantity) in self._entries.items():
+            grocery_list[category].append({'name': name, 'quantity': round_quantity(quantity), 'unit': unit})
+        return grocery_list
+
+
+def swap_grocery_items(grocery_list, removed, added):
+    """Replace one meal's grocery items with another's in a stored grocery_list
+
+    `removed` and `added` are grocery_item() tuples.  Returns (grocery_list,
+    quantities, replaced): the updated list, {(category, index): quantity}
+    with the new, rounded quantity of entries that merely change, and {category: items} for
+    categories that gain or lose an entry and have to be rewritten.  The work
+    depends on the size of the list and the two meals, not on the plan.
+    Lists of plain names (plans stored before quantities) stay plain: they
+    lose one occurrence per removed ingredient and gain one per added one.
+    """
+    plain = any(isinstance(item, str) for items in grocery_list.values() for item in items)
+    updated = {category: list(items) for category, items in grocery_list.items()}
+    location = {}
+    for category, items in updated.items():
+        for index, item in enumerate(items):
+            if isinstance(item, dict):
+                location[(item['name'], item.get('unit'))] = (category, index)
+
+    changed = set()
+    deltas = {}
+    for name, category, quantity, unit in removed:
+        if (name, unit) in location:
+            deltas.setdefault((name, unit), [category, 0])[1] -= quantity
+            continue
+        for plain_category, items in updated.items():
+            if name in items:
+                items[items.index(name)] = None
+                changed.add(plain_category)
+                break
+    for name, category, quantity, unit in added:
+        if plain:
+            updated.setdefault(category, []).append(name)
+            changed.add(category)
+        else:
+            deltas.setdefault((name, unit), [category, 0])[1] += quantity
+
+    quantities = {}
+    for (name, unit), (category, delta) in deltas.items():
+        if abs(delta) < 1e-9:
+            continue
+        if (name, unit) in location:
+            category, index = location[(name, unit)]
+            item = dict(updated[category][index])
+            item['quantity'] = round_quantity(item['quantity'] + delta)
+            if item['quantity'] > 0:
+                updated[category][index] = item
+                quantities[(category, index)] = item['quantity']
+            else:
+                updated[category][index] = None
+                changed.add(category)
+        elif delta > 0:
+            updated.setdefault(category, []).append({'name': name, 'quantity': round_quantity(delta), 'unit': unit})
+            changed.add(category)
+
+    replaced = {}
+    for category in changed:
+        updated[category] = replaced[category] = [item for item in updated[category] if item is not None]
+    quantities = {key: quantity for key, quantity in quantities.items() if key[0] not in changed}
+    return updated, quantities, replaced
+
+
+def grocery_names(grocery_list):
+    """Return a stored grocery_list as {category: [name, ...]}, the original response shape"""
+    return {category: [item if isinstance(item, str) else item['name'] for item in items]
+            for category, items in grocery_list.items()}
+
+
+def grocery_quantities(grocery_list):
+    """Return a stored grocery_list as {category: [{name, quantity, unit}, ...]}
+
+    Lists of plain names (plans stored before quantities) count each
+    occurrence of a name as one, as the combined grocery list does.
+    """
+    quantities = {}
+    for category, items in grocery_list.items():
+        counted = {}
+        entries = []
+        for item in items:
+            if not isinstance(item, str):
+                entries.append(item)
+            elif item in counted:
+                counted[item]['quantity'] += 1
+            else:
+                counted[item] = {'name': item, 'quantity': 1, 'unit': None}
+                entries.append(counted[item])
+        quantities[category] = entries
+    return quantities
@@ -0,0 +1,222 @@
+"""
+Background jobs for the Python Meal Prep Application
+Large meal plans are generated by a local worker pool instead of on the
+request thread.  Job state lives in a store shared by every server process
+(the meal_plan_jobs collection), or in memory as a single-process stand-in
+for tests and local development.
+
+A queued or running job holds one of its user's slots and a lease that the
+process running it renews.  A job whose lease runs out, because its process
+died, is marked failed and its slot is freed.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from process_local import ProcessLocal
+
+logger = logging.getLogger(__name__)
+
+JOB_BACKENDS = ('mongo', 'memory')
+ACTIVE_STATES = ('queued', 'running')
+
+
+class JobQueueFull(Exception):
+    """Raised when MAX_PENDING jobs are already queued or running in this process"""
+
+
+class TooManyUserJobs(Exception):
+    """Raised when a user already has their allowed number of active jobs"""
+
+
+def slot_key(user_id, slot):
+    return '%s:%d' % (user_id, slot)
+
+
+class MongoJobStore:
+    """Job documents in a MongoDB collection
+
+    Active jobs carry a 'slot' key that is unique across the collection
+    (a sparse unique index), so claiming one of a user's slots is a single
+    atomic insert shared by every process.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def claim(self, job, limit):
+        """Insert `job` holding one of its user's `limit` slots; False when all are taken"""
+        for slot in range(limit):
+            try:
+                self.collection.insert_one(dict(job, slot=slot_key(job['user'], slot)))
+            except DuplicateKeyError:
+                continue
+            return True
+        return False
+
+    def update(self, job_id, fields):
+        self.collection.update_one({'_id': job_id}, {'$set': fields})
+
+    def finish(self, job_id, fields):
+        """Record a job's final fields and free its slot"""
+        self.collection.update_one({'_id': job_id}, {'$set': fields, '$unset': {'slot': '', 'expires': ''}})
+
+    def renew(self, job_ids, expires):
+        self.collection.update_many({'_id': {'$in': job_ids}, 'slot': {'$exists': True}},
+                                    {'$set': {'expires': expires}})
+
+    def expire(self, user_id, now):
+        """Fail the user's active jobs whose lease ran out before `now`"""
+        self.collection.update_many(
+            {'user': user_id, 'status': {'$in': list(ACTIVE_STATES)}, 'expires': {'$lt': now}},
+            {'$set': {'status': 'failed', 'finished': now}, '$unset': {'slot': '', 'expires': ''}}
+        )
+
+    def get(self, job_id):
+        return self.collection.find_one({'_id': job_id})
+
+
+class MemoryJobStore:
+    """Job documents in a dict; only visible to the current process"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def claim(self, job, limit):
+        with self._lock:
+            active = sum(1 for other in self._jobs.values()
+                         if other['user'] == job['user'] and other['status'] in ACTIVE_STATES)
+            if active >= limit:
+                return False
+            self._jobs[job['_id']] = dict(job)
+            return True
+
+    def update(self, job_id, fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def finish(self, job_id, fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            self._jobs[job_id].pop('expires', None)
+
+    def renew(self, job_ids, expires):
+        with self._lock:
+            for job_id in job_ids:
+                if self._jobs[job_id]['status'] in ACTIVE_STATES:
+                    self._jobs[job_id]['expires'] = expires
+
+    def expire(self, user_id, now):
+        with self._lock:
+            for job in self._jobs.values():
+                if job['user'] == user_id and job['status'] in ACTIVE_STATES and job['expires'] < now:
+                    job.update(status='failed', finished=now)
+                    job.pop('expires')
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+
+class JobRunner:
+    """Runs submitted jobs on a bounded local thread pool
+
+    At most `max_pending` jobs are queued or running in this process, and a
+    user may have at most `per_user` jobs queued or running across every
+    process sharing the store.  Leases last `lease` seconds and are renewed
+    every third of that while this process holds the job.  The pool and
+    the lease thread are per process (see process_local.py).
+    """
+
+    def __init__(self, store, workers=2, max_pending=100, per_user=2, lease=60):
+        self.store = store
+        self.workers = workers
+        self.per_user = per_user
+        self.lease = lease
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ProcessLocal(self._start_workers)
+        self._held = set()
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, kind, fn, *args):
+        """Record a queued job and schedule fn(*args) for it
+
+        fn returns a dict of result fields that are stored on the job when it
+        finishes.  Returns the new job document.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull('Job queue is full')
+
+        try:
+            now = datetime.utcnow()
+            job = {
+                '_id': ObjectId(),
+                'user': user_id,
+                'kind': kind,
+                'status': 'queued',
+                'created': now,
+                'expires': now + timedelta(seconds=self.lease)
+            }
+            # Jobs orphaned by a dead process give their slots back first
+            self.store.expire(user_id, now)
+            if not self.store.claim(job, self.per_user):
+                raise TooManyUserJobs('Too many active jobs')
+            executor = self._executor.get()
+            with self._lock:
+                self._held.add(job['_id'])
+            executor.submit(self._run, job['_id'], fn, args)
+        except Exception:
+            self._slots.release()
+            raise
+        return job
+
+    def get(self, job_id):
+        """Return a job, reporting it failed if its lease has run out"""
+        job = self.store.get(job_id)
+        now = datetime.utcnow()
+        if job is not None and job['status'] in ACTIVE_STATES and job.get('expires', now) < now:
+            self.store.expire(job['user'], now)
+            job = self.store.get(job_id)
+        return job
+
+    def _start_workers(self):
+        # Jobs held by the parent are renewed by the parent
+        self._held = set()
+        threading.Thread(target=self._renew_leases, name='job-leases', daemon=True).start()
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job-worker')
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                job_ids = list(self._held)
+            if not job_ids:
+                continue
+            try:
+                self.store.renew(job_ids, datetime.utcnow() + timedelta(seconds=self.lease))
+            except Exception:
+                logger.exception('Could not renew job leases')
+
+    def _run(self, job_id, fn, args):
+        try:
+            self.store.update(job_id, {'status': 'running', 'started': datetime.utcnow()})
+            result = fn(*args)
+            self.store.finish(job_id, dict(result, status='done', finished=datetime.utcnow()))
+        except Exception:
+            logger.exception('Job %s failed', job_id)
+            try:
+                self.store.finish(job_id, {'status': 'failed', 'finished': datetime.utcnow()})
+            except Exception:
+                logger.exception('Could not record failure of job %s', job_id)
+        finally:
+            with self._lock:
+                self._held.discard(job_id)
+            self._slots.release()
@@ -0,0 +1,115 @@
+"""
+JSON response encoding for the Python Meal Prep Application
+Both providers write ObjectId values as their hex string and datetimes in the
+configured date format, so routes can return MongoDB documents without
+converting fields one by one, and responses are the same whichever provider
+is active.  'orjson' encodes in C straight to bytes; 'stdlib' is the
+fallback when orjson is not installed.
+
+Dates default to RFC 822 ('http') and non-ASCII characters to \\u escapes,
+as Flask writes them; 'iso' dates and raw UTF-8 are opt-in.
+"""
+
+from datetime import date, datetime, timezone
+
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_ENCODERS = ('orjson', 'stdlib')
+DEFAULT_JSON_ENCODER = 'orjson' if orjson is not None else 'stdlib'
+DATE_FORMATS = ('http', 'iso')
+
+
+def format_datetime(value, date_format='http'):
+    """RFC 822 as Flask writes it ('http'), or ISO 8601 in UTC with a Z suffix as orjson writes naive UTC ('iso')"""
+    if date_format == 'http':
+        return http_date(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + 'Z'
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """Flask's json provider with ObjectId support and a configurable date format"""
+
+    date_format = 'http'
+
+    def default(self, value):
+        """Encode the types json and orjson do not know; others as Flask does"""
+        if isinstance(value, ObjectId):
+            return str(value)
+        if isinstance(value, datetime):
+            return format_datetime(value, self.date_format)
+        if isinstance(value, date) and self.date_format == 'iso':
+            return value.isoformat()
+        return DefaultJSONProvider.default(value)
+
+
+class OrjsonProvider(MongoJSONProvider):
+    """JSON provider backed by orjson; responses skip the str round trip
+
+    Extra keyword arguments to dumps() (indent and the like) fall back to
+    the stdlib encoder, as does response() in debug or non-compact mode.
+    orjson only writes UTF-8, so with ensure_ascii a body holding non-ASCII
+    characters is encoded again by the stdlib encoder.
+    """
+
+    def __init__(self, app):
+        if orjson is None:
+            raise RuntimeError('JSON_ENCODER=orjson requires the orjson package')
+        super().__init__(app)
+
+    def _options(self):
+        if self.date_format == 'iso':
+            options = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+        else:
+            options = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options())
+        if self.ensure_ascii and not body.isascii():
+            return super().dumps(obj)
+        return body.decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        if self.ensure_ascii and not body.isascii():
+            return super().response(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+PROVIDERS = {
+    'orjson': OrjsonProvider,
+    'stdlib': MongoJSONProvider
+}
+
+
+def json_provider(app, encoder=DEFAULT_JSON_ENCODER, date_format='http', ensure_ascii=True):
+    """Return the JSON provider named `encoder` for `app`"""
+    if encoder not in PROVIDERS:
+        raise ValueError('JSON_ENCODER must be one of %s' % ', '.join(JSON_ENCODERS))
+    if date_format not in DATE_FORMATS:
+        raise ValueError('JSON_DATE_FORMAT must be one of %s' % ', '.join(DATE_FORMATS))
+    provider = PROVIDERS[encoder](app)
+    provider.date_format = date_format
+    provider.ensure_ascii = ensure_ascii
+    return provider
@@ -0,0 +1,70 @@
+"""
+Load test script for the Python Meal Prep Application
+Registers a user and fires concurrent requests at a running server, so that
+the synchronous (Flask) and async (ASGI) serving modes can be compared.
+
+    python app.py                                         # or gunicorn app:app
+    uvicorn asgi_app:application --port 5001 --workers 4
+    python load_test.py --url http://localhost:5000 --requests 2000 --concurrency 50
+    python load_test.py --url http://localhost:5001 --requests 2000 --concurrency 50
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+import urllib.request
+import uuid
+
+
+def call(url, method='GET', body=None, token=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method)
+    req.add_header('Content-Type', 'application/json')
+    if token:
+        req.add_header('x-auth-token', token)
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read() or b'null')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--endpoint', default='/api/meals/my-plans')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    # Create a user with a few plans to read back
+    token = call(args.url + '/api/auth/register', 'POST', {
+        'name': 'Load Test',
+        'email': 'load-%s@example.com' % uuid.uuid4().hex[:12],
+        'password': 'password123'
+    })['token']
+    for _ in range(5):
+        call(args.url + '/api/meals/generate', 'POST', {
+            'dietaryPreference': 'vegetarian',
+            'allergies': ['nuts'],
+            'nutritionalGoal': 'weight-loss',
+            'numberOfMeals': 7,
+            'preferredCuisine': 'mediterranean'
+        }, token)
+
+    def timed_request(_):
+        start = time.perf_counter()
+        call(args.url + args.endpoint, token=token)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = sorted(executor.map(timed_request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print("%s %s" % (args.url, args.endpoint))
+    print("  %d requests, concurrency %d: %.1f req/s" % (args.requests, args.concurrency, args.requests / elapsed))
+    print("  p50 %.1f ms, p99 %.1f ms" % (latencies[len(latencies) // 2] * 1000,
+                                         latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Macro-target optimizer for the Python Meal Prep Application
+Chooses recipes so that each day's calories, protein, carbs and fat land close
+to the targets implied by the user's nutritional goal.
+"""
+
+import numpy as np
+
+from recipe_catalog import MACRO_FIELDS, MEAL_TYPES, normalize_tag
+
+OPTIMIZER_MODES = ('greedy', 'search')
+
+# Daily targets per goal: calories, protein (g), carbs (g), fat (g)
+GOAL_TARGETS = {
+    'weight-loss': (1800, 135, 180, 60),
+    'maintenance': (2200, 110, 275, 73),
+    'muscle-gain': (2800, 175, 315, 93)
+}
+
+# Share of the daily targets each meal type is expected to cover
+MEAL_SHARES = {
+    'breakfast': 0.25,
+    'lunch': 0.3,
+    'dinner': 0.35,
+    'snack': 0.1
+}
+
+# Relative importance of calories, protein, carbs and fat when scoring
+MACRO_WEIGHTS = np.array([2.0, 1.5, 1.0, 1.0])
+
+# Local search tuning: extra candidates kept per meal type, days compared
+# against each other in one swap block, and the pass limit
+SEARCH_POOL_SIZE = 48
+SEARCH_BLOCK_DAYS = 128
+SEARCH_MAX_PASSES = 8
+
+# Best-scoring candidates beyond the requested number that a penalty is
+# computed for; the rest of the candidates are never penalized
+PENALTY_POOL_SIZE = 64
+
+_EPSILON = 1e-9
+
+# (GOAL_TARGETS key, meal_type) -> (macros, scores of every recipe in macros)
+_score_cache = {}
+
+
+class NoCandidatesError(ValueError):
+    """A plan needs meal types that no candidate recipe can fill"""
+
+    def __init__(self, meal_types):
+        super().__init__('No recipes match these preferences for %s' % ', '.join(meal_types))
+        self.meal_types = meal_types
+
+
+def target_goal(goal):
+    """The GOAL_TARGETS key for a nutritional goal; unknown goals are maintenance"""
+    goal = normalize_tag(goal)
+    return goal if goal in GOAL_TARGETS else 'maintenance'
+
+
+def daily_targets(goal):
+    """Return the daily macro targets for a nutritional goal"""
+    return np.array(GOAL_TARGETS[target_goal(goal)], dtype=np.float64)
+
+
+def deviation(totals, target):
+    """Weighted squared relative error of macro totals against a target
+
+    Both arguments broadcast over leading axes; the last axis holds the four
+    macros, so scoring a whole candidate matrix is a single call.
+    """
+    relative = (totals - target) / target
+    return (relative * relative) @ MACRO_WEIGHTS
+
+
+def recipe_scores(macros, meal_type, goal):
+    """Score every recipe in `macros` against one meal-type target
+
+    The scores only depend on the catalog, so they are computed once per
+    (GOAL_TARGETS key, meal type) and reused until a different macro matrix
+    is passed.
+    """
+    key = (target_goal(goal), meal_type)
+    cached = _score_cache.get(key)
+    if cached is None or cached[0] is not macros:
+        target = daily_targets(goal) * MEAL_SHARES[meal_type]
+        cached = (macros, deviation(macros.astype(np.float64), target))
+        _score_cache[key] = cached
+    return cached[1]
+
+
+def rank_candidates(macros, candidates, meal_type, goal, limit=None, penalty=None):
+    """Return `candidates` ordered by how well each fits its meal-type target
+
+    `penalty`, when given, maps an array of recipe positions to score
+    penalties.  With a `limit` it is only applied to the best
+    limit + PENALTY_POOL_SIZE candidates by unpenalized score, so its cost
+    does not grow with the number of candidates.
+    """
+    scores = recipe_scores(macros, meal_type, goal)[candidates]
+    if penalty is not None:
+        if limit is not None:
+            pool = _best(scores, limit + PENALTY_POOL_SIZE)
+            candidates, scores = candidates[pool], scores[pool]
+        scores = scores + penalty(candidates)
+    best = _best(scores, limit) if limit is not None else np.arange(len(candidates))
+    return candidates[best[np.argsort(scores[best], kind='stable')]]
+
+
+def _best(scores, limit):
+    """Indexes of the `limit` lowest scores, unordered"""
+    if limit >= len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(scores, limit - 1)[:limit]
+
+
+def plan_totals(macros, positions):
+    """Summed calories, protein, carbs and fat of the recipes at `positions`"""
+    sums = macros[positions].sum(axis=0, dtype=np.float64) if len(positions) else np.zeros(len(MACRO_FIELDS))
+    return {field: int(round(value)) for field, value in zip(MACRO_FIELDS, sums)}
+
+
+def slot_count(number_of_meals, meal_type):
+    """Number of slots of `meal_type` in a plan of `number_of_meals`"""
+    return len(range(MEAL_TYPES.index(meal_type), number_of_meals, 4))
+
+
+def pool_size(count, mode):
+    """Recipes optimize_plan ranks for a meal type with `count` slots"""
+    return count + SEARCH_POOL_SIZE if mode == 'search' else count
+
+
+def candidate_pools(macros, candidates, number_of_meals, goal, mode='greedy'):
+    """Best-ranked candidates of each meal type, enough for optimize_plan under any penalty
+
+    Passing the result to optimize_plan in place of `candidates` gives the
+    same plan for any penalty, so it can be memoized on the preferences and
+    shared by users with different histories.
+    """
+    if mode not in OPTIMIZER_MODES:
+        raise ValueError('Unknown optimizer mode: %s' % mode)
+    return {
+        meal_type: rank_candidates(macros, options, meal_type, goal,
+                                   pool_size(slot_count(number_of_meals, meal_type), mode) + PENALTY_POOL_SIZE)
+        for meal_type, options in candidates.items()
+    }
+
+
+def optimize_plan(macros, candidates, number_of_meals, goal, mode='greedy', penalty=None):
+    """Pick one recipe position per meal slot
+
+    `macros` is the catalog's (recipes x 4) macro matrix and `candidates`
+    maps each meal type to its filtered candidate positions.  Slot i has
+    meal type MEAL_TYPES[i % 4] and belongs to day i // 4.
+
+    'greedy' scores every candidate against its meal-type target in one
+    batch and cycles through the best distinct recipes.  'search' starts from
+    the greedy plan and refines whole days with swap and replace moves.
+    Raises NoCandidatesError rather than return a short plan when a meal
+    type with slots has no candidates.  `penalty` is an optional callable
+    giving a score added when ranking (see rank_candidates), e.g. to avoid
+    recipes the user ate recently.
+    """
+    if mode not in OPTIMIZER_MODES:
+        raise ValueError('Unknown optimizer mode: %s' % mode)
+    missing = [meal_type for meal_type in MEAL_TYPES[:number_of_meals]
+               if candidates.get(meal_type) is None or not len(candidates[meal_type])]
+    if missing:
+        raise NoCandidatesError(missing)
+
+    days = -(-number_of_meals // 4)
+    plan = {}
+    for meal_type in MEAL_TYPES:
+        count = slot_count(number_of_meals, meal_type)
+        if count == 0:
+            continue
+        pool = rank_candidates(macros, candidates[meal_type], meal_type, goal, pool_size(count, mode), penalty)
+        assignment = np.full(days, -1, dtype=np.intp)
+        assignment[:count] = np.arange(count) % min(count, len(pool))
+        plan[meal_type] = (pool, assignment)
+
+    if mode == 'search' and plan:
+        _local_search(macros, plan, daily_targets(goal), days)
+
+    positions = []
+    for i in range(number_of_meals):
+        pool, assignment = plan[MEAL_TYPES[i % 4]]
+        positions.append(int(pool[assignment[i // 4]]))
+    return positions
+
+
+def _local_search(macros, plan, daily, days):
+    """Refine `plan` in place to minimise the summed per-day deviation
+
+    Swaps exchange the recipes of two days for one meal type and so keep the
+    plan's variety unchanged; replacements bring in an unused pool recipe
+    while no recipe is used more often than the greedy plan required.
+    """
+    pool_macros = {}
+    present = {}
+    shares = np.zeros((days, 1))
+    totals = np.zeros((days, 4))
+    for meal_type, (pool, assignment) in plan.items():
+        pool_macros[meal_type] = macros[pool].astype(np.float64)
+        present[meal_type] = np.flatnonzero(assignment >= 0)
+        shares[present[meal_type]] += MEAL_SHARES[meal_type]
+        totals[present[meal_type]] += pool_macros[meal_type][assignment[present[meal_type]]]
+    target = daily * shares
+
+    for _ in range(SEARCH_MAX_PASSES):
+        improved = False
+        for meal_type, (pool, assignment) in plan.items():
+            days_used = present[meal_type]
+            cap = -(-len(days_used) // len(pool))
+            improved |= _swap_days(pool_macros[meal_type], assignment, days_used, totals, target)
+            improved |= _replace_recipes(pool_macros[meal_type], assignment, days_used, totals, target, cap)
+        if not improved:
+            break
+
+
+def _swap_days(pool_macros, assignment, days_used, totals, target):
+    """Apply the best disjoint improving swaps within blocks of days"""
+    changed = False
+    for start in range(0, len(days_used), SEARCH_BLOCK_DAYS):
+        block = days_used[start:start + SEARCH_BLOCK_DAYS]
+        assigned = pool_macros[assignment[block]]
+        base = totals[block] - assigned
+        current = deviation(totals[block], target[block])
+        # received[a, b]: day a's deviation after taking day b's recipe
+        received = deviation(base[:, None, :] + assigned[None, :, :], target[block][:, None, :])
+        gain = received + received.T - current[:, None] - current[None, :]
+        first, second = np.nonzero(np.triu(gain, 1) < -_EPSILON)
+        if not len(first):
+            continue
+
+        taken = np.zeros(len(block), dtype=bool)
+        for k in np.argsort(gain[first, second], kind='stable'):
+            a, b = first[k], second[k]
+            if taken[a] or taken[b]:
+                continue
+            taken[a] = taken[b] = True
+            day_a, day_b = block[a], block[b]
+            assignment[day_a], assignment[day_b] = assignment[day_b], assignment[day_a]
+            totals[day_a] = base[a] + assigned[b]
+            totals[day_b] = base[b] + assigned[a]
+            changed = True
+    return changed
+
+
+def _replace_recipes(pool_macros, assignment, days_used, totals, target, cap):
+    """Move days onto better pool recipes that are still under the usage cap"""
+    uses = np.bincount(assignment[days_used], minlength=len(pool_macros))
+    free = np.flatnonzero(uses < cap)[:SEARCH_POOL_SIZE]
+    if not len(free):
+        return False
+
+    base = totals[days_used] - pool_macros[assignment[days_used]]
+    current = deviation(totals[days_used], target[days_used])
+    trial = deviation(base[:, None, :] + pool_macros[free][None, :, :], target[days_used][:, None, :])
+    best = trial.argmin(axis=1)
+    gain = trial[np.arange(len(days_used)), best] - current
+
+    changed = False
+    for k in np.argsort(gain, kind='stable'):
+        if gain[k] >= -_EPSILON:
+            break
+        choice = free[best[k]]
+        if uses[choice] >= cap:
+            continue
+        day = days_used[k]
+        uses[assignment[day]] -= 1
+        uses[choice] += 1
+        assignment[day] = choice
+        totals[day] = base[k] + pool_macros[choice]
+        changed = True
+    return changed
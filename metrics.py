@@ -0,0 +1,195 @@
+"""
+Instrumentation for the Python Meal Prep Application
+Latency histograms per route and per stage (auth, generation, Mongo calls,
+serialization), Mongo command metrics from a pymongo command listener, and an
+opt-in sampling profiler.  render() writes everything in the Prometheus text
+exposition format for the /metrics endpoint.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import cProfile
+from functools import wraps
+import itertools
+import os
+import re
+import threading
+import time
+
+from pymongo import monitoring
+
+# Upper bounds in seconds, from sub-millisecond cache hits to slow jobs
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Route template of the request being served, used to label stage timings
+current_route = ContextVar('current_route', default='')
+
+
+def _label_pairs(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+class Counter:
+    """Monotonic counter with one series per label value tuple"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s counter' % self.name]
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, value in series:
+            lines.append('%s{%s} %s' % (self.name, _label_pairs(self.labels, labels), value))
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with one series per label value tuple
+
+    observe() is a bisect and two additions under a lock; buckets are made
+    cumulative only when rendered.
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # One count per bucket, then +Inf, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            pairs = _label_pairs(self.labels, labels)
+            prefix = pairs + ',' if pairs else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append('%s_bucket{%sle="%s"} %d' % (self.name, prefix, bound, cumulative))
+            lines.append('%s_sum{%s} %.6f' % (self.name, pairs, values[-1]))
+            lines.append('%s_count{%s} %d' % (self.name, pairs, cumulative))
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'mealprep_request_duration_seconds', 'HTTP request latency', ('method', 'route', 'status'))
+STAGE_SECONDS = Histogram(
+    'mealprep_stage_duration_seconds', 'Time spent in each stage of a request', ('route', 'stage'))
+MONGO_SECONDS = Histogram(
+    'mealprep_mongo_command_duration_seconds', 'MongoDB command latency', ('command', 'collection'))
+MONGO_FAILURES = Counter(
+    'mealprep_mongo_command_failures_total', 'MongoDB commands that failed', ('command', 'collection'))
+
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, MONGO_SECONDS, MONGO_FAILURES]
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as stage `name` of the current route"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, current_route.get(), name)
+
+
+def timed(name):
+    """Decorator form of stage()"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records every MongoDB command's latency by command and collection
+
+    The latency is also added to the 'mongo' stage of the current route,
+    since pymongo publishes events on the thread that issued the command.
+    """
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get('collection', '')
+        self._collections[event.request_id] = collection
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, '')
+        seconds = event.duration_micros / 1e6
+        MONGO_SECONDS.observe(seconds, event.command_name, collection)
+        STAGE_SECONDS.observe(seconds, current_route.get(), 'mongo')
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, '')
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name, collection)
+        MONGO_FAILURES.inc(event.command_name, collection)
+
+
+class RequestProfiler:
+    """Profiles 1 in `every` requests with cProfile (0 disables)
+
+    Each sampled request's stats are written to `directory` as a .prof file
+    for pstats or snakeviz.  When disabled, start() is one comparison.
+    """
+
+    def __init__(self, every=0, directory='profiles'):
+        self.every = every
+        self.directory = directory
+        self._requests = itertools.count()
+
+    def start(self):
+        """Return a running profile for a sampled request, else None"""
+        if not self.every or next(self._requests) % self.every:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another thread's profile is active (one profiler at a time on 3.12+)
+            return None
+        return profile
+
+    def finish(self, profile, label):
+        """Stop `profile` and dump its stats, named after `label`"""
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        name = '%d-%d-%s.prof' % (time.time() * 1000, os.getpid(), re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_'))
+        profile.dump_stats(os.path.join(self.directory, name))
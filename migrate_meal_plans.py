@@ -0,0 +1,157 @@
+"""
+Meal plan migrations for the Python Meal Prep Application
+Rewrites stored meals between the 'embedded' and 'reference' formats (see
+plan_storage.py) in batches, and reports how document sizes changed.  The
+server reads both formats, so it can run while the application is serving.
+--backfill-totals instead adds the macro totals used by /api/meals/stats to
+plans stored before they were recorded.
+
+    python migrate_meal_plans.py --to reference --dry-run
+    python migrate_meal_plans.py --to reference
+    python migrate_meal_plans.py --to embedded
+    python migrate_meal_plans.py --backfill-totals
+"""
+
+import argparse
+from collections import Counter
+import os
+
+import bson
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from plan_storage import MEAL_FORMATS, compact_meals, expand_meals, is_reference_meal
+from recipe_catalog import MACRO_FIELDS, load_catalog
+
+load_dotenv()
+
+# Documents that still hold meals in the other format
+PENDING = {
+    'reference': {'meals.name': {'$exists': True}},
+    'embedded': {'meals': {'$elemMatch': {'name': {'$exists': False}}}}
+}
+
+
+def migrate_collection(collection, target, catalog, batch_size, dry_run, plans=None):
+    """Convert the meals of one collection
+
+    Full meals without a recipe id are matched to the catalog by name, meal
+    type and ingredients.  Converted plans get their rev bumped, which
+    changes their ETag; when `collection` holds plan bodies, `plans` is the
+    meal_plans collection whose plans referencing a converted body are
+    bumped.  Returns (documents, updated, bytes before, bytes after,
+    unconverted), where `unconverted` counts the meals that stay in the
+    other format by recipe name or id: their recipe is not in the catalog.
+    """
+    convert = compact_meals if target == 'reference' else expand_meals
+    documents = updated = size_before = size_after = 0
+    unconverted = Counter()
+    requests = []
+    ids = []
+
+    def write():
+        modified = collection.bulk_write(requests, ordered=False).modified_count
+        if plans is not None:
+            plans.update_many({'body': {'$in': ids}}, {'$inc': {'rev': 1}})
+        return modified
+
+    # Meals matched by name gain a recipe_id, so the response changes
+    bump = {'$inc': {'rev': 1}} if plans is None else {}
+    for doc in collection.find(PENDING[target], {'meals': 1}).batch_size(batch_size):
+        meals = convert(doc['meals'], catalog)
+        documents += 1
+        for meal in meals:
+            if is_reference_meal(meal) != (target == 'reference'):
+                unconverted[meal.get('name') or meal.get('recipe_id')] += 1
+        size_before += len(bson.encode({'meals': doc['meals']}))
+        size_after += len(bson.encode({'meals': meals}))
+        if meals == doc['meals']:
+            continue
+
+        # Matching on the old meals leaves a concurrently edited plan alone
+        requests.append(UpdateOne({'_id': doc['_id'], 'meals': doc['meals']},
+                                  dict(bump, **{'$set': {'meals': meals}})))
+        ids.append(doc['_id'])
+        if len(requests) == batch_size:
+            if not dry_run:
+                updated += write()
+            requests = []
+            ids = []
+
+    if requests and not dry_run:
+        updated += write()
+    return documents, updated, size_before, size_after, unconverted
+
+
+def backfill_totals(db, catalog, batch_size, dry_run):
+    """Store totals, daily_average and days on plans that lack them; returns (documents, updated)"""
+    documents = updated = 0
+    bodies = {}
+    requests = []
+
+    query = {'totals': {'$exists': False}}
+    for doc in db.meal_plans.find(query, {'meals': 1, 'body': 1, 'number_of_meals': 1}).batch_size(batch_size):
+        meals = doc.get('meals')
+        if meals is None and doc.get('body') is not None:
+            if doc['body'] not in bodies:
+                bodies[doc['body']] = (db.plan_bodies.find_one({'_id': doc['body']}, {'meals': 1}) or {}).get('meals')
+            meals = bodies[doc['body']]
+        if meals is None:
+            continue
+        documents += 1
+
+        meals = expand_meals(meals, catalog)
+        totals = {field: int(sum(meal.get(field) or 0 for meal in meals)) for field in MACRO_FIELDS}
+        days = max(-(-int(doc.get('number_of_meals') or len(meals)) // 4), 1)
+        # rev changes the plan's ETag, as the response now includes the totals
+        requests.append(UpdateOne({'_id': doc['_id'], 'totals': {'$exists': False}}, {'$set': {
+            'totals': totals,
+            'daily_average': {field: round(value / days, 1) for field, value in totals.items()},
+            'days': days
+        }, '$inc': {'rev': 1}}))
+        if len(requests) == batch_size:
+            if not dry_run:
+                updated += db.meal_plans.bulk_write(requests, ordered=False).modified_count
+            requests = []
+
+    if requests and not dry_run:
+        updated += db.meal_plans.bulk_write(requests, ordered=False).modified_count
+    return documents, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--to', choices=MEAL_FORMATS, default='reference')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true', help='report sizes without writing')
+    parser.add_argument('--backfill-totals', action='store_true', help='add macro totals to older plans')
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/mealprep'))
+    db = client.mealprep
+    catalog = load_catalog()
+
+    if args.backfill_totals:
+        documents, updated = backfill_totals(db, catalog, args.batch_size, args.dry_run)
+        print("meal_plans: %d documents without totals, %d updated" % (documents, updated))
+        return
+
+    # plan_bodies keep their _id: it is the hash of the body as first written,
+    # so identical plans written before and after the migration may not share one
+    for name in ('meal_plans', 'plan_bodies'):
+        documents, updated, before, after, unconverted = migrate_collection(
+            db[name], args.to, catalog, args.batch_size, args.dry_run,
+            plans=db.meal_plans if name == 'plan_bodies' else None
+        )
+        print("%s: %d documents to convert, %d updated" % (name, documents, updated))
+        if documents:
+            print("  meals %.1f KB -> %.1f KB per document (%+.0f%%)" % (
+                before / documents / 1024, after / documents / 1024, (after - before) * 100.0 / before))
+        if unconverted:
+            print("  %d meals not in the catalog were left as they are:" % sum(unconverted.values()))
+            for recipe, count in unconverted.most_common():
+                print("    %6d  %s" % (count, recipe))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Password hashing for the Python Meal Prep Application
+pbkdf2 hashing and verification run in a bounded process pool so that a burst
+of logins does not hold the GIL on the request threads.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from process_local import ProcessLocal
+
+logger = logging.getLogger(__name__)
+
+# pbkdf2 iteration count for new hashes; stored hashes with a different
+# method are upgraded on the next successful login
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 600000))
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:%d' % PASSWORD_HASH_ITERATIONS
+
+# Worker processes (0 hashes on the calling thread), hashes allowed to be
+# queued or running at once, and how long a caller waits for a slot
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', max(PASSWORD_HASH_WORKERS, 1) * 4))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when no hashing slot frees up within PASSWORD_HASH_QUEUE_TIMEOUT"""
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _create_executor():
+    # Workers are not forked from the threaded server process, which could
+    # copy a lock held by another thread
+    return ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=_mp_context())
+
+
+_executor = ProcessLocal(_create_executor)
+
+
+def _submit(fn, *args, timeout=None):
+    """Run fn(*args) in the pool, holding a slot until it finishes"""
+    if timeout is None:
+        timeout = PASSWORD_HASH_QUEUE_TIMEOUT
+    if not _slots.acquire(timeout=timeout):
+        raise PasswordHasherBusy('Password hashing queue is full')
+    try:
+        future = _executor.get().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def hash_password(password):
+    """Hash a password with the configured pbkdf2 method"""
+    if PASSWORD_HASH_WORKERS <= 0:
+        return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+    return _submit(generate_password_hash, password, PASSWORD_HASH_METHOD).result()
+
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash"""
+    if PASSWORD_HASH_WORKERS <= 0:
+        return check_password_hash(pwhash, password)
+    return _submit(check_password_hash, pwhash, password).result()
+
+
+def needs_rehash(pwhash):
+    """True if `pwhash` was made with a method other than the configured one"""
+    return pwhash.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+
+def rehash_in_background(password, on_done):
+    """Hash `password` with the current method and pass the result to on_done
+
+    Used to upgrade a stored hash after a successful login without making the
+    login wait for a second pbkdf2 run.  Skipped when the pool is busy.
+    """
+    if PASSWORD_HASH_WORKERS <= 0:
+        on_done(hash_password(password))
+        return
+
+    def _store(future):
+        try:
+            on_done(future.result())
+        except Exception:
+            logger.exception('Password rehash failed')
+
+    try:
+        future = _submit(generate_password_hash, password, PASSWORD_HASH_METHOD, timeout=0)
+        future.add_done_callback(_store)
+    except PasswordHasherBusy:
+        pass
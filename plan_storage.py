@@ -0,0 +1,129 @@
+"""
+Meal plan storage formats for the Python Meal Prep Application
+'embedded' keeps meals and grocery_list on every meal_plans document.
+'deduplicated' stores each distinct plan body once in plan_bodies under its
+content hash, and meal_plans documents reference it through 'body'.
+
+Independently, meals are stored either in full ('embedded') or, in the
+'reference' format, as {'recipe_id': ...} plus an 'overrides' dict holding
+any fields that differ from the recipe catalog.  Full meals always carry a
+'name', reference meals never do, so both can be read from the same data.
+
+The functions here only transform documents; the servers do the I/O.
+"""
+
+import hashlib
+import json
+
+STORAGE_MODES = ('embedded', 'deduplicated')
+BODY_FIELDS = ('meals', 'grocery_list')
+MEAL_FORMATS = ('embedded', 'reference')
+
+
+def plan_body_id(meal_plan_doc):
+    """Content hash of a plan's meals and grocery list"""
+    body = {field: meal_plan_doc[field] for field in BODY_FIELDS}
+    encoded = json.dumps(body, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def split_plan_body(meal_plan_doc):
+    """Return (meal_plans document, plan_bodies document) for deduplicated storage"""
+    body_id = plan_body_id(meal_plan_doc)
+    stored = {k: v for k, v in meal_plan_doc.items() if k not in BODY_FIELDS}
+    stored['body'] = body_id
+    body = {field: meal_plan_doc[field] for field in BODY_FIELDS}
+    body['_id'] = body_id
+    return stored, body
+
+
+def cached_bodies(plans, cache):
+    """Split the bodies referenced by `plans` into (found in cache, ids to fetch)"""
+    bodies = {}
+    missing = []
+    for plan in plans:
+        body_id = plan.get('body')
+        if body_id is None or body_id in bodies or body_id in missing:
+            continue
+        body = cache.get(body_id)
+        if body is None:
+            missing.append(body_id)
+        else:
+            bodies[body_id] = body
+    return bodies, missing
+
+
+def attach_bodies(plans, bodies):
+    """Fill in meals and grocery_list on plans that reference a stored body"""
+    for plan in plans:
+        body = bodies.get(plan.get('body'))
+        if body is not None:
+            for field in BODY_FIELDS:
+                plan[field] = body[field]
+    return plans
+
+
+def is_reference_meal(meal):
+    return 'name' not in meal
+
+
+def meal_position(meal, catalog):
+    """Catalog position of a stored meal's recipe, or None
+
+    Full meals stored before recipe ids were recorded are matched on name,
+    meal type and ingredients.
+    """
+    position = catalog.position(meal.get('recipe_id'))
+    if position is None and 'recipe_id' not in meal and 'name' in meal:
+        position = catalog.find_recipe(meal['name'], meal.get('meal_type'), meal.get('ingredients') or [])
+    return position
+
+
+def compact_meals(meals, catalog):
+    """Convert full meals to the reference format
+
+    Meals whose recipe is not in the catalog are kept in full.
+    """
+    compact = []
+    for meal in meals:
+        if is_reference_meal(meal):
+            compact.append(meal)
+            continue
+        position = meal_position(meal, catalog)
+        if position is None:
+            compact.append(meal)
+            continue
+        recipe = catalog.meal(position)
+        reference = {'recipe_id': recipe['recipe_id']}
+        overrides = {k: v for k, v in meal.items() if k not in recipe or recipe[k] != v}
+        if overrides:
+            reference['overrides'] = overrides
+        compact.append(reference)
+    return compact
+
+
+def expand_meals(meals, catalog):
+    """Convert reference meals back to full meals from the catalog
+
+    A reference to a recipe that has since left the catalog is returned as
+    stored, with its overrides applied.
+    """
+    expanded = []
+    for meal in meals:
+        if not is_reference_meal(meal):
+            expanded.append(meal)
+            continue
+        position = catalog.position(meal['recipe_id'])
+        full = catalog.meal(position) if position is not None else {'recipe_id': meal['recipe_id']}
+        full.update(meal.get('overrides', {}))
+        expanded.append(full)
+    return expanded
+
+
+def expand_plan_meals(plans, catalog):
+    """Expand reference meals in place on every plan that has meals"""
+    for plan in plans:
+        meals = plan.get('meals')
+        if meals and any(is_reference_meal(meal) for meal in meals):
+            plan['meals'] = expand_meals(meals, catalog)
+    return plans
@@ -0,0 +1,49 @@
+"""
+Per-process resources for the Python Meal Prep Application
+A forked child inherits the parent's pools and queues but none of their
+threads or worker processes, and may inherit a lock held by a thread that no
+longer exists.  Anything backed by threads or processes is therefore built
+on first use in each process, through ProcessLocal, so an app created in a
+pre-forking master never hands its pools to a worker.
+"""
+
+import os
+import threading
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+class ProcessLocal:
+    """The value of `factory()` built on first get() in each process
+
+    get() in a forked child builds a new value instead of returning the
+    parent's.  started() tells whether this process has built one yet.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def started(self):
+        return self._pid == os.getpid()
+
+
+def _after_fork():
+    # The parent's lock may have been copied while held
+    for instance in list(_instances):
+        instance._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
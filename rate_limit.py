@@ -0,0 +1,158 @@
+"""
+Rate limiting for the Python Meal Prep Application
+Token buckets kept in a memory-mapped file, so every worker process on a host
+draws from the same buckets without a network round trip.  The file is split
+into groups of slots; a hit locks only its key's group (a striped thread lock
+plus an fcntl byte-range lock), reads and rewrites one 24-byte slot, and
+releases it.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+
+RATE_LIMIT_STORAGES = ('shared', 'memory', 'off')
+
+_UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Slot: key hash (0 = empty), tokens left, time of the last update
+_SLOT = struct.Struct('<Qdd')
+_GROUP_SLOTS = 8
+_THREAD_STRIPES = 64
+
+
+def parse_limit(text):
+    """Parse '100 per hour' or '10/minute' into (capacity, seconds per refill of the capacity)"""
+    match = re.match(r'^\s*(\d+)\s*(?:per|/)\s*(\d*)\s*(second|minute|hour|day)s?\s*$', text or '', re.I)
+    if not match:
+        raise ValueError('Invalid rate limit: %r' % text)
+    count, multiple, unit = match.groups()
+    return int(count), int(multiple or 1) * _UNITS[unit.lower()]
+
+
+def key_hash(key):
+    """Stable 64-bit hash of a bucket key, never 0"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+
+def _take(tokens, updated, now, capacity, period):
+    """Refill then take one token; returns (allowed, tokens, seconds until the next token)"""
+    rate = capacity / period
+    tokens = min(capacity, tokens + max(now - updated, 0.0) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+class SharedTokenBuckets:
+    """Token buckets in a file shared by every process that opens the same path
+
+    Keys hash to a group of _GROUP_SLOTS slots and take the first free or
+    matching slot in it.  When a group is full the least recently updated
+    slot is reused, which hands that key a full bucket; size `slots` well
+    above the number of clients active within one limit period.
+    """
+
+    def __init__(self, path, slots=65536, clock=time.time):
+        self.path = path
+        self.groups = max(slots // _GROUP_SLOTS, 1)
+        self._clock = clock
+        self._group_size = _GROUP_SLOTS * _SLOT.size
+        size = self.groups * self._group_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._locks = [threading.Lock() for _ in range(_THREAD_STRIPES)]
+
+    def hit(self, key, capacity, period):
+        """Take a token for `key`; returns (allowed, retry after seconds)"""
+        digest = key_hash(key)
+        group = digest % self.groups
+        start = group * self._group_size
+        with self._locks[group % _THREAD_STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._group_size, start)
+            try:
+                now = self._clock()
+                target = empty = oldest = None
+                oldest_updated = 0.0
+                for offset in range(start, start + self._group_size, _SLOT.size):
+                    slot_hash, tokens, updated = _SLOT.unpack_from(self._map, offset)
+                    if slot_hash == digest:
+                        target = offset
+                        break
+                    if slot_hash == 0:
+                        if empty is None:
+                            empty = offset
+                    elif oldest is None or updated < oldest_updated:
+                        oldest, oldest_updated = offset, updated
+                if target is None:
+                    # New key: a free slot, else the least recently used one
+                    target = empty if empty is not None else oldest
+                    tokens, updated = capacity, now
+
+                allowed, tokens, retry_after = _take(tokens, updated, now, capacity, period)
+                _SLOT.pack_into(self._map, target, digest, tokens, now)
+                return allowed, retry_after
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._group_size, start)
+
+    def clear(self):
+        """Reset every bucket"""
+        self._map[:] = bytes(len(self._map))
+
+
+class MemoryTokenBuckets:
+    """Token buckets in a dict; per process, for tests and single-worker setups"""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, capacity, period):
+        with self._lock:
+            now = self._clock()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            allowed, tokens, retry_after = _take(tokens, updated, now, capacity, period)
+            self._buckets[key] = (tokens, now)
+            return allowed, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+def default_shm_path():
+    """Per-user file under /dev/shm, or the temp directory where that is missing"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'mealprep-ratelimit-%d' % os.getuid())
+
+
+class RateLimiter:
+    """Per-route, per-client token bucket limits
+
+    `limits` maps route templates to limit strings and falls back to
+    `default`; routes in `exempt` are never limited.  check() is called by
+    the server with the matched route and the client address.
+    """
+
+    def __init__(self, buckets, default, limits=None, exempt=()):
+        self.buckets = buckets
+        self.default = parse_limit(default)
+        self.limits = {route: parse_limit(limit) for route, limit in (limits or {}).items()}
+        self.exempt = set(exempt)
+
+    def check(self, route, client):
+        """Return None if the request may proceed, else the seconds to wait"""
+        if route in self.exempt:
+            return None
+        capacity, period = self.limits.get(route, self.default)
+        allowed, retry_after = self.buckets.hit('%s|%s' % (route, client), capacity, period)
+        return None if allowed else retry_after
@@ -0,0 +1,341 @@
+"""
+Recipe catalog for the Python Meal Prep Application
+Loads the recipe data once and keeps it in compact, column-oriented form with
+prebuilt inverted indexes so that meal selection is a dictionary lookup.
+"""
+
+from array import array
+from functools import lru_cache
+import hashlib
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+from grocery import grocery_item
+from variety import band_keys, minhash_signatures
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'recipes.json')
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner', 'snack')
+MACRO_FIELDS = ('calories', 'protein', 'carbs', 'fat')
+ANY = 'any'
+
+# Every restriction a request can carry is one bit of a recipe's tag mask.
+# Diet bits are set when a recipe is NOT suitable for that diet, allergen bits
+# when it contains the allergen, so a recipe passes a request iff
+# recipe_mask & request_mask == 0.
+DIET_TAGS = ('vegetarian', 'vegan', 'pescatarian', 'keto', 'gluten-free')
+ALLERGEN_TAGS = ('nuts', 'peanuts', 'dairy', 'eggs', 'gluten', 'soy', 'fish',
+                 'shellfish', 'sesame', 'mustard', 'celery')
+TAG_BITS = {tag: 1 << bit for bit, tag in enumerate(DIET_TAGS + ALLERGEN_TAGS)}
+
+# Diets a recipe tagged with the key also satisfies; recipes are tagged with
+# their strictest diet only
+DIET_IMPLIES = {
+    'vegan': ('vegetarian',),
+    'vegetarian': ('pescatarian',)
+}
+
+# Word stems that mark an ingredient as containing an allergen
+ALLERGEN_KEYWORDS = {
+    'nuts': ('almond', 'walnut', 'pecan', 'cashew', 'pistachio', 'hazelnut', 'macadamia', 'nut'),
+    'peanuts': ('peanut',),
+    'dairy': ('milk', 'yogurt', 'cheese', 'feta', 'mozzarella', 'parmesan', 'ricotta', 'cheddar',
+              'cream', 'butter', 'ghee', 'whey'),
+    'eggs': ('egg',),
+    'gluten': ('wheat', 'pasta', 'bagel', 'couscous', 'bread', 'flour', 'barley', 'bulgur', 'oat',
+               'noodle', 'tortilla'),
+    'soy': ('soy', 'tofu', 'edamame', 'miso', 'tempeh'),
+    'fish': ('salmon', 'tuna', 'cod', 'anchovy', 'sardine', 'fish'),
+    'shellfish': ('shrimp', 'prawn', 'crab', 'lobster', 'scallop', 'mussel', 'clam'),
+    'sesame': ('sesame', 'tahini'),
+    'mustard': ('mustard',),
+    'celery': ('celery',)
+}
+
+# Ingredients the keyword rules would misclassify
+INGREDIENT_ALLERGENS = {
+    'peanut butter': ('peanuts',),
+    'coconut milk': (),
+    'corn tortillas': (),
+    'soy sauce': ('soy', 'gluten'),
+    'rice noodles': ()
+}
+
+# Free-text allergy names accepted from clients
+ALLERGY_ALIASES = {
+    'nut': ('nuts', 'peanuts'),
+    'nuts': ('nuts', 'peanuts'),
+    'tree nut': ('nuts',),
+    'tree nuts': ('nuts',),
+    'peanut': ('peanuts',),
+    'milk': ('dairy',),
+    'lactose': ('dairy',),
+    'egg': ('eggs',),
+    'wheat': ('gluten',),
+    'soya': ('soy',),
+    'seafood': ('fish', 'shellfish')
+}
+
+
+def normalize_tag(value):
+    """Normalize a free-text preference ('Mediterranean ') to an index key"""
+    if not value:
+        return ANY
+    return str(value).strip().lower() or ANY
+
+
+def expand_diets(diets):
+    """Normalize a recipe's diets and add every diet they imply"""
+    expanded = set()
+    pending = [normalize_tag(diet) for diet in diets]
+    while pending:
+        diet = pending.pop()
+        if diet not in expanded:
+            expanded.add(diet)
+            pending.extend(DIET_IMPLIES.get(diet, ()))
+    return expanded
+
+
+def ingredient_allergens(ingredient):
+    """Return the allergen tags contained in a single ingredient name"""
+    return _name_allergens(normalize_tag(ingredient))
+
+
+# Catalogs repeat a few hundred ingredient names across every recipe
+@lru_cache(maxsize=8192)
+def _name_allergens(name):
+    if name in INGREDIENT_ALLERGENS:
+        return INGREDIENT_ALLERGENS[name]
+
+    stems = set()
+    for word in re.findall(r'[a-z]+', name):
+        stems.add(word)
+        stems.add(word[:-1] if word.endswith('s') else word)
+    return tuple(tag for tag, keywords in ALLERGEN_KEYWORDS.items()
+                 if any(keyword in stems for keyword in keywords))
+
+
+class RecipeCatalog:
+    """Immutable, indexed collection of recipes
+
+    Recipes are stored as parallel columns (interned strings, tuples and
+    typed arrays) instead of one dict per recipe.  The composite index maps
+    (meal_type, cuisine, goal) to the positions of every matching recipe,
+    with 'any' indexed as a wildcard for cuisine and goal.  Diet and allergen
+    restrictions are compiled into one 64-bit tag mask per recipe at load time.
+    """
+
+    def __init__(self, records):
+        records = list(records)
+        # Changes whenever any record does; part of the ETags of meal plan reads
+        self.version = hashlib.sha256(json.dumps(records, sort_keys=True).encode()).hexdigest()[:16]
+        self._ids = []
+        self._names = []
+        self._descriptions = []
+        self._ingredients = []
+        self._grocery = []
+        self._prep_times = []
+        self._meal_types = array('B')
+        self._cuisines = []
+        self._calories = array('H')
+        self._protein = array('H')
+        self._carbs = array('H')
+        self._fat = array('H')
+        self._positions = {}
+        self._by_name = {}
+        masks = []
+        by_ingredient = {}
+        index = {}
+
+        for record in records:
+            position = len(self._ids)
+            recipe_id = str(record['id'])
+            if recipe_id in self._positions:
+                raise ValueError('Duplicate recipe id: %s' % recipe_id)
+            meal_type = normalize_tag(record['meal_type'])
+            cuisine = normalize_tag(record.get('cuisine'))
+
+            self._positions[recipe_id] = position
+            self._by_name.setdefault((normalize_tag(record['name']), meal_type), []).append(position)
+            self._ids.append(sys.intern(recipe_id))
+            self._names.append(record['name'])
+            self._descriptions.append(record.get('description', ''))
+            # Ingredients are names or {name, quantity, unit, category} dicts
+            grocery = tuple((sys.intern(name), category, quantity, unit) for name, category, quantity, unit
+                            in map(grocery_item, record['ingredients']))
+            self._grocery.append(grocery)
+            self._ingredients.append(tuple(item[0] for item in grocery))
+            self._prep_times.append(sys.intern(record.get('prep_time', '')))
+            self._meal_types.append(MEAL_TYPES.index(meal_type))
+            self._cuisines.append(sys.intern(cuisine))
+            self._calories.append(int(record['calories']))
+            self._protein.append(int(record['protein']))
+            self._carbs.append(int(record['carbs']))
+            self._fat.append(int(record['fat']))
+
+            diets = expand_diets(record.get('diets', []))
+            mask = 0
+            for diet in DIET_TAGS:
+                if diet not in diets:
+                    mask |= TAG_BITS[diet]
+            for allergen in record.get('allergens', []):
+                mask |= TAG_BITS[normalize_tag(allergen)]
+            for ingredient in self._ingredients[position]:
+                by_ingredient.setdefault(normalize_tag(ingredient), array('I')).append(position)
+                for allergen in ingredient_allergens(ingredient):
+                    mask |= TAG_BITS[allergen]
+            masks.append(mask)
+
+            goals = {ANY} | {normalize_tag(g) for g in record.get('goals', [])}
+            for cuisine_key in {cuisine, ANY}:
+                for goal in goals:
+                    index.setdefault((meal_type, cuisine_key, goal), array('I')).append(position)
+
+        self._masks = np.array(masks, dtype=np.uint64)
+        self._macros = np.column_stack([
+            np.frombuffer(column, dtype=np.uint16)
+            for column in (self._calories, self._protein, self._carbs, self._fat)
+        ]).astype(np.float32).reshape(-1, 4)
+        self._by_ingredient = {k: np.frombuffer(v, dtype=np.uint32) for k, v in by_ingredient.items()}
+        self._index = {k: np.frombuffer(v, dtype=np.uint32) for k, v in index.items()}
+        self._band_keys = band_keys(minhash_signatures(
+            [[normalize_tag(i) for i in ingredients] for ingredients in self._ingredients]))
+
+    @classmethod
+    def from_file(cls, path=None):
+        """Load a catalog from a JSON array of recipe records"""
+        with open(path or DEFAULT_CATALOG_PATH) as fh:
+            return cls(json.load(fh))
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def macros(self):
+        """(recipes x 4) float32 matrix of MACRO_FIELDS"""
+        return self._macros
+
+    @property
+    def band_keys(self):
+        """(recipes x bands) uint64 LSH keys of each recipe's ingredient set"""
+        return self._band_keys
+
+    def position(self, recipe_id):
+        """Return the internal position of a recipe id, or None"""
+        return self._positions.get(recipe_id)
+
+    def find_recipe(self, name, meal_type, ingredients):
+        """Return the position of the recipe with this name, meal type and set of ingredient names, or None
+
+        Resolves meals stored before recipe ids were recorded.  Comparisons
+        ignore case; ingredients are names or ingredient dicts.
+        """
+        wanted = sorted(normalize_tag(grocery_item(ingredient)[0]) for ingredient in ingredients)
+        for position in self._by_name.get((normalize_tag(name), normalize_tag(meal_type)), ()):
+            if sorted(normalize_tag(ingredient) for ingredient in self._ingredients[position]) == wanted:
+                return position
+        return None
+
+    def meal(self, position):
+        """Build the public meal dict for the recipe at `position`"""
+        return {
+            'recipe_id': self._ids[position],
+            'name': self._names[position],
+            'description': self._descriptions[position],
+            'ingredients': list(self._ingredients[position]),
+            'prep_time': self._prep_times[position],
+            'calories': self._calories[position],
+            'protein': self._protein[position],
+            'carbs': self._carbs[position],
+            'fat': self._fat[position],
+            'meal_type': MEAL_TYPES[self._meal_types[position]]
+        }
+
+    def grocery_items(self, position):
+        """(name, category, quantity, unit) tuples of the recipe's ingredients"""
+        return self._grocery[position]
+
+    def compile_filter(self, dietary_preference, allergies):
+        """Compile a diet and allergy list into (tag_mask, excluded_positions)
+
+        Known diets and allergies become bits of the tag mask.  Allergies that
+        are not a known tag are matched against ingredient names through the
+        ingredient index; their recipes are returned as excluded positions.
+        """
+        mask = TAG_BITS.get(normalize_tag(dietary_preference), 0)
+        excluded = []
+        for allergy in allergies or []:
+            name = normalize_tag(allergy)
+            if name == ANY:
+                continue
+            singular = name[:-1] if name.endswith('s') else name
+            tags = ALLERGY_ALIASES.get(name) or ALLERGY_ALIASES.get(singular)
+            if tags is None:
+                tags = [t for t in (name, singular) if t in ALLERGEN_TAGS]
+            if tags:
+                for tag in tags:
+                    mask |= TAG_BITS[tag]
+                continue
+            for key in (name, singular, name + 's'):
+                if key in self._by_ingredient:
+                    excluded.append(self._by_ingredient[key])
+
+        if excluded:
+            excluded = np.unique(np.concatenate(excluded))
+        else:
+            excluded = None
+        return mask, excluded
+
+    def allows(self, position, recipe_filter):
+        """True if the recipe at `position` passes a compile_filter() result"""
+        mask, excluded = recipe_filter
+        if int(self._masks[position]) & mask:
+            return False
+        return excluded is None or position not in excluded
+
+    def coverage_gaps(self):
+        """(diet, meal_type) pairs with no recipe at all, for every diet in DIET_TAGS"""
+        gaps = []
+        for diet in DIET_TAGS:
+            recipe_filter = (TAG_BITS[diet], None)
+            for meal_type in MEAL_TYPES:
+                if not len(self.candidates(meal_type, ANY, ANY, recipe_filter)):
+                    gaps.append((diet, meal_type))
+        return gaps
+
+    def candidates(self, meal_type, cuisine, goal, recipe_filter=(0, None)):
+        """Return the positions of recipes matching the given preferences
+
+        `recipe_filter` is the result of compile_filter().  Cuisine and goal
+        are relaxed to 'any' (cuisine first) when nothing matches exactly;
+        diet and allergy restrictions are never relaxed.
+        """
+        mask, excluded = recipe_filter
+        mask = np.uint64(mask)
+        meal_type = normalize_tag(meal_type)
+        cuisine = normalize_tag(cuisine)
+        goal = normalize_tag(goal)
+
+        for key in ((meal_type, cuisine, goal),
+                    (meal_type, ANY, goal),
+                    (meal_type, cuisine, ANY),
+                    (meal_type, ANY, ANY)):
+            found = self._index.get(key)
+            if found is None:
+                continue
+            if mask:
+                found = found[(self._masks[found] & mask) == 0]
+            if excluded is not None and len(found):
+                found = found[~np.isin(found, excluded, assume_unique=True)]
+            if len(found):
+                return found
+        return np.empty(0, dtype=np.uint32)
+
+
+def load_catalog(path=None):
+    """Load the recipe catalog from `path`, RECIPE_CATALOG_PATH or the bundled data"""
+    return RecipeCatalog.from_file(path or os.getenv('RECIPE_CATALOG_PATH') or DEFAULT_CATALOG_PATH)
@@ -0,0 +1,230 @@
+"""
+MongoDB storage setup for the Python Meal Prep Application
+Builds the client with the configured pool size, timeouts and read
+preference, creates the indexes the routes rely on, and holds the
+projection each route reads with.  With MONGO_QUERY_DEBUG=1 every query
+shape is explained once in the background and logged if it scans a
+collection or sorts in memory.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MONGODB_URI = 'mongodb://localhost:27017/mealprep'
+READ_PREFERENCES = ('primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest')
+
+# Finished jobs, and jobs orphaned before leases were recorded, are removed
+# this many seconds after they were created
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', 7 * 24 * 3600))
+
+# Indexes created at startup, per collection.  meal_plans(user, date, _id)
+# serves my-plans keyset pages, stats and grocery lists; _id is included as
+# the pagination tie-breaker.  meal_plan_jobs.slot is only set on active
+# jobs and makes claiming a per-user job slot atomic.
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], unique=True, name='email_unique')
+    ],
+    'meal_plans': [
+        IndexModel([('user', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], name='user_date')
+    ],
+    'meal_plan_jobs': [
+        IndexModel([('user', ASCENDING), ('status', ASCENDING)], name='user_status'),
+        IndexModel([('slot', ASCENDING)], unique=True, sparse=True, name='slot_unique'),
+        IndexModel([('created', ASCENDING)], expireAfterSeconds=JOB_RETENTION, name='created_ttl')
+    ]
+}
+
+# Fields each route reads
+USER_EXISTS_PROJECTION = {'_id': 1}
+USER_LOGIN_PROJECTION = {'name': 1, 'email': 1, 'password': 1}
+USER_PROFILE_PROJECTION = {'password': 0, 'recent_recipes': 0}
+USER_SUMMARY_PROJECTION = {'name': 1, 'email': 1}
+RECENT_RECIPES_PROJECTION = {'recent_recipes': 1}
+MEAL_PLAN_PROJECTION = {
+    'user': 1,
+    'dietary_preference': 1,
+    'allergies': 1,
+    'nutritional_goal': 1,
+    'number_of_meals': 1,
+    'preferred_cuisine': 1,
+    'meals': 1,
+    'grocery_list': 1,
+    'body': 1,
+    'totals': 1,
+    'daily_average': 1,
+    'date': 1,
+    'rev': 1
+}
+
+# Fields that determine a meal plan read's ETag
+MEAL_PLAN_ETAG_PROJECTION = {'user': 1, 'rev': 1}
+
+# Fields read by a meal swap, besides the swapped meal itself
+MEAL_SWAP_PROJECTION = {
+    'user': 1,
+    'dietary_preference': 1,
+    'allergies': 1,
+    'nutritional_goal': 1,
+    'preferred_cuisine': 1,
+    'grocery_list': 1,
+    'body': 1,
+    'totals': 1,
+    'days': 1,
+    'rev': 1
+}
+
+
+def client_options(config):
+    """MongoClient keyword arguments from the MONGO_* settings in `config`"""
+    read_preference = config['MONGO_READ_PREFERENCE']
+    if read_preference not in READ_PREFERENCES:
+        raise ValueError('MONGO_READ_PREFERENCE must be one of %s' % ', '.join(READ_PREFERENCES))
+    return {
+        'maxPoolSize': config['MONGO_MAX_POOL_SIZE'],
+        'minPoolSize': config['MONGO_MIN_POOL_SIZE'],
+        'maxIdleTimeMS': config['MONGO_MAX_IDLE_TIME_MS'],
+        'waitQueueTimeoutMS': config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        'connectTimeoutMS': config['MONGO_CONNECT_TIMEOUT_MS'],
+        'serverSelectionTimeoutMS': config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'socketTimeoutMS': config['MONGO_SOCKET_TIMEOUT_MS'],
+        'readPreference': read_preference,
+        'appname': 'mealprep'
+    }
+
+
+def create_client(uri=None, event_listeners=(), client_class=MongoClient, options=None):
+    """Create a client (MongoClient or Motor's) with the given client_options()"""
+    return client_class(
+        uri or os.getenv('MONGODB_URI', DEFAULT_MONGODB_URI),
+        event_listeners=list(event_listeners),
+        **(options or {})
+    )
+
+
+def ensure_indexes(db):
+    """Create any missing INDEXES; failures are logged, not raised
+
+    A unique index cannot be built over existing duplicates, and the server
+    should still start in that case.
+    """
+    for name, indexes in INDEXES.items():
+        try:
+            db[name].create_indexes(indexes)
+        except PyMongoError as e:
+            logger.error('Could not create indexes on %s: %s', name, e)
+
+
+# Commands whose query plan QueryPlanChecker inspects
+EXPLAINED_COMMANDS = ('find', 'aggregate', 'count', 'findAndModify', 'update', 'delete')
+
+
+def query_shape(value):
+    """Replace the values of a filter with None, keeping field and operator names"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(value[0])] if value else []
+    return None
+
+
+def plan_stages(plan):
+    """Names of every stage in an explain winningPlan tree"""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if 'stage' in node:
+            stages.append(node['stage'])
+        for key in ('inputStage', 'queryPlan', 'outerStage', 'innerStage'):
+            pending.append(node.get(key))
+        pending.extend(node.get('inputStages') or [])
+    return stages
+
+
+def winning_plans(explain):
+    """Every winningPlan in an explain result, including aggregation $cursor stages"""
+    found = []
+    pending = [explain]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, dict):
+            if 'winningPlan' in node:
+                found.append(node['winningPlan'])
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    return found
+
+
+class QueryPlanChecker(monitoring.CommandListener):
+    """Debug listener that logs queries not served by an index
+
+    The first command of each shape (collection, command and filter fields)
+    is queued and explained on a background thread with the client passed to
+    attach().  A winning plan with a COLLSCAN or a blocking SORT is logged as
+    a warning.  Meant for development; it doubles the queries of new shapes.
+    """
+
+    def __init__(self, maxsize=1000):
+        self._client = None
+        self._seen = set()
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+
+    def attach(self, client):
+        self._client = client
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='query-plan-checker', daemon=True)
+            self._thread.start()
+
+    def started(self, event):
+        command = event.command
+        name = event.command_name
+        if name not in EXPLAINED_COMMANDS or self._client is None:
+            return
+        statements = command.get('updates') or command.get('deletes')
+        if statements is not None and len(statements) != 1:
+            return
+        shape = json.dumps([event.database_name, name, command.get(name), query_shape(
+            command.get('filter') or command.get('query') or command.get('pipeline')
+            or (statements or [{}])[0].get('q')), query_shape(command.get('sort'))], sort_keys=True, default=str)
+        if shape in self._seen:
+            return
+        self._seen.add(shape)
+        explained = {key: value for key, value in command.items()
+                     if not key.startswith('$') and key not in ('lsid', 'txnNumber', 'cursor')}
+        if name == 'aggregate':
+            explained['cursor'] = {}
+        try:
+            self._queue.put_nowait((event.database_name, explained))
+        except queue.Full:
+            pass
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def _run(self):
+        while True:
+            database, command = self._queue.get()
+            try:
+                explain = self._client[database].command({'explain': command, 'verbosity': 'queryPlanner'})
+            except PyMongoError as e:
+                logger.debug('Could not explain %s: %s', command, e)
+                continue
+            stages = [stage for plan in winning_plans(explain) for stage in plan_stages(plan)]
+            if 'COLLSCAN' in stages or 'SORT' in stages:
+                logger.warning('Query not covered by an index (%s): %s', ' > '.join(stages), command)
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Replaced before any test module imports storage.py, which binds MongoClient
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+else:
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """app.py imported against an in-memory MongoDB"""
+    if mongomock is None:
+        pytest.skip('requires mongomock')
+    os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+    os.environ.setdefault('PASSWORD_HASH_ITERATIONS', '1000')
+    import app
+    return app
+
+
+@pytest.fixture
+def application(app_module):
+    """A new app per test: its own in-memory database, caches and no rate limits"""
+    return app_module.create_app({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off'})
+
+
+@pytest.fixture
+def app_context(application):
+    """Run the test in application's context, so app.py helpers use its resources"""
+    with application.app_context():
+        yield application
+
+
+@pytest.fixture
+def client(application):
+    return application.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    from bson import ObjectId
+    response = client.post('/api/auth/register', json={
+        'name': 'Test User', 'email': 'test-%s@example.com' % ObjectId(), 'password': 'secret1'
+    })
+    return {'x-auth-token': response.get_json()['token']}
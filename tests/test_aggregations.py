@@ -0,0 +1,155 @@
+from datetime import datetime
+
+from bson import ObjectId
+import pytest
+
+from grocery import GROCERY_CATEGORIES
+
+
+def user_id_of(app_module, headers):
+    return app_module.decode_token(headers['x-auth-token'])['user']['id']
+
+
+def plan(user_id, date, **fields):
+    return dict({'user': ObjectId(user_id), 'dietary_preference': 'omnivore', 'allergies': [],
+                 'nutritional_goal': 'maintenance', 'number_of_meals': 0, 'preferred_cuisine': 'any',
+                 'meals': [], 'date': date}, **fields)
+
+
+def item(name, quantity, unit=None):
+    return {'name': name, 'quantity': quantity, 'unit': unit}
+
+
+def test_grocery_list_sums_embedded_shared_body_and_legacy_plans(app_module, app_context, client, auth_headers):
+    user_id = user_id_of(app_module, auth_headers)
+    db = app_module.get_db()
+    db.plan_bodies.insert_one({'_id': 'shared', 'meals': [], 'grocery_list': {'grains': [item('rice', 25, 'g')]}})
+    db.meal_plans.insert_many([
+        plan(user_id, datetime(2026, 10, 5), grocery_list={
+            'produce': [item('lemon', 0.1)], 'grains': [item('rice', 150, 'g'), item('rice', 1, 'cup')]
+        }),
+        # Two deduplicated plans share one stored body, which counts once per plan
+        plan(user_id, datetime(2026, 10, 6), body='shared'),
+        plan(user_id, datetime(2026, 10, 7), body='shared'),
+        # Plain names from before quantities were stored count as one each
+        plan(user_id, datetime(2026, 10, 8), grocery_list={'produce': ['lemon', 'lemon'], 'spices': ['cumin']}),
+        plan(user_id, datetime(2026, 11, 1), grocery_list={'produce': [item('lemon', 5)]}),
+        plan(str(ObjectId()), datetime(2026, 10, 6), grocery_list={'grains': [item('rice', 999, 'g')]})
+    ])
+
+    response = client.get('/api/meals/grocery-list?from=2026-10-01&to=2026-10-31', headers=auth_headers)
+    assert response.status_code == 200
+    expected = {category: [] for category in GROCERY_CATEGORIES}
+    expected.update({
+        'produce': [item('lemon', 2.1)],
+        'grains': [item('rice', 1, 'cup'), item('rice', 200, 'g')],
+        'spices': [item('cumin', 1)]
+    })
+    assert response.get_json()['data'] == expected
+
+
+def test_grocery_list_of_generated_reference_plans_matches_their_lists(app_module):
+    application = app_module.create_app({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off',
+                                         'MEAL_PLAN_STORAGE': 'deduplicated', 'MEAL_FORMAT': 'reference'})
+    client = application.test_client()
+    response = client.post('/api/auth/register', json={
+        'name': 'Shopper', 'email': 'shopper-%s@example.com' % ObjectId(), 'password': 'secret1'
+    })
+    headers = {'x-auth-token': response.get_json()['token']}
+    expected = {}
+    for goal in ('maintenance', 'weight-loss', 'maintenance'):
+        generated = client.post('/api/meals/generate', headers=headers, json={
+            'dietaryPreference': 'omnivore', 'nutritionalGoal': goal, 'numberOfMeals': 4, 'preferredCuisine': 'any'
+        }).get_json()['data']
+        for category, items in generated['grocery_items'].items():
+            for entry in items:
+                key = (category, entry['name'], entry['unit'])
+                expected[key] = expected.get(key, 0) + entry['quantity']
+
+    data = client.get('/api/meals/grocery-list', headers=headers).get_json()['data']
+    merged = {(category, entry['name'], entry['unit']): entry['quantity']
+              for category, items in data.items() for entry in items}
+    assert merged.keys() == expected.keys()
+    for key, quantity in expected.items():
+        assert abs(merged[key] - quantity) < 0.01, key
+
+
+def totals(calories, protein, carbs, fat):
+    return {'calories': calories, 'protein': protein, 'carbs': carbs, 'fat': fat}
+
+
+def test_stats_sum_stored_totals_per_period(app_module, app_context, client, auth_headers):
+    user_id = user_id_of(app_module, auth_headers)
+    app_module.get_db().meal_plans.insert_many([
+        # ISO week 2026-W41 runs from Monday 5 October
+        plan(user_id, datetime(2026, 10, 5, 8), days=2, totals=totals(4000, 200, 400, 100)),
+        plan(user_id, datetime(2026, 10, 11, 20), days=1, totals=totals(2100, 90, 250, 70)),
+        plan(user_id, datetime(2026, 10, 12, 8), days=2, totals=totals(3900, 180, 420, 110)),
+        # Plans stored before totals were recorded are left out
+        plan(user_id, datetime(2026, 10, 12, 9), grocery_list={}),
+        plan(str(ObjectId()), datetime(2026, 10, 12, 8), days=7, totals=totals(1, 1, 1, 1))
+    ])
+
+    weekly = client.get('/api/meals/stats', headers=auth_headers).get_json()['data']
+    assert weekly['summary'] == {'plans': 3, 'days': 5, 'totals': totals(10000, 470, 1070, 280),
+                                 'daily_average': totals(2000, 94, 214, 56)}
+    assert [(row['period'], row['plans'], row['days']) for row in weekly['trend']] == [
+        ('2026-W41', 2, 3), ('2026-W42', 1, 2)
+    ]
+    assert weekly['trend'][0]['totals'] == totals(6100, 290, 650, 170)
+    assert weekly['trend'][0]['daily_average'] == totals(2033.3, 96.7, 216.7, 56.7)
+
+    daily = client.get('/api/meals/stats?interval=day&from=2026-10-11', headers=auth_headers).get_json()['data']
+    assert [row['period'] for row in daily['trend']] == ['2026-10-11', '2026-10-12']
+    monthly = client.get('/api/meals/stats?interval=month', headers=auth_headers).get_json()['data']
+    assert [(row['period'], row['plans']) for row in monthly['trend']] == [('2026-10', 3)]
+
+    response = client.get('/api/meals/stats?interval=year', headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Interval must be one of day, week, month'
+
+
+@pytest.mark.parametrize('value, end, expected', [
+    ('2026-10-18', False, datetime(2026, 10, 18)),
+    # A bare end date includes the whole day
+    ('2026-10-18', True, datetime(2026, 10, 19)),
+    ('2026-10-18T09:30', True, datetime(2026, 10, 18, 9, 30)),
+    ('2026-10-18T09:30:00+02:00', False, datetime(2026, 10, 18, 7, 30)),
+    ('2026-10-18T23:30:00-01:00', True, datetime(2026, 10, 19, 0, 30)),
+    ('2026-10-18T09:30:00.250Z', False, datetime(2026, 10, 18, 9, 30, 0, 250000))
+])
+def test_date_bounds_are_naive_utc(app_module, value, end, expected):
+    assert app_module.parse_date_bound(value, end=end) == expected
+
+
+@pytest.mark.parametrize('args', [{'from': 'yesterday'}, {'to': '2026-13-01'}, {'from': '18/10/2026'}])
+def test_malformed_date_ranges_are_rejected(app_module, client, auth_headers, args):
+    assert app_module.parse_date_range(args) == (None, 'Invalid date range')
+    for url in ('/api/meals/stats', '/api/meals/grocery-list'):
+        response = client.get(url, query_string=args, headers=auth_headers)
+        assert response.status_code == 400
+        assert response.get_json() == {'success': False, 'message': 'Invalid date range'}
+
+
+def test_empty_ranges_give_empty_stats_and_grocery_lists(app_module, app_context, client, auth_headers):
+    assert app_module.parse_date_range({}) == (None, None)
+    user_id = user_id_of(app_module, auth_headers)
+    app_module.get_db().meal_plans.insert_one(plan(user_id, datetime(2026, 10, 18), days=1,
+                                                   totals=totals(2000, 100, 200, 50),
+                                                   grocery_list={'produce': [item('lemon', 1)]}))
+
+    for args in ({'from': '2026-10-19'}, {'to': '2026-10-17'}, {'from': '2026-10-18', 'to': '2026-10-17'}):
+        stats = client.get('/api/meals/stats', query_string=args, headers=auth_headers).get_json()['data']
+        assert stats == {'summary': {'plans': 0, 'days': 0, 'totals': totals(0, 0, 0, 0), 'daily_average': None},
+                         'trend': []}
+        groceries = client.get('/api/meals/grocery-list', query_string=args, headers=auth_headers).get_json()
+        assert groceries['data'] == {category: [] for category in GROCERY_CATEGORIES}
+
+    stats = client.get('/api/meals/stats?from=2026-10-18&to=2026-10-18', headers=auth_headers).get_json()['data']
+    assert stats['summary']['plans'] == 1
+
+
+def test_daily_average_divides_each_total_and_rounds_to_one_decimal(app_module):
+    assert app_module.daily_average(totals(2000, 100, 250, 70), 3) == totals(666.7, 33.3, 83.3, 23.3)
+    assert app_module.daily_average(totals(0, 0, 0, 0), 1) == totals(0, 0, 0, 0)
+    assert app_module.format_plan_stats([])['summary']['daily_average'] is None
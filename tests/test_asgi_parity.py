@@ -0,0 +1,137 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+pytest.importorskip('motor')
+mongomock_motor = pytest.importorskip('mongomock_motor')
+
+EMAIL = 'parity@example.com'
+GENERATE = {'dietaryPreference': 'omnivore', 'allergies': [], 'nutritionalGoal': 'maintenance',
+            'numberOfMeals': 4, 'preferredCuisine': 'any'}
+
+# Values that differ between two servers given the same requests
+VOLATILE = [
+    (re.compile(r'^[0-9a-f]{24}$'), '<id>'),
+    (re.compile(r'^eyJ[\w-]+\.[\w-]+\.[\w-]+$'), '<token>'),
+    (re.compile(r'^\w{3}, \d{2} \w{3} \d{4} \d{2}:\d{2}:\d{2} GMT$'), '<date>')
+]
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, str):
+        for pattern, placeholder in VOLATILE:
+            if pattern.match(value):
+                return placeholder
+    return value
+
+
+class WSGIServer:
+    """app.py served by Flask's test client"""
+
+    def __init__(self, application):
+        self.client = application.test_client()
+        self.token = self.plan_id = None
+
+    def request(self, method, path, body, headers):
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class ASGIServer:
+    """asgi_app.py on its own app's resources, with Motor over that app's in-memory database"""
+
+    def __init__(self, asgi_app, application):
+        self.asgi_app = asgi_app
+        self.application = application
+        self.token = self.plan_id = None
+
+    def request(self, method, path, body, headers):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+            'client': ('127.0.0.1', 50000),
+            'headers': [(key.lower().encode(), value.encode()) for key, value in headers.items()]
+        }
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body or b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        # app.py helpers called by the handlers use this app's resources
+        with self.application.app_context():
+            asyncio.run(self.asgi_app.application(scope, receive, send))
+        return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+@pytest.fixture
+def servers(app_module, application, monkeypatch):
+    asgi_app = pytest.importorskip('asgi_app')
+    backing = app_module.create_app({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off'})
+    resources = backing.extensions['mealprep']
+    monkeypatch.setattr(asgi_app, 'resources', resources)
+    monkeypatch.setattr(asgi_app, '_motor_client',
+                        mongomock_motor.AsyncMongoMockClient(mock_mongo_client=resources.db().client))
+    return WSGIServer(application), ASGIServer(asgi_app, backing)
+
+
+def exchange(servers, method, path, body=None, raw=None, auth=True, content_type='application/json'):
+    """Send the same request to both servers and return their common (status, body)"""
+    responses = []
+    for server in servers:
+        headers = {'Content-Type': content_type} if body is not None or raw is not None else {}
+        if auth and server.token:
+            headers['x-auth-token'] = server.token
+        data = raw if raw is not None else (json.dumps(body).encode() if body is not None else None)
+        status, data = server.request(method, path.format(plan_id=server.plan_id), data, headers)
+        responses.append((status, json.loads(data)))
+    assert normalize(responses[0]) == normalize(responses[1]), '%s %s' % (method, path)
+    return responses
+
+
+def test_both_servers_answer_the_same_requests_alike(servers):
+    register = {'name': 'Parity', 'email': EMAIL, 'password': 'secret1'}
+    responses = exchange(servers, 'POST', '/api/auth/register', register)
+    assert responses[0][0] == 200
+    for server, (status, body) in zip(servers, responses):
+        server.token = body['token']
+
+    exchange(servers, 'POST', '/api/auth/register', register)
+    exchange(servers, 'POST', '/api/auth/register', {'name': ' ', 'email': 'nope'})
+    exchange(servers, 'POST', '/api/auth/login', {'email': EMAIL, 'password': 'wrong1'})
+    exchange(servers, 'POST', '/api/auth/login', {'email': EMAIL, 'password': 'secret1'})
+    exchange(servers, 'GET', '/api/auth')
+    exchange(servers, 'GET', '/api/users/profile')
+    exchange(servers, 'PUT', '/api/users/profile', {'name': 'Renamed', 'email': EMAIL,
+                                                    'dietaryPreference': 'vegetarian'})
+    exchange(servers, 'PUT', '/api/users/profile', {'name': 'Renamed'})
+
+    responses = exchange(servers, 'POST', '/api/meals/generate', GENERATE)
+    assert responses[0][0] == 200
+    for server, (status, body) in zip(servers, responses):
+        server.plan_id = body['data']['_id']
+    exchange(servers, 'POST', '/api/meals/generate', dict(GENERATE, numberOfMeals=0))
+    exchange(servers, 'GET', '/api/meals/my-plans')
+    exchange(servers, 'GET', '/api/meals/{plan_id}')
+    exchange(servers, 'GET', '/api/meals/000000000000000000000000')
+    exchange(servers, 'PATCH', '/api/meals/{plan_id}/meals/0', raw=b'not json')
+    exchange(servers, 'GET', '/api/cache/stats')
+
+
+def test_both_servers_answer_errors_alike(servers):
+    statuses = [
+        exchange(servers, 'POST', '/api/auth/register', raw=b'{"name": ')[0][0],
+        exchange(servers, 'POST', '/api/auth/login', raw=b'email=a', content_type='text/plain')[0][0],
+        exchange(servers, 'GET', '/api/auth', auth=False)[0][0],
+        exchange(servers, 'GET', '/api/unknown')[0][0],
+        exchange(servers, 'DELETE', '/api/auth')[0][0]
+    ]
+    assert statuses == [400, 415, 401, 404, 405]
@@ -0,0 +1,103 @@
+import os
+
+from bson import ObjectId
+from jobs import MemoryJobStore
+import pytest
+
+
+def test_rate_limits_are_per_app_and_open_no_file_until_a_request(app_module, tmp_path):
+    path = str(tmp_path / 'buckets')
+    shared = app_module.create_app({'RATE_LIMIT_STORAGE': 'shared', 'RATE_LIMIT_SHM_PATH': path,
+                                    'RATE_LIMIT_DEFAULT': '1 per hour'})
+    assert not os.path.exists(path)
+
+    client = shared.test_client()
+    assert client.get('/api/cache/stats').status_code == 200
+    assert os.path.exists(path)
+    assert client.get('/api/cache/stats').status_code == 429
+
+    # Another app with its own in-memory buckets is not limited by the first
+    memory = app_module.create_app({'RATE_LIMIT_STORAGE': 'memory', 'RATE_LIMIT_DEFAULT': '1 per hour'})
+    assert memory.test_client().get('/api/cache/stats').status_code == 200
+
+
+def test_resources_are_built_from_app_config(app_module):
+    application = app_module.create_app({'MONGODB_URI': 'mongodb://db.example.com:27017/mealprep',
+                                         'JOB_BACKEND': 'memory', 'PLAN_CACHE_SIZE': 3})
+    resources = application.extensions['mealprep']
+    assert resources.plan_cache is not app_module.app.extensions['mealprep'].plan_cache
+    assert resources.plan_cache.maxsize == 3
+    assert isinstance(resources.job_runner().store, MemoryJobStore)
+    with application.app_context():
+        assert app_module.resources() is resources
+        assert app_module.get_db().client.address == ('db.example.com', 27017)
+
+
+def test_unknown_rate_limit_storage_is_rejected(app_module):
+    with pytest.raises(ValueError):
+        app_module.create_app({'RATE_LIMIT_STORAGE': 'redis'})
+
+
+def register(client):
+    response = client.post('/api/auth/register', json={
+        'name': 'Test User', 'email': 'test-%s@example.com' % ObjectId(), 'password': 'secret1'
+    })
+    return {'x-auth-token': response.get_json()['token']}
+
+
+def test_request_limits_and_jwt_secret_come_from_app_config(app_module, auth_headers):
+    application = app_module.create_app({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off', 'JWT_SECRET': 'other',
+                                         'MAX_SYNC_MEALS': 2, 'MAX_JOB_MEALS': 3, 'MAX_BATCH_SIZE': 1,
+                                         'MAX_PLAN_PAGE_SIZE': 2})
+    client = application.test_client()
+    # A token signed with the default app's secret is not valid here
+    assert client.get('/api/users/profile', headers=auth_headers).status_code == 401
+    headers = register(client)
+    body = {'dietaryPreference': 'omnivore', 'nutritionalGoal': 'maintenance', 'preferredCuisine': 'any'}
+
+    response = client.post('/api/meals/generate', headers=headers, json=dict(body, numberOfMeals=3))
+    assert response.status_code == 400
+    assert response.get_json()['message'].startswith('numberOfMeals above 2 ')
+    response = client.post('/api/meals/generate', headers=headers, json=dict(body, numberOfMeals=4))
+    assert response.get_json()['message'] == 'numberOfMeals must be between 1 and 3'
+    response = client.post('/api/meals/generate', headers=dict(headers, Prefer='respond-async'),
+                           json=dict(body, numberOfMeals=4))
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'numberOfMeals must be between 1 and 3'
+    response = client.post('/api/meals/generate-batch', headers=headers,
+                           json={'items': [dict(body, numberOfMeals=2)] * 2})
+    assert response.get_json()['message'] == 'Batch is limited to 1 items'
+    response = client.get('/api/meals/my-plans?limit=3', headers=headers)
+    assert response.get_json()['message'] == 'Limit must be between 1 and 2'
+
+
+def test_plan_storage_modes_come_from_app_config(app_module):
+    application = app_module.create_app({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off',
+                                         'MEAL_PLAN_STORAGE': 'deduplicated', 'MEAL_FORMAT': 'reference'})
+    client = application.test_client()
+    response = client.post('/api/meals/generate', headers=register(client), json={
+        'dietaryPreference': 'omnivore', 'nutritionalGoal': 'maintenance', 'preferredCuisine': 'any',
+        'numberOfMeals': 4
+    })
+    assert response.status_code == 200
+    with application.app_context():
+        stored = app_module.get_db().meal_plans.find_one()
+        body = app_module.get_db().plan_bodies.find_one({'_id': stored['body']})
+    assert 'meals' not in stored
+    assert all('recipe_id' in meal and 'ingredients' not in meal for meal in body['meals'])
+
+
+def test_mongo_client_options_come_from_app_config(app_module):
+    application = app_module.create_app({'MONGO_MAX_POOL_SIZE': 7, 'MONGO_READ_PREFERENCE': 'secondaryPreferred',
+                                         'MONGO_SOCKET_TIMEOUT_MS': 1000})
+    options = application.extensions['mealprep'].client_options
+    assert options['maxPoolSize'] == 7
+    assert options['readPreference'] == 'secondaryPreferred'
+    assert options['socketTimeoutMS'] == 1000
+
+
+@pytest.mark.parametrize('config', [{'MONGO_READ_PREFERENCE': 'fastest'}, {'MEAL_FORMAT': 'compact'},
+                                    {'MEAL_PLAN_STORAGE': 'gridfs'}])
+def test_unknown_storage_settings_are_rejected(app_module, config):
+    with pytest.raises(ValueError):
+        app_module.create_app(config)
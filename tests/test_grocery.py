@@ -0,0 +1,64 @@
+from grocery import GroceryAggregator, grocery_item, grocery_names, grocery_quantities, swap_grocery_items
+
+
+def items(*ingredients):
+    return tuple(grocery_item(ingredient) for ingredient in ingredients)
+
+
+def grocery_list(*ingredients):
+    aggregator = GroceryAggregator()
+    aggregator.add(items(*ingredients))
+    return aggregator.to_dict()
+
+
+def test_shared_ingredient_quantities_change_in_place():
+    stored = grocery_list({'name': 'Rice', 'quantity': 100, 'unit': 'g'}, {'name': 'Rice', 'quantity': 50, 'unit': 'g'},
+                          {'name': 'Milk', 'quantity': 1, 'unit': 'cup'})
+    updated, quantities, replaced = swap_grocery_items(
+        stored, items({'name': 'Rice', 'quantity': 50, 'unit': 'g'}, {'name': 'Milk', 'quantity': 1, 'unit': 'cup'}),
+        items({'name': 'Rice', 'quantity': 0.075, 'unit': 'kg'}, {'name': 'Milk', 'quantity': 2, 'unit': 'tbsp'})
+    )
+    assert updated['grains'] == [{'name': 'Rice', 'quantity': 175, 'unit': 'g'}]
+    assert updated['dairy'] == [{'name': 'Milk', 'quantity': 30, 'unit': 'ml'}]
+    assert quantities == {('grains', 0): 175, ('dairy', 0): 30}
+    assert replaced == {}
+
+
+def test_items_that_run_out_or_appear_rewrite_their_category():
+    stored = grocery_list('Salmon', 'Tofu', {'name': 'Lemon', 'quantity': 0.5})
+    updated, quantities, replaced = swap_grocery_items(
+        stored, items('Salmon', {'name': 'Lemon', 'quantity': 0.5}), items('Chicken breast', 'Lime')
+    )
+    assert updated['proteins'] == [{'name': 'Tofu', 'quantity': 1, 'unit': None},
+                                   {'name': 'Chicken breast', 'quantity': 1, 'unit': None}]
+    assert updated['produce'] == [{'name': 'Lime', 'quantity': 1, 'unit': None}]
+    assert replaced == {'proteins': updated['proteins'], 'produce': updated['produce']}
+    assert quantities == {}
+
+
+def test_legacy_name_lists_stay_plain():
+    stored = {'produce': ['Cucumber', 'Tomatoes', 'Cucumber'], 'proteins': ['Chickpeas'], 'pantry': ['Olives'],
+              'grains': ['Quinoa'], 'dairy': ['Feta cheese']}
+    updated, quantities, replaced = swap_grocery_items(
+        stored, items('Quinoa', 'Chickpeas', 'Cucumber', 'Tomatoes', 'Olives', 'Feta cheese'),
+        items({'name': 'Chickpeas', 'quantity': 120, 'unit': 'g'}, {'name': 'Cucumber', 'quantity': 0.5}, 'Tahini')
+    )
+    assert updated == {'produce': ['Cucumber', 'Cucumber'], 'proteins': ['Chickpeas'], 'pantry': ['Tahini'],
+                       'grains': [], 'dairy': []}
+    assert all(isinstance(item, str) for entries in updated.values() for item in entries)
+    assert quantities == {}
+    assert replaced == updated
+
+
+def test_responses_give_names_in_grocery_list_and_quantities_in_grocery_items():
+    stored = grocery_list({'name': 'Rice', 'quantity': 100, 'unit': 'g'}, {'name': 'Rice', 'quantity': 1, 'unit': 'cup'},
+                          'Salmon')
+    assert grocery_names(stored)['grains'] == ['Rice', 'Rice']
+    assert grocery_names(stored)['proteins'] == ['Salmon']
+    assert grocery_quantities(stored) == stored
+
+    legacy = {'produce': ['Cucumber', 'Tomatoes', 'Cucumber'], 'dairy': []}
+    assert grocery_names(legacy) == legacy
+    assert grocery_quantities(legacy) == {'produce': [{'name': 'Cucumber', 'quantity': 2, 'unit': None},
+                                                      {'name': 'Tomatoes', 'quantity': 1, 'unit': None}],
+                                          'dairy': []}
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+import threading
+
+from bson import ObjectId
+import pytest
+
+from jobs import JobRunner, MemoryJobStore, MongoJobStore, TooManyUserJobs
+from storage import INDEXES
+
+mongomock = pytest.importorskip('mongomock')
+
+
+def mongo_store():
+    collection = mongomock.MongoClient().db.meal_plan_jobs
+    collection.create_indexes(INDEXES['meal_plan_jobs'])
+    return MongoJobStore(collection)
+
+
+@pytest.fixture(params=['mongo', 'memory'])
+def store(request):
+    return mongo_store() if request.param == 'mongo' else MemoryJobStore()
+
+
+def new_job(user_id, expires=None):
+    now = datetime.utcnow()
+    return {'_id': ObjectId(), 'user': user_id, 'kind': 'generate', 'status': 'queued',
+            'created': now, 'expires': expires or now + timedelta(seconds=60)}
+
+
+def test_claim_caps_active_jobs_per_user(store):
+    user_id = ObjectId()
+    first, second, third = new_job(user_id), new_job(user_id), new_job(user_id)
+    assert store.claim(first, 2) and store.claim(second, 2)
+    assert not store.claim(third, 2)
+    assert store.claim(new_job(ObjectId()), 2)
+
+    store.finish(first['_id'], {'status': 'done'})
+    assert store.claim(third, 2)
+
+
+def test_orphaned_jobs_expire_and_free_their_slots(store):
+    user_id = ObjectId()
+    orphan = new_job(user_id, expires=datetime.utcnow() - timedelta(seconds=1))
+    assert store.claim(orphan, 1)
+    assert not store.claim(new_job(user_id), 1)
+
+    store.expire(user_id, datetime.utcnow())
+    assert store.get(orphan['_id'])['status'] == 'failed'
+    assert store.claim(new_job(user_id), 1)
+
+
+def test_runner_reports_a_dead_process_job_as_failed():
+    store = mongo_store()
+    user_id = ObjectId()
+    orphan = new_job(user_id, expires=datetime.utcnow() - timedelta(seconds=1))
+    store.claim(orphan, 1)
+
+    runner = JobRunner(store, per_user=1)
+    assert runner.get(orphan['_id'])['status'] == 'failed'
+    done = threading.Event()
+    job = runner.submit(user_id, 'generate', lambda: done.wait(5) and {})
+    with pytest.raises(TooManyUserJobs):
+        runner.submit(user_id, 'generate', dict)
+    done.set()
+    runner._executor.get().shutdown(wait=True)
+    assert runner.get(job['_id'])['status'] == 'done'
+
+
+def test_runner_renews_leases_of_running_jobs():
+    store = MemoryJobStore()
+    runner = JobRunner(store, lease=0.3)
+    done = threading.Event()
+    job = runner.submit(ObjectId(), 'generate', lambda: done.wait(5) and {})
+    first = store.get(job['_id'])['expires']
+    threading.Event().wait(0.5)
+    assert store.get(job['_id'])['expires'] > first
+    assert runner.get(job['_id'])['status'] == 'running'
+    done.set()
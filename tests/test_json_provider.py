@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import pytest
+
+from json_provider import JSON_ENCODERS, json_provider
+
+DOCUMENT = {'_id': ObjectId('6ad494738469c16cac1f5729'), 'name': 'Crème brûlée',
+            'date': datetime(2026, 10, 18, 9, 2, 57, 503000)}
+
+
+def encode(encoder, **settings):
+    app = Flask(__name__)
+    try:
+        app.json = json_provider(app, encoder, **settings)
+    except RuntimeError as e:
+        pytest.skip(str(e))
+    with app.app_context():
+        return app.json.response(DOCUMENT).get_data()
+
+
+@pytest.mark.parametrize('encoder', JSON_ENCODERS)
+def test_default_output_matches_flask(encoder):
+    app = Flask(__name__)
+    app.json = DefaultJSONProvider(app)
+    with app.app_context():
+        expected = app.json.response(dict(DOCUMENT, _id=str(DOCUMENT['_id']))).get_data()
+
+    body = encode(encoder)
+    assert body == expected
+    assert b'"Sun, 18 Oct 2026 09:02:57 GMT"' in body
+    assert b'Cr\\u00e8me' in body
+
+
+@pytest.mark.parametrize('encoder', JSON_ENCODERS)
+def test_iso_dates_and_utf8_are_opt_in(encoder):
+    body = encode(encoder, date_format='iso', ensure_ascii=False)
+    assert b'"2026-10-18T09:02:57.503000Z"' in body
+    assert 'Crème brûlée'.encode() in body
+
+
+def test_unknown_date_format_is_rejected():
+    with pytest.raises(ValueError):
+        json_provider(Flask(__name__), 'stdlib', 'rfc3339')
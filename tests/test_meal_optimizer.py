@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import meal_optimizer
+from meal_optimizer import NoCandidatesError, optimize_plan, recipe_scores
+from recipe_catalog import MEAL_TYPES
+
+MACROS = np.array([[500, 30, 50, 20]] * 4, dtype=np.float32)
+
+
+def generate_body(**fields):
+    return dict({'dietaryPreference': 'omnivore', 'allergies': [], 'nutritionalGoal': 'maintenance',
+                 'numberOfMeals': 8, 'preferredCuisine': 'any'}, **fields)
+
+
+@pytest.mark.parametrize('mode', ['greedy', 'search'])
+def test_plan_has_one_recipe_per_slot(mode):
+    candidates = {meal_type: np.array([i], dtype=np.uint32) for i, meal_type in enumerate(MEAL_TYPES)}
+    assert optimize_plan(MACROS, candidates, 10, 'maintenance', mode) == [0, 1, 2, 3] * 2 + [0, 1]
+
+
+def test_missing_meal_type_raises_instead_of_short_plan():
+    candidates = {meal_type: np.array([i], dtype=np.uint32) for i, meal_type in enumerate(MEAL_TYPES)}
+    candidates['lunch'] = np.empty(0, dtype=np.uint32)
+    with pytest.raises(NoCandidatesError) as raised:
+        optimize_plan(MACROS, candidates, 8, 'maintenance')
+    assert raised.value.meal_types == ['lunch']
+    # Only slots the plan has need candidates
+    assert optimize_plan(MACROS, candidates, 1, 'maintenance') == [0]
+
+
+def test_generate_rejects_preferences_that_leave_a_meal_type_empty(client, auth_headers):
+    body = generate_body(dietaryPreference='keto', allergies=['dairy', 'eggs'])
+    for headers in (auth_headers, dict(auth_headers, Prefer='respond-async')):
+        response = client.post('/api/meals/generate', json=body, headers=headers)
+        assert response.status_code == 400
+        assert response.get_json()['message'] == 'No recipes match these preferences for lunch'
+
+
+def test_generated_plan_has_every_requested_meal(client, auth_headers):
+    response = client.post('/api/meals/generate', json=generate_body(dietaryPreference='keto'),
+                           headers=auth_headers)
+    data = response.get_json()['data']
+    assert len(data['meals']) == 8
+    assert data['daily_average']['calories'] == round(data['totals']['calories'] / 2)
+
+
+def test_batch_reports_unfillable_items(client, auth_headers):
+    items = [generate_body(), generate_body(dietaryPreference='keto', allergies=['dairy', 'eggs'])]
+    results = client.post('/api/meals/generate-batch', json={'items': items},
+                          headers=auth_headers).get_json()['data']['results']
+    assert [result['success'] for result in results] == [True, False]
+    assert results[1]['message'] == 'No recipes match these preferences for lunch'
+
+
+def test_score_cache_is_keyed_on_known_goals():
+    meal_optimizer._score_cache.clear()
+    for goal in ('Weight-Loss', 'weight-loss', 'bulk', 'x' * 100, 'maintenance'):
+        recipe_scores(MACROS, 'dinner', goal)
+    assert sorted(meal_optimizer._score_cache) == [('maintenance', 'dinner'), ('weight-loss', 'dinner')]
@@ -0,0 +1,196 @@
+import json
+
+from bson import ObjectId
+from pymongo.errors import AutoReconnect
+
+from migrate_meal_plans import migrate_collection
+from recipe_catalog import DEFAULT_CATALOG_PATH, RecipeCatalog
+
+
+def generate_body(**fields):
+    return dict({'dietaryPreference': 'omnivore', 'allergies': [], 'nutritionalGoal': 'maintenance',
+                 'numberOfMeals': 4, 'preferredCuisine': 'any'}, **fields)
+
+
+def test_batch_records_a_failed_chunk_and_continues(app_module, app_context, monkeypatch):
+    writer = app_module.get_meal_plans_writer()
+    calls = []
+
+    class FlakyWriter:
+        def insert_many(self, docs, ordered=True):
+            calls.append(len(docs))
+            if len(calls) == 1:
+                raise AutoReconnect('connection reset')
+            return writer.insert_many(docs, ordered=ordered)
+
+    monkeypatch.setitem(app_context.config, 'BATCH_CHUNK_SIZE', 2)
+    monkeypatch.setattr(app_module, 'get_meal_plans_writer', FlakyWriter)
+    user_id = str(ObjectId())
+    results = app_module.generate_meal_plans_batch([(user_id, generate_body())] * 5)
+
+    assert calls == [2, 2, 1]
+    assert [result['success'] for result in results] == [False, False, True, True, True]
+    assert results[0] == {'index': 0, 'success': False, 'message': 'Database error'}
+    assert writer.count_documents({'user': ObjectId(user_id)}) == 3
+
+
+
+def test_each_batch_item_is_steered_by_the_items_before_it(app_module, app_context, auth_headers):
+    user_id = app_module.decode_token(auth_headers['x-auth-token'])['user']['id']
+    results = app_module.generate_meal_plans_batch([(user_id, generate_body())] * 3)
+    assert all(result['success'] for result in results)
+
+    plans = app_module.get_db().meal_plans
+    picks = [app_module.plan_recipe_ids(plans.find_one({'_id': result['_id']})['meals']) for result in results]
+    assert picks[0] != picks[1] and picks[1] != picks[2]
+    app_module.flush_write_behind()
+    # Ordered by last use across the batch
+    expected = {}
+    for recipe_id in picks[0] + picks[1] + picks[2]:
+        expected.pop(recipe_id, None)
+        expected[recipe_id] = True
+    history = app_module.get_db().users.find_one({'_id': ObjectId(user_id)})['recent_recipes']
+    assert history == list(expected)[-app_module.setting('VARIETY_HISTORY'):]
+
+
+LEGACY_LUNCH = {
+    'name': 'Quinoa Mediterranean Salad',
+    'description': 'Quinoa with chickpeas, cucumber, tomatoes, olives, and feta',
+    'ingredients': ['Quinoa', 'Chickpeas', 'Cucumber', 'Tomatoes', 'Olives', 'Feta cheese'],
+    'prep_time': '20 minutes', 'calories': 450, 'protein': 16, 'carbs': 58, 'fat': 18, 'meal_type': 'lunch'
+}
+
+
+def test_swapping_a_legacy_meal_picks_another_recipe_and_keeps_names(app_module, app_context, client, auth_headers):
+    user_id = app_module.decode_token(auth_headers['x-auth-token'])['user']['id']
+    plan_id = app_module.get_db().meal_plans.insert_one({
+        'user': ObjectId(user_id), 'dietary_preference': 'vegetarian', 'allergies': [],
+        'nutritional_goal': 'maintenance', 'number_of_meals': 1, 'preferred_cuisine': 'mediterranean',
+        'meals': [LEGACY_LUNCH],
+        'grocery_list': {'produce': ['Cucumber', 'Tomatoes'], 'grains': ['Quinoa'], 'proteins': ['Chickpeas'],
+                         'dairy': ['Feta cheese'], 'pantry': ['Olives']},
+        'date': app_module.now_millis()
+    }).inserted_id
+
+    response = client.patch('/api/meals/%s/meals/0' % plan_id, headers=auth_headers)
+    data = response.get_json()['data']
+    assert data['meal']['recipe_id'] != 'med-quinoa-salad'
+    assert data['meal']['meal_type'] == 'lunch'
+    stored = app_module.get_db().meal_plans.find_one({'_id': plan_id})
+    names = [item for entries in stored['grocery_list'].values() for item in entries]
+    assert all(isinstance(item, str) for item in names)
+    assert sorted(names) == sorted(data['meal']['ingredients'])
+
+
+def test_history_is_cached_in_place_and_written_behind(app_module, app_context, client, auth_headers, monkeypatch):
+    user_id = app_module.decode_token(auth_headers['x-auth-token'])['user']['id']
+    first = client.post('/api/meals/generate', json=generate_body(), headers=auth_headers).get_json()['data']
+    first_ids = [meal['recipe_id'] for meal in first['meals']]
+
+    reads = []
+    find_one = app_module.get_db().users.find_one
+    monkeypatch.setattr(type(app_module.get_db().users), 'find_one',
+                        lambda self, *args, **kwargs: reads.append(args) or find_one(*args, **kwargs))
+    second = client.post('/api/meals/generate', json=generate_body(), headers=auth_headers).get_json()['data']
+    second_ids = [meal['recipe_id'] for meal in second['meals']]
+    monkeypatch.undo()
+
+    assert not [args for args in reads if args[1:] == (app_module.RECENT_RECIPES_PROJECTION,)]
+    assert not set(first_ids) & set(second_ids)
+    assert app_module.resources().recent_recipes_cache.get(user_id) == first_ids + second_ids
+
+    app_module.flush_write_behind()
+    stored = app_module.get_db().users.find_one({'_id': ObjectId(user_id)})
+    assert stored['recent_recipes'] == first_ids + second_ids
+
+
+def test_history_penalty_reuses_memoized_rankings(app_module, app_context):
+    preferences = dict(dietary_preference='omnivore', allergies=[], nutritional_goal='weight-loss',
+                       number_of_meals=8, preferred_cuisine='any')
+    recent = app_module.plan_recipe_ids(app_module.compute_meal_plan(**preferences)['meals'])
+
+    varied = app_module.generate_meal_plan(recent=recent, **preferences)
+    assert len(app_module.resources().ranking_cache) == 1
+    assert varied == app_module.compute_meal_plan(recent=recent, **preferences)
+    assert not set(recent) & set(app_module.plan_recipe_ids(varied['meals']))
+    # A history outside every ranking leaves the memoized plan in place
+    assert app_module.generate_meal_plan(recent=['no-such-recipe'], **preferences) is \
+        app_module.generate_meal_plan(**preferences)
+
+
+def lemon_lunch(recipe_id, lemons, protein):
+    return {'id': recipe_id, 'name': recipe_id, 'description': '', 'prep_time': '5 minutes',
+            'ingredients': [{'name': 'Lemon', 'quantity': lemons}], 'calories': 300, 'protein': protein,
+            'carbs': 30, 'fat': 10, 'meal_type': 'lunch', 'cuisine': 'mediterranean', 'diets': ['vegan'],
+            'goals': ['maintenance']}
+
+
+def test_swapped_quantities_and_totals_are_stored_as_returned(app_module, app_context, client, auth_headers,
+                                                              monkeypatch):
+    with open(DEFAULT_CATALOG_PATH) as fh:
+        records = json.load(fh)
+    catalog = RecipeCatalog(records + [lemon_lunch('lemon-a', 0.1, 10), lemon_lunch('lemon-b', 0.2, 13)])
+    monkeypatch.setattr(app_module, '_catalog', catalog)
+    old = catalog.meal(catalog.position('lemon-a'))
+    user_id = app_module.decode_token(auth_headers['x-auth-token'])['user']['id']
+    plan_id = app_module.get_db().meal_plans.insert_one({
+        'user': ObjectId(user_id), 'dietary_preference': 'vegan', 'allergies': [],
+        'nutritional_goal': 'maintenance', 'number_of_meals': 1, 'preferred_cuisine': 'mediterranean',
+        'meals': [old], 'grocery_list': {'produce': [{'name': 'Lemon', 'quantity': 0.2, 'unit': None}]},
+        'totals': {'calories': 300, 'protein': 10, 'carbs': 30, 'fat': 10}, 'date': app_module.now_millis()
+    }).inserted_id
+
+    response = client.patch('/api/meals/%s/meals/0' % plan_id, json={'recipeId': 'lemon-b'}, headers=auth_headers)
+    data = response.get_json()['data']
+    assert data['grocery_items']['produce'] == [{'name': 'Lemon', 'quantity': 0.3, 'unit': None}]
+    assert data['grocery_list']['produce'] == ['Lemon']
+    assert data['totals']['protein'] == 13
+
+    # Compared as JSON, so 0.30000000000000004 or 300.0 stored for 300 would show up
+    stored = app_module.get_db().meal_plans.find_one({'_id': plan_id})
+    assert json.dumps(stored['grocery_list']) == json.dumps(data['grocery_items'])
+    assert json.dumps(stored['totals'], sort_keys=True) == json.dumps(data['totals'], sort_keys=True)
+    fetched = client.get('/api/meals/%s' % plan_id, headers=auth_headers).get_json()['data']
+    assert fetched['grocery_list'] == data['grocery_list']
+    assert fetched['grocery_items'] == data['grocery_items']
+
+
+def revalidate(client, url, headers, etag):
+    return client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+
+
+def test_plan_reads_answer_304_until_a_swap_or_migration_changes_the_plan(app_module, app_context, client,
+                                                                          auth_headers):
+    user_id = app_module.decode_token(auth_headers['x-auth-token'])['user']['id']
+    plan_id = app_module.get_db().meal_plans.insert_one({
+        'user': ObjectId(user_id), 'dietary_preference': 'vegetarian', 'allergies': [],
+        'nutritional_goal': 'maintenance', 'number_of_meals': 1, 'preferred_cuisine': 'mediterranean',
+        'meals': [LEGACY_LUNCH], 'grocery_list': {}, 'date': app_module.now_millis()
+    }).inserted_id
+    urls = ['/api/meals/my-plans', '/api/meals/%s' % plan_id]
+
+    etags = {}
+    for url in urls:
+        response = client.get(url, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        etags[url] = response.headers['ETag']
+        not_modified = revalidate(client, url, auth_headers, etags[url])
+        assert not_modified.status_code == 304
+        assert not_modified.get_data() == b''
+        assert not_modified.headers['ETag'] == etags[url]
+
+    # The legacy meal gains a recipe_id, so both reads must change
+    migrate_collection(app_module.get_db().meal_plans, 'reference', app_module.get_catalog(), 10, False)
+    for url in urls:
+        response = revalidate(client, url, auth_headers, etags[url])
+        assert response.status_code == 200
+        assert response.get_json()['data'] is not None
+        assert response.headers['ETag'] != etags[url]
+        etags[url] = response.headers['ETag']
+
+    assert client.patch('/api/meals/%s/meals/0' % plan_id, headers=auth_headers).status_code == 200
+    for url in urls:
+        response = revalidate(client, url, auth_headers, etags[url])
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etags[url]
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import metrics
+from metrics import Counter, Histogram, MongoCommandListener
+
+GENERATE = {'dietaryPreference': 'omnivore', 'nutritionalGoal': 'maintenance', 'numberOfMeals': 2,
+            'preferredCuisine': 'any'}
+
+
+def scrape(client):
+    """/metrics samples as {'name{labels}': value}"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'version=0.0.4' in response.headers['Content-Type']
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line and not line.startswith('#'):
+            series, value = line.rsplit(' ', 1)
+            samples[series] = float(value)
+    return samples
+
+
+def delta(before, after, series):
+    return after.get(series, 0) - before.get(series, 0)
+
+
+def test_requests_and_their_stages_are_counted(client, auth_headers):
+    before = scrape(client)
+    assert client.get('/api/users/profile', headers=auth_headers).status_code == 200
+    assert client.post('/api/meals/generate', json=GENERATE, headers=auth_headers).status_code == 200
+    assert client.get('/api/no-such-route').status_code == 404
+    after = scrape(client)
+
+    requests = 'mealprep_request_duration_seconds_count{method="%s",route="%s",status="%s"}'
+    assert delta(before, after, requests % ('GET', '/api/users/profile', 200)) == 1
+    assert delta(before, after, requests % ('POST', '/api/meals/generate', 200)) == 1
+    assert delta(before, after, requests % ('GET', 'unmatched', 404)) == 1
+    # The scrape that produced `before` was itself counted before `after` was rendered
+    assert delta(before, after, requests % ('GET', '/metrics', 200)) == 1
+
+    stages = 'mealprep_stage_duration_seconds_count{route="/api/meals/generate",stage="%s"}'
+    for name in ('auth', 'generate', 'serialize'):
+        assert delta(before, after, stages % name) >= 1, name
+    assert after['mealprep_request_duration_seconds_sum{method="POST",route="/api/meals/generate",status="200"}'] > 0
+
+
+def test_histogram_buckets_are_cumulative_and_end_at_the_count():
+    histogram = Histogram('test_seconds', 'Test latency', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, '/a"b')
+    assert histogram.render() == [
+        '# HELP test_seconds Test latency',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{route="/a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{route="/a\\"b",le="1.0"} 3',
+        'test_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{route="/a\\"b"} 3.650000',
+        'test_seconds_count{route="/a\\"b"} 4'
+    ]
+
+
+def test_counters_add_up_per_label_values():
+    counter = Counter('test_total', 'Test count', ('kind',))
+    counter.inc('b')
+    counter.inc('a', amount=2)
+    counter.inc('b')
+    assert counter.render()[2:] == ['test_total{kind="a"} 2', 'test_total{kind="b"} 2']
+
+
+def command_event(request_id, command_name, command, micros):
+    return SimpleNamespace(request_id=request_id, command_name=command_name, command=command,
+                           duration_micros=micros)
+
+
+def test_mongo_commands_are_timed_by_command_and_collection():
+    listener = MongoCommandListener()
+    series = '{command="find",collection="metrics_test"}'
+
+    listener.started(command_event(1, 'find', {'find': 'metrics_test'}, 0))
+    listener.succeeded(command_event(1, 'find', {}, 2000))
+    listener.started(command_event(2, 'find', {'find': 'metrics_test'}, 0))
+    listener.failed(command_event(2, 'find', {}, 500))
+
+    rendered = metrics.render()
+    assert 'mealprep_mongo_command_duration_seconds_count%s 2' % series in rendered
+    assert 'mealprep_mongo_command_duration_seconds_sum%s 0.002500' % series in rendered
+    assert 'mealprep_mongo_command_failures_total%s 1' % series in rendered
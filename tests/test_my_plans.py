@@ -0,0 +1,124 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+import pytest
+
+DAY = datetime(2026, 10, 18, 9, 2, 57, 503000)
+
+
+def user_id_of(app_module, headers):
+    return app_module.decode_token(headers['x-auth-token'])['user']['id']
+
+
+def insert_plans(app_module, user_id, dates):
+    """Insert one minimal plan per date for the user and return their ids"""
+    return app_module.get_db().meal_plans.insert_many([{
+        'user': ObjectId(user_id), 'dietary_preference': 'omnivore', 'allergies': [],
+        'nutritional_goal': 'maintenance', 'number_of_meals': 0, 'preferred_cuisine': 'any',
+        'meals': [], 'grocery_list': {}, 'date': date
+    } for date in dates]).inserted_ids
+
+
+def walk(client, headers, limit):
+    """Follow `next` tokens from the first page; return the pages' plan ids"""
+    pages = []
+    url = '/api/meals/my-plans?limit=%d' % limit
+    while url:
+        body = client.get(url, headers=headers).get_json()
+        pages.append([plan['_id'] for plan in body['data']])
+        url = body['next'] and '/api/meals/my-plans?limit=%d&next=%s' % (limit, body['next'])
+    return pages
+
+
+def test_pages_cover_every_plan_once_newest_first_with_ties_on_date(app_module, app_context, client,
+                                                                     auth_headers):
+    # Three plans share a date, so the _id breaks the tie across the page boundary
+    dates = [DAY - timedelta(days=1), DAY, DAY, DAY, DAY - timedelta(days=2)]
+    ids = insert_plans(app_module, user_id_of(app_module, auth_headers), dates)
+    expected = [str(plan_id) for date, plan_id in sorted(zip(dates, ids), reverse=True)]
+
+    pages = walk(client, auth_headers, 2)
+    assert pages == [expected[0:2], expected[2:4], expected[4:5]]
+
+
+def test_a_full_last_page_has_no_next_token(app_module, app_context, client, auth_headers):
+    dates = [DAY - timedelta(hours=hour) for hour in range(4)]
+    insert_plans(app_module, user_id_of(app_module, auth_headers), dates)
+
+    pages = walk(client, auth_headers, 2)
+    assert [len(page) for page in pages] == [2, 2]
+
+    body = client.get('/api/meals/my-plans?limit=4', headers=auth_headers).get_json()
+    assert len(body['data']) == 4
+    assert body['next'] is None
+
+
+def test_page_tokens_round_trip_at_millisecond_precision(app_module):
+    plan_id = ObjectId()
+    assert app_module.decode_page_token(app_module.encode_page_token(DAY, plan_id)) == (DAY, plan_id)
+
+
+@pytest.mark.parametrize('token', [
+    'not a token',
+    base64.urlsafe_b64encode(b'1760778177503').decode(),
+    base64.urlsafe_b64encode(b'soon.%s' % str(ObjectId()).encode()).decode(),
+    base64.urlsafe_b64encode(b'1760778177503.not-an-object-id').decode(),
+    base64.urlsafe_b64encode(b'1760778177503.%s.extra' % str(ObjectId()).encode()).decode()
+])
+def test_malformed_page_tokens_are_rejected(client, auth_headers, token):
+    response = client.get('/api/meals/my-plans', query_string={'next': token}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'message': 'Invalid pagination token'}
+
+
+def test_a_token_edited_to_another_users_plan_only_returns_own_plans(app_module, app_context, client,
+                                                                     auth_headers):
+    own = insert_plans(app_module, user_id_of(app_module, auth_headers), [DAY - timedelta(days=1)])
+    other = insert_plans(app_module, str(ObjectId()), [DAY + timedelta(days=1), DAY])
+
+    # Tokens are not signed; a forged position still only filters the caller's plans
+    token = app_module.encode_page_token(DAY + timedelta(days=1), other[0])
+    body = client.get('/api/meals/my-plans', query_string={'next': token}, headers=auth_headers).get_json()
+    assert [plan['_id'] for plan in body['data']] == [str(own[0])]
+    assert body['next'] is None
+
+
+@pytest.mark.parametrize('limit', ['0', '101', 'ten'])
+def test_page_size_must_be_between_1_and_the_maximum(client, auth_headers, limit):
+    response = client.get('/api/meals/my-plans', query_string={'limit': limit}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'message': 'Limit must be between 1 and 100'}
+
+
+@pytest.mark.parametrize('storage', [{}, {'MEAL_PLAN_STORAGE': 'deduplicated', 'MEAL_FORMAT': 'reference'}])
+def test_ndjson_export_streams_the_same_plans_as_the_json_pages(app_module, storage):
+    application = app_module.create_app(dict({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off',
+                                              'EXPORT_BATCH_SIZE': 2}, **storage))
+    client = application.test_client()
+    response = client.post('/api/auth/register', json={
+        'name': 'Exporter', 'email': 'export-%s@example.com' % ObjectId(), 'password': 'secret1'
+    })
+    headers = {'x-auth-token': response.get_json()['token']}
+    for goal in ('maintenance', 'weight-loss', 'maintenance', 'muscle-gain', 'maintenance'):
+        assert client.post('/api/meals/generate', headers=headers, json={
+            'dietaryPreference': 'omnivore', 'nutritionalGoal': goal, 'numberOfMeals': 4, 'preferredCuisine': 'any'
+        }).status_code == 200
+
+    # Five plans read two per page, and exported two per cursor batch
+    paged = []
+    url = '/api/meals/my-plans?limit=2'
+    while url:
+        body = client.get(url, headers=headers).get_json()
+        paged.extend(body['data'])
+        url = body['next'] and '/api/meals/my-plans?limit=2&next=%s' % body['next']
+
+    response = client.get('/api/meals/my-plans?format=ndjson', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    data = response.get_data(as_text=True)
+    assert data.endswith('\n')
+    streamed = [json.loads(line) for line in data.splitlines()]
+    assert len(streamed) == 5
+    assert streamed == paged
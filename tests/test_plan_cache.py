@@ -0,0 +1,83 @@
+from bson import ObjectId
+
+PREFERENCES = dict(dietary_preference='omnivore', allergies=['nuts', 'dairy'], nutritional_goal='weight-loss',
+                   number_of_meals=8, preferred_cuisine='any')
+
+
+def test_plans_are_memoized_on_normalized_preferences(app_module, app_context):
+    state = app_module.resources()
+    first = app_module.generate_meal_plan(**PREFERENCES)
+    same = app_module.generate_meal_plan(**dict(PREFERENCES, dietary_preference='Omnivore',
+                                                allergies=['Dairy', 'nuts', 'nuts']))
+
+    assert same is first
+    assert state.plan_cache.stats()['hits'] == 1
+    assert state.plan_cache.stats()['misses'] == 1
+    assert app_module.generate_meal_plan(**dict(PREFERENCES, optimizer='search')) is not first
+    assert len(state.plan_cache) == 2
+
+
+def test_plans_above_max_sync_meals_are_not_memoized(app_module):
+    application = app_module.create_app({'MAX_SYNC_MEALS': 4})
+    with application.app_context():
+        state = app_module.resources()
+        first = app_module.generate_meal_plan(**PREFERENCES)
+        second = app_module.generate_meal_plan(**PREFERENCES)
+        assert second is not first
+        assert second == first
+        assert len(state.plan_cache) == 0
+
+        recent = app_module.plan_recipe_ids(first['meals'])
+        app_module.generate_meal_plan(recent=recent, **PREFERENCES)
+        assert len(state.ranking_cache) == 0
+
+
+def test_histories_share_one_ranking_and_bypass_the_plan_cache(app_module, app_context):
+    state = app_module.resources()
+    plan = app_module.compute_meal_plan(**PREFERENCES)
+    recent = app_module.plan_recipe_ids(plan['meals'])
+
+    first = app_module.generate_meal_plan(recent=recent, **PREFERENCES)
+    second = app_module.generate_meal_plan(recent=recent[:2], **PREFERENCES)
+    assert state.ranking_cache.stats()['misses'] == 1
+    assert state.ranking_cache.stats()['hits'] == 1
+    # Penalized plans are assembled per history and never stored as the plan for these preferences
+    assert state.plan_cache.stats()['hits'] == state.plan_cache.stats()['misses'] == 0
+    assert len(state.plan_cache) == 0
+    assert first == app_module.compute_meal_plan(recent=recent, **PREFERENCES)
+    assert second == app_module.compute_meal_plan(recent=recent[:2], **PREFERENCES)
+    assert first != plan
+
+
+def test_identical_plans_share_one_stored_body(app_module):
+    application = app_module.create_app({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off',
+                                         'MEAL_PLAN_STORAGE': 'deduplicated', 'VARIETY_HISTORY': 0})
+    client = application.test_client()
+    plans = []
+    for name in ('First', 'Second'):
+        response = client.post('/api/auth/register', json={
+            'name': name, 'email': '%s-%s@example.com' % (name.lower(), ObjectId()), 'password': 'secret1'
+        })
+        headers = {'x-auth-token': response.get_json()['token']}
+        for _ in range(2):
+            response = client.post('/api/meals/generate', headers=headers, json={
+                'dietaryPreference': 'omnivore', 'nutritionalGoal': 'maintenance', 'numberOfMeals': 4,
+                'preferredCuisine': 'any'
+            })
+            plans.append((headers, response.get_json()['data']))
+
+    with application.app_context():
+        db = app_module.get_db()
+        stored = list(db.meal_plans.find())
+        assert len(stored) == 4
+        assert len({plan['body'] for plan in stored}) == 1
+        assert db.plan_bodies.count_documents({}) == 1
+        assert 'meals' not in stored[0] and 'grocery_list' not in stored[0]
+        # Only the first plan wrote the body; the others found it in the body cache
+        assert app_module.resources().plan_body_cache.stats()['misses'] == 1
+
+    for headers, generated in plans:
+        read = client.get('/api/meals/%s' % generated['_id'], headers=headers).get_json()['data']
+        assert read['meals'] == generated['meals']
+        assert read['grocery_list'] == generated['grocery_list']
+        assert read['grocery_items'] == generated['grocery_items']
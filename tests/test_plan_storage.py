@@ -0,0 +1,56 @@
+import pytest
+
+from migrate_meal_plans import PENDING, migrate_collection
+from plan_storage import compact_meals, expand_meals, meal_position
+from recipe_catalog import load_catalog
+
+mongomock = pytest.importorskip('mongomock')
+
+# Meals as the first version of the app stored them: no recipe_id
+LEGACY_BREAKFAST = {
+    'name': 'Mediterranean Breakfast Bowl',
+    'description': 'Greek yogurt with honey, mixed berries, and almonds',
+    'ingredients': ['Greek yogurt', 'Honey', 'Mixed berries', 'Almonds'],
+    'prep_time': '10 minutes', 'calories': 320, 'protein': 18, 'carbs': 28, 'fat': 16,
+    'meal_type': 'breakfast'
+}
+UNKNOWN_DINNER = dict(LEGACY_BREAKFAST, name='Grandma Stew', meal_type='dinner')
+
+
+def test_legacy_meals_resolve_by_name_meal_type_and_ingredients():
+    catalog = load_catalog()
+    assert catalog.meal(meal_position(LEGACY_BREAKFAST, catalog))['recipe_id'] == 'med-breakfast-bowl'
+    assert meal_position(dict(LEGACY_BREAKFAST, meal_type='snack'), catalog) is None
+    assert meal_position(dict(LEGACY_BREAKFAST, ingredients=['Greek yogurt', 'Honey']), catalog) is None
+    assert meal_position(UNKNOWN_DINNER, catalog) is None
+
+
+def test_compact_legacy_meal_round_trips():
+    catalog = load_catalog()
+    compact = compact_meals([LEGACY_BREAKFAST, UNKNOWN_DINNER], catalog)
+    assert compact[0]['recipe_id'] == 'med-breakfast-bowl'
+    assert compact[1] is UNKNOWN_DINNER
+    expanded = expand_meals(compact, catalog)[0]
+    assert {k: expanded[k] for k in LEGACY_BREAKFAST} == LEGACY_BREAKFAST
+
+
+def test_migration_converts_legacy_meals_and_reports_the_rest():
+    collection = mongomock.MongoClient().db.meal_plans
+    collection.insert_many([{'meals': [LEGACY_BREAKFAST]}, {'meals': [LEGACY_BREAKFAST, UNKNOWN_DINNER]}])
+
+    documents, updated, _, _, unconverted = migrate_collection(collection, 'reference', load_catalog(), 10, False)
+    assert (documents, updated) == (2, 2)
+    assert unconverted == {'Grandma Stew': 1}
+    assert collection.count_documents(PENDING['reference']) == 1
+
+
+def test_migration_bumps_rev_of_converted_plans_and_plans_sharing_a_body():
+    db = mongomock.MongoClient().db
+    db.meal_plans.insert_many([{'meals': [LEGACY_BREAKFAST], 'rev': 2}, {'meals': [UNKNOWN_DINNER]},
+                               {'body': 'shared'}, {'body': 'other'}])
+    db.plan_bodies.insert_many([{'_id': 'shared', 'meals': [LEGACY_BREAKFAST]}, {'_id': 'other', 'meals': []}])
+
+    migrate_collection(db.meal_plans, 'reference', load_catalog(), 10, False)
+    migrate_collection(db.plan_bodies, 'reference', load_catalog(), 10, False, plans=db.meal_plans)
+    revs = [(plan.get('body'), plan.get('rev')) for plan in db.meal_plans.find({}, {'_id': 0, 'body': 1, 'rev': 1})]
+    assert revs == [(None, 3), (None, None), ('shared', 1), ('other', None)]
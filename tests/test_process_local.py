@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from process_local import ProcessLocal
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork()')
+def test_a_forked_child_builds_its_own_value():
+    local = ProcessLocal(lambda: os.getpid())
+    assert not local.started()
+    assert local.get() == os.getpid()
+    assert local.started()
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        ok = not local.started() and local.get() == os.getpid() and local.started()
+        os.write(write, b'1' if ok else b'0')
+        os._exit(0)
+    os.close(write)
+    try:
+        assert os.read(read, 1) == b'1'
+    finally:
+        os.close(read)
+        os.waitpid(pid, 0)
+    assert local.get() == os.getpid()
@@ -0,0 +1,78 @@
+import pytest
+
+from rate_limit import MemoryTokenBuckets, RateLimiter, SharedTokenBuckets, key_hash, parse_limit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture(params=['shared', 'memory'])
+def buckets(request, tmp_path, clock):
+    if request.param == 'shared':
+        return SharedTokenBuckets(str(tmp_path / 'buckets'), slots=64, clock=clock)
+    return MemoryTokenBuckets(clock=clock)
+
+
+def test_bucket_refills_over_time_and_reports_retry_after(buckets, clock):
+    capacity, period = parse_limit('2 per minute')
+    assert buckets.hit('a', capacity, period) == (True, 0.0)
+    assert buckets.hit('a', capacity, period) == (True, 0.0)
+    allowed, retry_after = buckets.hit('a', capacity, period)
+    assert not allowed
+    assert retry_after == pytest.approx(30.0)
+
+    clock.now += 15
+    allowed, retry_after = buckets.hit('a', capacity, period)
+    assert not allowed
+    assert retry_after == pytest.approx(15.0)
+    clock.now += 15
+    assert buckets.hit('a', capacity, period)[0]
+
+
+def test_limiter_keeps_a_bucket_per_route_and_client(buckets):
+    limiter = RateLimiter(buckets, '1 per hour', limits={'/login': '2 per hour'}, exempt=('/metrics',))
+    assert limiter.check('/a', '10.0.0.1') is None
+    assert limiter.check('/a', '10.0.0.1') == pytest.approx(3600.0)
+    assert limiter.check('/b', '10.0.0.1') is None
+    assert limiter.check('/a', '10.0.0.2') is None
+    assert limiter.check('/login', '10.0.0.1') is None
+    assert limiter.check('/login', '10.0.0.1') is None
+    assert limiter.check('/login', '10.0.0.1') is not None
+    assert all(limiter.check('/metrics', '10.0.0.1') is None for _ in range(5))
+
+
+def test_full_group_reuses_the_least_recently_updated_slot(tmp_path, clock):
+    # One group of 8 slots: a ninth key evicts the oldest, which then starts full again
+    buckets = SharedTokenBuckets(str(tmp_path / 'buckets'), slots=8, clock=clock)
+    assert buckets.groups == 1
+    keys = ['key-%d' % i for i in range(9)]
+    for key in keys[:8]:
+        assert buckets.hit(key, 1, 3600)[0]
+        clock.now += 1
+    assert not buckets.hit(keys[1], 1, 3600)[0]
+
+    assert buckets.hit(keys[8], 1, 3600)[0]
+    hashes = {int.from_bytes(buckets._map[offset:offset + 8], 'little') for offset in range(0, 8 * 24, 24)}
+    assert key_hash(keys[0]) not in hashes
+    assert buckets.hit(keys[0], 1, 3600)[0]
+
+
+def test_handles_on_the_same_file_share_buckets(tmp_path, clock):
+    path = str(tmp_path / 'buckets')
+    first = SharedTokenBuckets(path, slots=64, clock=clock)
+    second = SharedTokenBuckets(path, slots=64, clock=clock)
+    assert first.hit('client', 1, 60)[0]
+    assert not second.hit('client', 1, 60)[0]
+
+    second.clear()
+    assert first.hit('client', 1, 60)[0]
@@ -0,0 +1,108 @@
+import pytest
+
+from meal_optimizer import NoCandidatesError, optimize_plan
+from recipe_catalog import DIET_TAGS, MEAL_TYPES, RecipeCatalog, expand_diets, ingredient_allergens, load_catalog
+
+
+def recipe(recipe_id, meal_type='dinner', ingredients=('Rice',), diets=(), **fields):
+    return dict({
+        'id': recipe_id, 'name': recipe_id, 'ingredients': list(ingredients), 'meal_type': meal_type,
+        'cuisine': 'any', 'diets': list(diets), 'goals': ['maintenance'],
+        'calories': 500, 'protein': 30, 'carbs': 50, 'fat': 20
+    }, **fields)
+
+
+def matching(catalog, diet=None, allergies=(), meal_type='dinner'):
+    positions = catalog.candidates(meal_type, 'any', 'maintenance', catalog.compile_filter(diet, list(allergies)))
+    return sorted(catalog.meal(int(position))['recipe_id'] for position in positions)
+
+
+def test_bundled_catalog_covers_every_diet_and_meal_type():
+    assert load_catalog().coverage_gaps() == []
+
+
+def test_bundled_catalog_has_pescatarian_snacks_and_breakfasts():
+    catalog = load_catalog()
+    for meal_type in MEAL_TYPES:
+        assert len(matching(catalog, 'pescatarian', meal_type=meal_type)) > 1
+
+
+def test_diets_are_nested():
+    assert expand_diets(['Vegan']) == {'vegan', 'vegetarian', 'pescatarian'}
+    assert expand_diets(['vegetarian']) == {'vegetarian', 'pescatarian'}
+    assert expand_diets(['keto']) == {'keto'}
+
+    catalog = RecipeCatalog([
+        recipe('tofu', ingredients=['Tofu'], diets=['vegan']),
+        recipe('omelette', ingredients=['Eggs'], diets=['vegetarian']),
+        recipe('salmon', ingredients=['Salmon'], diets=['pescatarian']),
+        recipe('steak', ingredients=['Beef'])
+    ])
+    assert matching(catalog, 'vegan') == ['tofu']
+    assert matching(catalog, 'vegetarian') == ['omelette', 'tofu']
+    assert matching(catalog, 'pescatarian') == ['omelette', 'salmon', 'tofu']
+    assert matching(catalog, 'any') == ['omelette', 'salmon', 'steak', 'tofu']
+
+
+def test_coverage_gaps_lists_missing_meal_types():
+    catalog = RecipeCatalog([recipe('tofu', diets=['vegan', 'keto', 'gluten-free'])])
+    gaps = catalog.coverage_gaps()
+    assert ('vegan', 'dinner') not in gaps
+    assert ('vegan', 'lunch') in gaps
+    assert len(gaps) == len(DIET_TAGS) * 3
+
+
+def test_allergy_filters():
+    catalog = RecipeCatalog([
+        recipe('pesto', ingredients=['Pasta', 'Pine nuts', 'Basil']),
+        recipe('satay', ingredients=['Chicken', 'Peanut butter']),
+        recipe('stir-fry', ingredients=['Tofu', 'Soy sauce', 'Rice']),
+        recipe('salad', ingredients=['Tomatoes', 'Cucumber']),
+        recipe('curry', ingredients=['Chickpeas', 'Coconut milk'], allergens=['mustard'])
+    ])
+    assert matching(catalog, allergies=['nuts']) == ['curry', 'salad', 'stir-fry']
+    assert matching(catalog, allergies=['tree nuts']) == ['curry', 'salad', 'satay', 'stir-fry']
+    assert matching(catalog, allergies=['Gluten']) == ['curry', 'salad', 'satay']
+    assert matching(catalog, allergies=['soya']) == ['curry', 'pesto', 'salad', 'satay']
+    assert matching(catalog, allergies=['mustard']) == ['pesto', 'salad', 'satay', 'stir-fry']
+    # Unknown allergies exclude recipes with an ingredient of that name
+    assert matching(catalog, allergies=['Cucumbers']) == ['curry', 'pesto', 'satay', 'stir-fry']
+
+
+def test_ingredient_allergens_overrides_and_keywords():
+    assert ingredient_allergens('Coconut milk') == ()
+    assert ingredient_allergens('Soy sauce') == ('soy', 'gluten')
+    assert ingredient_allergens('Greek yogurt') == ('dairy',)
+    assert set(ingredient_allergens('Almond butter')) == {'nuts', 'dairy'}
+
+
+def test_cuisine_then_goal_are_relaxed_but_diet_is_not():
+    catalog = RecipeCatalog([
+        recipe('thai-cut', cuisine='thai', goals=['weight-loss']),
+        recipe('thai-any', cuisine='thai', goals=['maintenance']),
+        recipe('plain-cut', goals=['weight-loss'], diets=['vegan'])
+    ])
+
+    def ids(cuisine, goal, diet=None):
+        positions = catalog.candidates('dinner', cuisine, goal, catalog.compile_filter(diet, []))
+        return sorted(catalog.meal(int(position))['recipe_id'] for position in positions)
+
+    assert ids('Thai', 'weight-loss') == ['thai-cut']
+    # No French recipes: any cuisine with the goal comes before the cuisine without it
+    assert ids('french', 'weight-loss') == ['plain-cut', 'thai-cut']
+    assert ids('thai', 'muscle-gain') == ['thai-any', 'thai-cut']
+    assert ids('thai', 'weight-loss', 'vegan') == ['plain-cut']
+    assert ids('thai', 'weight-loss', 'keto') == []
+
+
+def test_empty_pool_for_a_needed_meal_type_raises():
+    catalog = RecipeCatalog([recipe('tofu-%s' % meal_type, meal_type=meal_type, diets=['vegan'])
+                             for meal_type in MEAL_TYPES[:3]] + [recipe('jerky', meal_type='snack')])
+    recipe_filter = catalog.compile_filter('vegan', [])
+    candidates = {meal_type: catalog.candidates(meal_type, 'any', 'maintenance', recipe_filter)
+                  for meal_type in MEAL_TYPES}
+    assert catalog.coverage_gaps().count(('vegan', 'snack')) == 1
+
+    assert len(optimize_plan(catalog.macros, candidates, 3, 'maintenance')) == 3
+    with pytest.raises(NoCandidatesError, match='snack'):
+        optimize_plan(catalog.macros, candidates, 4, 'maintenance')
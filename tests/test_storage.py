@@ -0,0 +1,107 @@
+import logging
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+from storage import INDEXES, QueryPlanChecker, ensure_indexes, plan_stages, query_shape, winning_plans
+
+mongomock = pytest.importorskip('mongomock')
+
+COLLSCAN = {'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}
+IXSCAN = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+
+
+def index_keys(name):
+    return {index.document['name']: list(index.document['key'].items()) for index in INDEXES[name]}
+
+
+def test_ensure_indexes_creates_every_index():
+    db = mongomock.MongoClient().mealprep
+    ensure_indexes(db)
+    for name, indexes in INDEXES.items():
+        info = db[name].index_information()
+        for index in indexes:
+            document = index.document
+            assert list(info[document['name']]['key']) == list(document['key'].items())
+            assert info[document['name']].get('unique', False) == document.get('unique', False)
+
+
+def test_an_index_that_cannot_be_built_is_logged_and_the_rest_are_created(caplog):
+    db = mongomock.MongoClient().mealprep
+    db.users.insert_many([{'email': 'twice@example.com'}, {'email': 'twice@example.com'}])
+    with caplog.at_level(logging.ERROR, logger='storage'):
+        ensure_indexes(db)
+    assert 'Could not create indexes on users' in caplog.text
+    assert 'user_date' in db.meal_plans.index_information()
+
+
+def test_meal_plan_reads_filter_and_sort_on_the_user_date_index_prefix():
+    # Equality on user, then the my-plans sort; stats and grocery lists add a range on date
+    assert index_keys('meal_plans')['user_date'] == [('user', 1), ('date', -1), ('_id', -1)]
+    assert index_keys('users')['email_unique'] == [('email', 1)]
+    assert index_keys('meal_plan_jobs')['slot_unique'] == [('slot', 1)]
+    ttl = [index.document for index in INDEXES['meal_plan_jobs'] if index.document['name'] == 'created_ttl'][0]
+    assert ttl['expireAfterSeconds'] > 0
+
+
+def test_query_shape_keeps_fields_and_operators_only():
+    assert query_shape({'user': 'abc', 'date': {'$gte': 1, '$lt': 2}, '$or': [{'a': 1}, {'b': 2}]}) == \
+        {'user': None, 'date': {'$gte': None, '$lt': None}, '$or': [{'a': None}]}
+    assert query_shape([]) == []
+    assert query_shape('value') is None
+
+
+def test_winning_plans_and_their_stages_are_found_in_nested_explains():
+    aggregate = {'stages': [{'$cursor': IXSCAN}, {'$lookup': {}}], 'shards': {'a': COLLSCAN}}
+    plans = winning_plans(aggregate)
+    assert sorted(stage for plan in plans for stage in plan_stages(plan)) == ['COLLSCAN', 'FETCH', 'IXSCAN', 'SORT']
+    merged = {'stage': 'OR', 'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'FETCH', 'inputStage': None}]}
+    assert sorted(plan_stages(merged)) == ['FETCH', 'IXSCAN', 'OR']
+
+
+class ExplainingClient:
+    """Answers explain commands with a canned plan per collection"""
+
+    def __init__(self, plans):
+        self.plans = plans
+        self.explained = queue.Queue()
+
+    def __getitem__(self, database):
+        return SimpleNamespace(command=lambda command, **kwargs: self.explain(database, command))
+
+    def explain(self, database, command):
+        explained = command['explain']
+        self.explained.put((database, explained))
+        name = next(iter(explained))
+        return self.plans[explained[name]]
+
+
+def command_started(name, command, database='mealprep'):
+    return SimpleNamespace(command_name=name, command=dict(command, lsid={'id': 1}, **{'$db': database}),
+                           database_name=database)
+
+
+def test_queries_of_each_shape_are_explained_once_and_scans_are_logged(caplog):
+    client = ExplainingClient({'users': IXSCAN, 'meal_plans': COLLSCAN})
+    checker = QueryPlanChecker()
+    with caplog.at_level(logging.WARNING, logger='storage'):
+        # Ignored until a client is attached
+        checker.started(command_started('find', {'find': 'users', 'filter': {'email': 'a@example.com'}}))
+        checker.attach(client)
+        checker.started(command_started('find', {'find': 'users', 'filter': {'email': 'a@example.com'}}))
+        checker.started(command_started('find', {'find': 'users', 'filter': {'email': 'b@example.com'}}))
+        checker.started(command_started('insert', {'insert': 'users', 'documents': [{}]}))
+        checker.started(command_started('update', {'update': 'users', 'updates': [{'q': {}}, {'q': {}}]}))
+        checker.started(command_started('find', {'find': 'meal_plans', 'filter': {'name': 'x'},
+                                                 'sort': {'date': -1}}))
+        # Commands are explained in order, so once this one is, the scan above has been logged
+        checker.started(command_started('find', {'find': 'users', 'filter': {'_id': 1}}))
+        explained = [client.explained.get(timeout=5) for _ in range(3)]
+
+    assert client.explained.empty()
+    assert [database for database, command in explained] == ['mealprep'] * 3
+    assert explained[0][1] == {'find': 'users', 'filter': {'email': 'a@example.com'}}
+    assert [record.getMessage() for record in caplog.records] == [
+        'Query not covered by an index (SORT > COLLSCAN): %s' % explained[1][1]
+    ]
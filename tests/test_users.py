@@ -0,0 +1,33 @@
+from bson import ObjectId
+from werkzeug.security import generate_password_hash
+
+
+def register(client, email):
+    response = client.post('/api/auth/register', json={'name': 'User', 'email': email, 'password': 'secret1'})
+    return {'x-auth-token': response.get_json()['token']}
+
+
+def test_profile_update_to_a_taken_email_is_rejected(client):
+    taken = 'taken-%s@example.com' % ObjectId()
+    register(client, taken)
+    headers = register(client, 'other-%s@example.com' % ObjectId())
+
+    response = client.put('/api/users/profile', json={'name': 'Other', 'email': taken}, headers=headers)
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'message': 'User already exists'}
+
+
+def test_login_upgrades_a_hash_made_with_an_older_method(app_module, app_context, client):
+    email = 'legacy-%s@example.com' % ObjectId()
+    register(client, email)
+    users = app_module.get_db().users
+    legacy = generate_password_hash('secret1', method='pbkdf2:sha256:500')
+    users.update_one({'email': email}, {'$set': {'password': legacy}})
+
+    response = client.post('/api/auth/login', json={'email': email, 'password': 'secret1'})
+    assert response.status_code == 200
+    upgraded = users.find_one({'email': email})['password']
+    assert app_module.needs_rehash(legacy)
+    assert upgraded != legacy and not app_module.needs_rehash(upgraded)
+    assert client.post('/api/auth/login', json={'email': email, 'password': 'secret1'}).status_code == 200
+    assert users.find_one({'email': email})['password'] == upgraded
@@ -0,0 +1,28 @@
+import numpy as np
+
+from meal_optimizer import rank_candidates
+from recipe_catalog import load_catalog
+from variety import variety_penalty
+
+
+def test_penalty_matches_band_overlap_with_recent_recipes():
+    keys = load_catalog().band_keys
+    recent = [3, 7, 3]
+    penalty = variety_penalty(keys, recent, 1.0, 0.5)
+    positions = np.arange(len(keys))
+
+    expected = 0.5 * np.array([np.isin(keys[i], keys[[3, 7]]).mean() for i in positions])
+    expected[[3, 7]] += 1.0
+    assert np.allclose(penalty(positions), expected)
+    assert variety_penalty(keys, [], 1.0, 0.5) is None
+
+
+def test_ranking_steers_away_from_recent_recipes():
+    catalog = load_catalog()
+    candidates = catalog.candidates('dinner', 'any', 'maintenance')
+    best = rank_candidates(catalog.macros, candidates, 'dinner', 'maintenance', 3)
+    penalty = variety_penalty(catalog.band_keys, best, 1.0, 0.5)
+
+    varied = rank_candidates(catalog.macros, candidates, 'dinner', 'maintenance', 3, penalty)
+    assert len(varied) == 3
+    assert not set(varied) & set(best)
@@ -0,0 +1,135 @@
+import logging
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+from bson import ObjectId
+import pytest
+
+from write_behind import WriteBehindQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Recorder:
+    """Stands in for a collection; records each write's batch, held back until released"""
+
+    name = 'recorder'
+
+    def __init__(self, fail_first=False):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail_first = fail_first
+
+    def write(self, collection, batch):
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append(list(batch))
+        if self.fail_first and len(self.batches) == 1:
+            raise RuntimeError('connection reset')
+
+
+def test_items_queued_behind_a_slow_write_are_batched_in_order():
+    recorder = Recorder()
+    writer = WriteBehindQueue(recorder, batch_size=3, write=recorder.write)
+    for item in range(7):
+        assert writer.submit(item)
+    recorder.release.set()
+    writer.flush()
+
+    assert [item for batch in recorder.batches for item in batch] == list(range(7))
+    assert max(len(batch) for batch in recorder.batches) == 3
+    # Everything after the batch in progress waited, so it was written in full batches
+    assert len(recorder.batches[1]) == 3
+    assert len(writer) == 0
+
+
+def test_a_failed_write_is_logged_and_later_items_are_still_written(caplog):
+    recorder = Recorder(fail_first=True)
+    writer = WriteBehindQueue(recorder, batch_size=2, write=recorder.write)
+    with caplog.at_level(logging.ERROR, logger='write_behind'):
+        for item in range(5):
+            writer.submit(item)
+        recorder.release.set()
+        writer.flush()
+
+    assert [item for batch in recorder.batches for item in batch] == list(range(5))
+    assert 'Write-behind write of %d items to recorder failed' % len(recorder.batches[0]) in caplog.text
+
+
+def test_a_full_queue_refuses_items_and_save_falls_back_to_a_direct_insert(app_module, app_context, monkeypatch):
+    recorder = Recorder()
+    writer = WriteBehindQueue(recorder, maxsize=1, write=recorder.write)
+    writer.submit('in progress')
+    recorder.started.wait(5)
+    assert writer.submit('queued')
+    assert not writer.submit('refused')
+
+    monkeypatch.setattr(app_module, 'get_write_behind', lambda: writer)
+    plan = app_module.build_meal_plan_doc(str(ObjectId()), app_module.parse_meal_plan_request({
+        'dietaryPreference': 'omnivore', 'nutritionalGoal': 'maintenance', 'numberOfMeals': 2,
+        'preferredCuisine': 'any'
+    })[0])
+    app_module.save_meal_plan(plan)
+    assert app_module.get_db().meal_plans.find_one({'_id': plan['_id']}) is not None
+    recorder.release.set()
+    writer.flush()
+    assert recorder.batches == [['in progress'], ['queued']]
+
+
+def test_write_behind_mode_queues_generated_plans_until_flushed(app_module):
+    application = app_module.create_app({'TESTING': True, 'RATE_LIMIT_STORAGE': 'off',
+                                         'MEAL_PLAN_WRITE_MODE': 'write-behind'})
+    client = application.test_client()
+    response = client.post('/api/auth/register', json={
+        'name': 'Writer', 'email': 'writer-%s@example.com' % ObjectId(), 'password': 'secret1'
+    })
+    headers = {'x-auth-token': response.get_json()['token']}
+    for _ in range(3):
+        assert client.post('/api/meals/generate', headers=headers, json={
+            'dietaryPreference': 'omnivore', 'nutritionalGoal': 'maintenance', 'numberOfMeals': 2,
+            'preferredCuisine': 'any'
+        }).status_code == 200
+
+    app_module.flush_write_behind()
+    with application.app_context():
+        assert app_module.get_write_behind() is not None
+        assert app_module.get_db().meal_plans.count_documents({}) == 3
+
+
+def test_queued_plans_are_written_at_interpreter_exit():
+    pytest.importorskip('mongomock')
+    script = textwrap.dedent('''
+        import sys, time
+        sys.path.insert(0, %r)
+        import mongomock, pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+        import app
+
+        class SlowCollection:
+            name = 'meal_plans'
+
+            def insert_many(self, docs, ordered=True):
+                time.sleep(0.2)
+                print('wrote', len(docs), flush=True)
+
+        state = app.create_app({'MEAL_PLAN_WRITE_MODE': 'write-behind'}).extensions['mealprep']
+        state.meal_plans_writer = SlowCollection
+        for _ in range(3):
+            state.write_behind().submit({})
+    ''' % ROOT)
+    env = dict(os.environ, RATE_LIMIT_STORAGE='off')
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=60, env=env)
+    assert result.returncode == 0, result.stderr
+    assert sum(int(line.split()[1]) for line in result.stdout.splitlines()) == 3
+
+
+@pytest.mark.parametrize('setting, w', [('1', 1), ('majority', 'majority'), ('0', 0)])
+def test_meal_plan_writes_use_the_configured_write_concern(app_module, setting, w):
+    application = app_module.create_app({'MEAL_PLAN_WRITE_CONCERN': setting})
+    state = application.extensions['mealprep']
+    assert state.meal_plan_write_concern.document == {'w': w}
+    assert state.meal_plans_writer().write_concern == state.meal_plan_write_concern
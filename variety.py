@@ -0,0 +1,92 @@
+"""
+Meal variety for the Python Meal Prep Application
+Each recipe's ingredient set gets a MinHash signature when the catalog loads;
+the signature is cut into LSH bands so that recipes with similar ingredients
+share band keys.  A generation request penalizes the recipes a user ate
+recently and any candidate sharing bands with them.  Penalties are only
+computed for the short list of best-ranked candidates, at a fixed cost per
+candidate regardless of catalog size, and without reading old meal plans.
+"""
+
+import zlib
+
+import numpy as np
+
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 16
+
+# Mersenne prime for the universal hash family h(x) = (a * x + b) mod p
+_PRIME = np.uint64((1 << 31) - 1)
+
+
+def minhash_signatures(ingredient_sets, permutations=MINHASH_PERMUTATIONS, seed=1):
+    """Return a (recipes x permutations) uint32 MinHash signature matrix"""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, int(_PRIME), size=permutations).astype(np.uint64)
+    b = rng.randint(0, int(_PRIME), size=permutations).astype(np.uint64)
+
+    signatures = np.full((len(ingredient_sets), permutations), int(_PRIME), dtype=np.uint32)
+    for row, ingredients in enumerate(ingredient_sets):
+        if not ingredients:
+            continue
+        values = np.array([zlib.crc32(i.lower().encode()) for i in set(ingredients)], dtype=np.uint64) % _PRIME
+        hashed = (values[:, None] * a + b) % _PRIME
+        signatures[row] = hashed.min(axis=0)
+    return signatures
+
+
+def band_keys(signatures, bands=MINHASH_BANDS):
+    """Hash each band of rows into one uint64 key, distinct per band index
+
+    Two recipes share a key in band i iff their signatures agree on every
+    row of that band, which is likely when their ingredient sets overlap.
+    """
+    rows = signatures.shape[1] // bands
+    keys = np.zeros((signatures.shape[0], bands), dtype=np.uint64)
+    for band in range(bands):
+        key = np.full(signatures.shape[0], band + 1, dtype=np.uint64)
+        for column in signatures[:, band * rows:(band + 1) * rows].T:
+            key = key * np.uint64(1000003) ^ column.astype(np.uint64)
+        keys[:, band] = key
+    return keys
+
+
+class VarietyPenalty:
+    """Score penalty for a user's recent recipes and recipes similar to them
+
+    Recent recipes get `recent_weight`; any other position gets
+    `similar_weight` times the share of its band keys found among the
+    recent recipes.  The recent positions and their band keys are sorted
+    once, so penalizing n positions costs O(n log history) whatever the
+    size of the catalog.
+    """
+
+    def __init__(self, keys, recent, recent_weight, similar_weight):
+        self.keys = keys
+        self.recent = np.unique(np.asarray(recent, dtype=np.intp))
+        self.recent_keys = np.unique(keys[self.recent])
+        self.recent_weight = recent_weight
+        self.similar_weight = similar_weight
+
+    def __call__(self, positions):
+        """Penalty of each catalog position in `positions`"""
+        positions = np.asarray(positions, dtype=np.intp)
+        penalty = self.similar_weight * _contains(self.recent_keys, self.keys[positions]).mean(axis=1)
+        penalty[_contains(self.recent, positions)] += self.recent_weight
+        return penalty
+
+
+def _contains(sorted_values, values):
+    """Elementwise membership of `values` in the sorted unique array `sorted_values`"""
+    index = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[index] == values
+
+
+def variety_penalty(keys, recent, recent_weight, similar_weight):
+    """VarietyPenalty for the positions of recently eaten recipes, or None when there are none
+
+    `keys` is the catalog's band key matrix.
+    """
+    if not len(recent):
+        return None
+    return VarietyPenalty(keys, recent, recent_weight, similar_weight)
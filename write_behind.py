@@ -0,0 +1,79 @@
+"""
+Write-behind queue for the Python Meal Prep Application
+Accepts documents on the request thread and writes them to MongoDB in
+batches from a background thread.
+"""
+
+import logging
+import queue
+import threading
+
+from process_local import ProcessLocal
+
+logger = logging.getLogger(__name__)
+
+
+def insert_batch(collection, docs):
+    collection.insert_many(docs, ordered=False)
+
+
+class WriteBehindQueue:
+    """Bounded queue drained into `collection` by a daemon thread
+
+    submit() never blocks: when the queue is full it returns False and the
+    caller is expected to write synchronously instead.  The thread is per
+    process and starts on the first submit().  Batches are inserted as
+    documents unless `write(collection, batch)` is given.
+    """
+
+    def __init__(self, collection, maxsize=10000, batch_size=100, poll_interval=0.05, write=None,
+                 name='meal-plan-writer'):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.write = write or insert_batch
+        self.name = name
+        self._queue = queue.Queue(maxsize)
+        self._thread = ProcessLocal(self._start)
+
+    def submit(self, doc):
+        """Queue `doc` for writing; returns False if the queue is full"""
+        self._thread.get()
+        try:
+            self._queue.put_nowait(doc)
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self):
+        """Block until every queued document has been written (or dropped)"""
+        if self._thread.started():
+            self._queue.join()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def _start(self):
+        thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.poll_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.write(self.collection, batch)
+            except Exception:
+                logger.exception('Write-behind write of %d items to %s failed', len(batch), self.collection.name)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()